@@ -4,82 +4,268 @@ build_production_models.py
 これまでの検証で確定した「高自信レースのみ・3車ボックス」戦略を実運用するための
 本番用モデル一式を、全期間の履歴データから作成して保存するスクリプト。
 
-作られるファイル(models/ フォルダに保存):
-  - stage1_model.pkl        : 個人(3着以内)予測モデル
-  - stage2_model.pkl        : ライン力(win_line)予測モデル
-  - category_maps.pkl       : カテゴリ特徴量の 文字列 -> コード 変換辞書(学習時と同じ変換をするため必須)
-  - confidence_threshold.pkl: 「高自信」判定のしきい値(過去データの上位1/3分位点)
-  - feature_config.pkl      : 特徴量リストなどの設定一式
-
-日次予測は daily_predict.py 側でこれらを読み込んで使用する。
+作られるファイル(models/versions/{バージョン}/ に保存。src/model_registry.py 参照):
+  - bundle.kbundle          : 次の5つを1ファイルにまとめたもの(src/model_bundle.py)
+      stage1_model        : 個人(3着以内)予測モデル
+      stage2_model        : ライン力(win_line)予測モデル
+      category_maps       : カテゴリ特徴量の 文字列 -> コード 変換辞書(学習時と同じ変換をするため必須)
+      confidence_threshold: 「高自信」判定のしきい値(過去データの上位1/3分位点)
+      feature_config      : 特徴量リストなどの設定一式
+  - validation_report.json  : 直近の検証期間での指標
+  - manifest.json           : 学習データの期間・検証指標・特徴量設定のハッシュなど
+
+全部そろったところでバージョンを確定し、models/CURRENT をそのバージョンに切り替える(--no-promote なら切り替えない)。
+日次予測は daily_predict.py 側で CURRENT のモデル一式を読み込んで使用する。
+
+    python build_production_models.py [--jobs N] [--no-promote]
+    python build_production_models.py --incremental [--tail-months 3] [--blend 0.3] [--no-promote]
+
+--incremental は全期間を学習し直さず、直近 --tail-months か月だけで Stage1 / Stage2 を学習し、
+CURRENT の全期間モデルと --blend の重みで混ぜる(src/model_blend.py)。カテゴリ変換表と特徴量の設定は
+全期間モデルのものをそのまま使う。結果確定後に毎日・毎週回す想定(kekka.bat の最後で、src/settle_races.py で
+当日のレースを data/history に入れてから実行)。直近の過去データが前回の差分更新から変わっていなければ何もしない。
+CURRENT に切り替えるのは、検証で混ぜたモデルの logloss が全期間モデルだけ以下だったときだけ。
+
+どちらのモードでも、直近 VALID_DAYS 日のレースでの logloss / AUC を validation_report.json に書く。
+全期間の学習では OOF 予測で測る。差分更新では、元にした全期間モデルの学習データ(manifest の data_range)より
+後の日だけを検証に使い、その期間を除いて学習した tail を混ぜた予測で測る(そういう日が無ければ検証は飛ばし、
+レポートに skipped と書く)。Stage2 の学習・自信度しきい値に使う個人・ラインの予測も、全期間モデルが
+学習した日は tail の OOF 予測だけを使い、学習データへの当てはめの値が入らないようにする。
+
+Stage1 / Stage2 とも、全データでの学習と GroupKFold 5分割の学習(計6回)は互いに独立なので、
+--jobs のプロセス数で並列に回す(特徴量行列は joblib が memmap で共有する)。
 """
 import pandas as pd
 import numpy as np
-import joblib
+import argparse
 import os
+import sys
+from joblib import Parallel, delayed
 from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.metrics import log_loss, roc_auc_score
 from sklearn.model_selection import GroupKFold
 
 # スクリプト自身の場所を基準にパスを組み立てる(どのフォルダから実行しても動くようにするため)
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 OUT_DIR = os.path.join(SCRIPT_DIR, 'models')
-os.makedirs(OUT_DIR, exist_ok=True)
+
+# 特徴量づくりは daily_predict.py と共通(src/feature_builder.py)
+sys.path.insert(0, os.path.join(SCRIPT_DIR, 'src'))
+from feature_builder import (  # noqa: E402
+    CATEGORICAL_FEATS, LINE_FEATURE_COLS, NUMERIC_FEATS, RACE_INFO_COLS,
+    add_line_predictions, apply_category_maps, build_category_maps, cache_key, line_features, load_or_build,
+    rider_features,
+)
+from dtype_plan import compact  # noqa: E402
+from history_store import HistoryStore  # noqa: E402
+from model_blend import BlendedClassifier, unwrap  # noqa: E402
+from model_registry import ModelRegistry, config_hash  # noqa: E402
 
 # このスクリプトと同じフォルダに、前回お渡しした修正版(race_id保持版・CSV形式)を置いてください
 # ※pickle形式はpandasのバージョン間で互換性が壊れることがあるため、CSV(gzip圧縮)形式に変更しました
 CARD_PATH = os.path.join(SCRIPT_DIR, 'race_card3_202106-202606_FIXED.csv.gz')
 INFO_PATH = os.path.join(SCRIPT_DIR, 'race_info2_202106-202606_FIXED.csv.gz')
+# 開催年月ごとの Parquet(src/history_store.py)。5_combine_data.py などで取り込み済みなら、上の csv.gz ではなくこちらを読む
+HISTORY_DIR = os.path.join(SCRIPT_DIR, 'data', 'history')
+# 学習に使う期間(保存されている最後の月から数えた月数)。None なら全期間
+TRAIN_MONTHS = None
+# 保存先から読む列(学習に使う列だけ)
+CARD_COLS = [c for c in NUMERIC_FEATS if c != 'ライン人数'] + ['脚 質', '級 班', '強度', 'ライン', '車 番', '着 順']
+INFO_COLS = RACE_INFO_COLS + ['開催日']
+# 入力ファイルが前回と同じなら、特徴量はここに保存したものを使う
+FEATURE_CACHE_DIR = os.path.join(SCRIPT_DIR, 'data', 'feature_cache')
+
+STAGE1_PARAMS = dict(max_iter=150, learning_rate=0.08, max_depth=6, random_state=42)
+STAGE2_PARAMS = dict(max_iter=150, learning_rate=0.08, max_depth=5, random_state=42)
+N_SPLITS = 5
+
+# 差分更新: 学習し直す直近の月数と、全期間モデルに混ぜる重み
+TAIL_MONTHS = 3
+BLEND_WEIGHT = 0.3
+# 検証に使う直近の日数
+VALID_DAYS = 14
+
+
+def history_source(months=TRAIN_MONTHS):
+    """(保存先, 読み始める日, キャッシュのキーにするファイル) を返す。保存先が空なら csv.gz を読む(保存先は None)。"""
+    store = HistoryStore(HISTORY_DIR)
+    if not (store.months('card') and store.months('info')):
+        return None, None, [CARD_PATH, INFO_PATH]
+    start = store.last_months_start('card', months) if months else None
+    return store, start, store.paths('card', start) + store.paths('info', start)
+
+
+def build_training_features(store=None, start=None):
+    """学習用の選手単位・ライン単位の特徴量(カテゴリのコード化と Stage1 予測の前まで)を作る。"""
+    print('データ読み込み中...')
+    if store is not None:
+        card = store.read('card', columns=CARD_COLS, start=start)
+        info = store.read('info', columns=INFO_COLS, start=start)
+    else:
+        card = pd.read_csv(CARD_PATH, encoding='utf-8-sig', compression='gzip', dtype={'race_id': str})
+        info = pd.read_csv(INFO_PATH, encoding='utf-8-sig', compression='gzip', dtype={'race_id': str})
+    # 文字列列は category、数値列は収まる範囲で小さい型にしてから結合する(dtype_plan.py)
+    card = compact(card, 'card')
+    info = compact(info, 'info')
 
-NUMERIC_FEATS = ['競走得点', '年齢', '期別', '得点順位', '競走得点_sa',
-                 'S', 'B', 'B_sa', 'B_sa2', 'B_suu',
-                 '逃', '逃_sa', '逃_sa2', '逃_suu',
-                 '捲', '捲_sa', '差', '差_sa', 'マ', 'マ_sa',
-                 '勝 率', '2連 対率', '3連 対率', '番手', 'ライン人数']
-CATEGORICAL_FEATS = ['脚 質', '級 班', '強度', 'グレード', '天気', '1周', '開催番号']
-LINE_FEATURE_COLS = ['人数', '先頭_得点順位', '先頭_競走得点sa', '先頭_逃sa', '先頭_逃suu',
-                     '番手以降_平均得点sa', '番手以降_平均差sa', '番手以降_平均マsa',
-                     '先頭_予測top3score', 'ライン内平均予測score', 'ライン内最大予測score']
-
-
-def build_category_maps(df, cat_cols):
-    """学習データから 文字列 -> コード の対応表を作る。予測時は同じ表を使い、
-    未知のカテゴリ値は -1(unknown)扱いにする。"""
-    maps = {}
-    for c in cat_cols:
-        uniques = pd.unique(df[c].astype(str))
-        maps[c] = {v: i for i, v in enumerate(uniques)}
-    return maps
+    info_reset = info.copy()
+    info_reset['開催日'] = pd.to_datetime(info_reset['開催日'], errors='coerce')
 
+    card['着 順'] = pd.to_numeric(card['着 順'], errors='coerce')
 
-def apply_category_maps(df, cat_cols, maps):
-    out = df.copy()
-    for c in cat_cols:
-        m = maps[c]
-        out[c + '_code'] = out[c].astype(str).map(m).fillna(-1).astype(int)
-    return out
+    merged = rider_features(card, info_reset, info_cols=INFO_COLS)
+    merged = merged.dropna(subset=['着 順']).copy()
+    merged['target_top3'] = (merged['着 順'] <= 3).astype('int8')
+    compact(merged, '学習データ')
 
+    print('ライン特徴量を構築中...')
+    outcome = merged.groupby(['race_id', 'ライン']).agg(
+        win_line=('着 順', lambda x: int((x == 1).any())),
+    ).reset_index()
+    line_df = line_features(merged).merge(outcome, on=['race_id', 'ライン'], how='inner')
+    return merged, line_df
+
+
+def _fit_hgb(values, y, columns, params, tr_idx=None, va_idx=None):
+    """
+    (ワーカー側)1つのモデルを学習する。tr_idx / va_idx を渡すと GroupKFold の1分割として学習し、
+    va_idx の行の予測確率を返す。渡さなければ全データで学習したモデルを返す。
+    values は joblib が memmap にして渡すので、ワーカーごとに特徴量行列が複製されない。
+    """
+    X = pd.DataFrame(values, columns=columns)
+    model = HistGradientBoostingClassifier(**params)
+    if tr_idx is None:
+        model.fit(X, y)
+        return model
+    model.fit(X.iloc[tr_idx], y[tr_idx])
+    return model.predict_proba(X.iloc[va_idx])[:, 1]
+
+
+def fit_with_oof(X, y, groups, params, jobs=1):
+    """
+    全データでの学習と、GroupKFold(N_SPLITS) の各分割の学習を jobs 並列でまとめて行い、
+    (全データで学習したモデル, OOF予測) を返す。分割・乱数は逐次で回したときと同じなので結果も同じ。
+    """
+    columns = list(X.columns)
+    values = X.to_numpy(dtype=np.float64)
+    folds = list(GroupKFold(n_splits=N_SPLITS).split(values, y, groups))
+    tasks = [delayed(_fit_hgb)(values, y, columns, params)]
+    tasks += [delayed(_fit_hgb)(values, y, columns, params, tr_idx, va_idx) for tr_idx, va_idx in folds]
+    results = Parallel(n_jobs=jobs)(tasks)
+
+    oof = np.zeros(len(values))
+    for (_, va_idx), pred in zip(folds, results[1:]):
+        oof[va_idx] = pred
+    return results[0], oof
+
+
+def confidence_threshold_of(merged, line_df):
+    """個人の予測とラインの予測から combined_score を作り、レースごとの自信度(1位-3位差)の上位1/3の境界値を返す。"""
+    rider_line = merged[['race_id', 'ライン', '車 番', 'indiv_pred_top3']].merge(
+        line_df[['race_id', 'ライン', 'line_power_score']], on=['race_id', 'ライン'], how='left')
+    rider_line['line_power_score'] = rider_line['line_power_score'].fillna(0)
+    rider_line['combined_score'] = rider_line['indiv_pred_top3'] + 0.5 * rider_line['line_power_score']
 
-def main():
-    print('データ読み込み中...')
-    card = pd.read_csv(CARD_PATH, encoding='utf-8-sig', compression='gzip', dtype={'race_id': str})
-    info = pd.read_csv(INFO_PATH, encoding='utf-8-sig', compression='gzip', dtype={'race_id': str})
+    def conf_gap(g):
+        s = g.sort_values('combined_score', ascending=False)['combined_score'].values
+        if len(s) < 3:
+            return np.nan
+        return s[0] - s[2]
 
-    info_reset = info.copy()
-    info_reset['開催日'] = pd.to_datetime(info_reset['開催日'], errors='coerce')
+    conf_series = rider_line.groupby('race_id').apply(conf_gap)
+    conf_series = conf_series.dropna()
+    # 上位1/3を「高自信」とするしきい値(2/3分位点)
+    return float(np.quantile(conf_series.values, 2 / 3))
+
+
+def valid_mask(merged, days=VALID_DAYS):
+    """直近 days 日(開催日)のレースの行。"""
+    last = merged['開催日'].max()
+    return (merged['開催日'] > last - pd.Timedelta(days=days)).to_numpy()
+
+
+def base_data_end(registry, version):
+    """
+    version の全期間モデル(差分更新のバージョンなら parent をたどった先)の学習データの最終日。
+    manifest に期間が無い(legacy など)ときは None。
+    """
+    m = registry.manifest(version)
+    while m.get('mode') == 'incremental' and m.get('parent'):
+        m = registry.manifest(m['parent'])
+    end = (m.get('data_range') or [None, None])[1]
+    return pd.Timestamp(end) if end else None
+
+
+def blend_out_of_sample(base_pred, tail_oof, weight, seen):
+    """
+    全期間モデルの予測と tail の OOF 予測を weight で混ぜる。ただし seen(全期間モデルの学習に入っていた行)は
+    全期間モデルの予測が学習データへの当てはめになるので、tail の OOF だけを使う。
+    """
+    return np.where(seen, tail_oof, (1 - weight) * base_pred + weight * tail_oof)
+
+
+def last_input_key(registry, parent):
+    """parent を元にした差分更新のうち最後のバージョンの、学習に使った入力ファイルのキー(無ければ None)。"""
+    for version in reversed(registry.versions()):
+        m = registry.manifest(version)
+        if m.get('mode') == 'incremental' and m.get('parent') == parent:
+            return m.get('input_key')
+    return None
+
+
+def improves(report):
+    """差分更新の検証で、混ぜたモデルが全期間モデルだけより悪くなっていないか(検証できなかったら False)。"""
+    if 'stage1' not in report:
+        return False
+    return report['stage1']['logloss'] <= report['stage1_base_only']['logloss']
+
+
+def validation_metrics(y, pred, period):
+    """検証期間の logloss / AUC(validation_report.json の1項目)。"""
+    return {
+        'period': [f'{period[0]:%Y-%m-%d}', f'{period[1]:%Y-%m-%d}'],
+        'n': int(len(y)),
+        'logloss': float(log_loss(y, pred, labels=[0, 1])),
+        'auc': float(roc_auc_score(y, pred)) if len(np.unique(y)) == 2 else None,
+    }
+
+
+def write_report(draft, report):
+    draft.write_json('validation_report', report)
+    for name, m in report.items():
+        if isinstance(m, dict) and 'logloss' in m:
+            auc = 'nan' if m['auc'] is None else f"{m['auc']:.4f}"
+            print(f"[検証] {name}: {m['period'][0]}〜{m['period'][1]} {m['n']} 行 logloss={m['logloss']:.4f} AUC={auc}")
+
+
+def training_manifest(merged, report, cfg, **extra):
+    """manifest.json に書く、学習データの期間・件数・検証指標・特徴量設定のハッシュ。"""
+    return {
+        'data_range': [f'{merged["開催日"].min():%Y-%m-%d}', f'{merged["開催日"].max():%Y-%m-%d}'],
+        'n_races': int(merged['race_id'].nunique()),
+        'n_rows': int(len(merged)),
+        'metrics': report,
+        'feature_config_hash': config_hash(cfg),
+        **extra,
+    }
+
+
+def publish(draft, manifest, promote):
+    version = draft.publish(manifest, promote=promote)
+    state = 'CURRENT に切り替えました' if promote else 'CURRENT はそのまま'
+    print(f'\n=== 保存完了: {version}({state}) ===')
+    for f in sorted(os.listdir(draft.registry.version_dir(version))):
+        print(' -', f)
 
-    card['着 順'] = pd.to_numeric(card['着 順'], errors='coerce')
 
-    merged = card.merge(
-        info_reset[['race_id', 'グレード', '天気', '1周', '開催番号', '開催日']],
-        on='race_id', how='left'
+def main(jobs=1, promote=True):
+    store, start, paths = history_source()
+    merged, line_base = load_or_build(
+        paths, 'training', lambda: build_training_features(store, start), cache_dir=FEATURE_CACHE_DIR
     )
-    line_size = merged.groupby(['race_id', 'ライン']).size().rename('ライン人数').reset_index()
-    merged = merged.merge(line_size, on=['race_id', 'ライン'], how='left')
-    merged = merged.dropna(subset=['着 順']).copy()
-    merged['target_top3'] = (merged['着 順'] <= 3).astype(int)
 
-    for c in NUMERIC_FEATS:
-        merged[c] = pd.to_numeric(merged[c], errors='coerce')
+    draft = ModelRegistry(OUT_DIR).begin('full')
+    print(f'新しいバージョン {draft.version} に保存します。')
 
     # ---- カテゴリ変換マップを作成・保存 ----
     cat_maps = build_category_maps(merged, CATEGORICAL_FEATS)
@@ -87,133 +273,162 @@ def main():
 
     feature_cols = NUMERIC_FEATS + [c + '_code' for c in CATEGORICAL_FEATS]
     cat_indices = [feature_cols.index(c + '_code') for c in CATEGORICAL_FEATS]
+    cfg = {
+        'numeric_feats': NUMERIC_FEATS,
+        'categorical_feats': CATEGORICAL_FEATS,
+        'feature_cols': feature_cols,
+        'cat_indices': cat_indices,
+        'line_feature_cols': LINE_FEATURE_COLS,
+    }
+    draft.save('category_maps', cat_maps)
+    draft.save('feature_config', cfg)
 
     X = merged[feature_cols].fillna(-999)
     y = merged['target_top3'].values
     groups = merged['race_id'].values
 
     # ---- Stage1: 個人モデル(全データで最終学習) ----
-    print('Stage1(個人モデル)を全データで学習中...')
-    stage1_model = HistGradientBoostingClassifier(
-        max_iter=150, learning_rate=0.08, max_depth=6,
-        categorical_features=cat_indices, random_state=42
+    # Stage2用の特徴量はリーク防止のためGroupKFoldでOOF予測を作る(全データの学習と各分割を並列で回す)
+    print(f'Stage1(個人モデル)を全データで学習し、Stage2用にOOF予測を作成中(GroupKFold, jobs={jobs})...')
+    stage1_model, oof_pred = fit_with_oof(
+        X, y, groups, dict(STAGE1_PARAMS, categorical_features=cat_indices), jobs
     )
-    stage1_model.fit(X, y)
 
-    # ここで即保存(この後の処理が時間切れになっても、本番用モデル自体は失われないように)
-    joblib.dump(stage1_model, f'{OUT_DIR}/stage1_model.pkl')
-    joblib.dump(cat_maps, f'{OUT_DIR}/category_maps.pkl')
-    joblib.dump({
-        'numeric_feats': NUMERIC_FEATS,
-        'categorical_feats': CATEGORICAL_FEATS,
-        'feature_cols': feature_cols,
-        'cat_indices': cat_indices,
-        'line_feature_cols': LINE_FEATURE_COLS,
-    }, f'{OUT_DIR}/feature_config.pkl')
-    print('Stage1モデルを保存しました。')
-
-    # Stage2用の特徴量はリーク防止のためGroupKFoldでOOF予測を作る
-    print('Stage2用にOOF予測を作成中(GroupKFold)...')
-    oof_pred = np.zeros(len(merged))
-    gkf = GroupKFold(n_splits=5)
-    for tr_idx, va_idx in gkf.split(X, y, groups):
-        m = HistGradientBoostingClassifier(
-            max_iter=150, learning_rate=0.08, max_depth=6,
-            categorical_features=cat_indices, random_state=42
-        )
-        m.fit(X.iloc[tr_idx], y[tr_idx])
-        oof_pred[va_idx] = m.predict_proba(X.iloc[va_idx])[:, 1]
+    # 書きかけのバージョンに渡しておく(最後の publish でまとめてバンドルに書く)
+    draft.save('stage1_model', stage1_model)
     merged['indiv_pred_top3'] = oof_pred
 
-    # ---- ライン特徴量を構築 ----
-    print('ライン特徴量を構築中...')
-    lead = merged[merged['番手'] == 1].copy().rename(columns={
-        '得点順位': '先頭_得点順位', '競走得点_sa': '先頭_競走得点sa',
-        '逃_sa': '先頭_逃sa', '逃_suu': '先頭_逃suu',
-    })[['race_id', 'ライン', '先頭_得点順位', '先頭_競走得点sa', '先頭_逃sa', '先頭_逃suu']]
-
-    followers = merged[merged['番手'] > 1].groupby(['race_id', 'ライン']).agg(
-        番手以降_平均得点sa=('競走得点_sa', 'mean'),
-        番手以降_平均差sa=('差_sa', 'mean'),
-        番手以降_平均マsa=('マ_sa', 'mean'),
-    ).reset_index()
-
-    line_size2 = merged.groupby(['race_id', 'ライン']).size().reset_index(name='人数')
-    line_agg_pred = merged.groupby(['race_id', 'ライン']).agg(
-        ライン内平均予測score=('indiv_pred_top3', 'mean'),
-        ライン内最大予測score=('indiv_pred_top3', 'max'),
-    ).reset_index()
-
-    line_features = line_size2.merge(lead, on=['race_id', 'ライン'], how='left') \
-                               .merge(followers, on=['race_id', 'ライン'], how='left') \
-                               .merge(line_agg_pred, on=['race_id', 'ライン'], how='left')
-    for c in ['番手以降_平均得点sa', '番手以降_平均差sa', '番手以降_平均マsa']:
-        line_features[c] = line_features[c].fillna(0)
-    line_features['先頭_予測top3score'] = line_features['ライン内平均予測score']
-    lead_pred = merged[merged['番手'] == 1][['race_id', 'ライン', 'indiv_pred_top3']]
-    line_features = line_features.merge(lead_pred, on=['race_id', 'ライン'], how='left', suffixes=('', '_lead'))
-    line_features['先頭_予測top3score'] = line_features['indiv_pred_top3'].fillna(line_features['ライン内平均予測score'])
-    line_features = line_features.drop(columns=['indiv_pred_top3'])
+    hold = valid_mask(merged)
+    period = (merged.loc[hold, '開催日'].min(), merged.loc[hold, '開催日'].max())
+    report = {
+        'mode': 'full',
+        'stage1': validation_metrics(y[hold], oof_pred[hold], period),
+    }
+    write_report(draft, report)
 
-    outcome = merged.groupby(['race_id', 'ライン']).agg(
-        win_line=('着 順', lambda x: int((x == 1).any())),
-    ).reset_index()
-    line_df = line_features.merge(outcome, on=['race_id', 'ライン'], how='inner')
+    # ---- ライン特徴量に Stage1 の OOF 予測を足す ----
+    line_df = add_line_predictions(line_base, merged)
 
     # ---- Stage2: ラインモデル(全データで最終学習) ----
-    print('Stage2(ラインモデル)を全データで学習中...')
+    # Stage2のOOF(ラインもGroupKFoldでOOF化してcombined_scoreの自信度分布を作る)
+    print(f'Stage2(ラインモデル)を全データで学習し、自信度しきい値用のOOF予測を作成中(jobs={jobs})...')
     Xl = line_df[LINE_FEATURE_COLS].fillna(-999)
     yl = line_df['win_line'].values
-    stage2_model = HistGradientBoostingClassifier(max_iter=150, learning_rate=0.08, max_depth=5, random_state=42)
-    stage2_model.fit(Xl, yl)
-    joblib.dump(stage2_model, f'{OUT_DIR}/stage2_model.pkl')
-    print('Stage2モデルを保存しました。')
-
-    # Stage2のOOF(ラインもGroupKFoldでOOF化してcombined_scoreの自信度分布を作る)
-    print('自信度しきい値を計算するためのOOF予測を作成中...')
     line_groups = line_df['race_id'].values
-    oof_line_pred = np.zeros(len(line_df))
-    for tr_idx, va_idx in gkf.split(Xl, yl, line_groups):
-        m2 = HistGradientBoostingClassifier(max_iter=150, learning_rate=0.08, max_depth=5, random_state=42)
-        m2.fit(Xl.iloc[tr_idx], yl[tr_idx])
-        oof_line_pred[va_idx] = m2.predict_proba(Xl.iloc[va_idx])[:, 1]
+    stage2_model, oof_line_pred = fit_with_oof(Xl, yl, line_groups, STAGE2_PARAMS, jobs)
+    draft.save('stage2_model', stage2_model)
     line_df['line_power_score'] = oof_line_pred
 
     # ---- 個人のcombined_scoreを再構築し、レースごとの自信度(1位-3位差)を計算 ----
-    rider_line = merged[['race_id', 'ライン', '車 番', 'indiv_pred_top3']].merge(
-        line_df[['race_id', 'ライン', 'line_power_score']], on=['race_id', 'ライン'], how='left')
-    rider_line['line_power_score'] = rider_line['line_power_score'].fillna(0)
-    rider_line['combined_score'] = rider_line['indiv_pred_top3'] + 0.5 * rider_line['line_power_score']
-
-    def conf_gap(g):
-        s = g.sort_values('combined_score', ascending=False)['combined_score'].values
-        if len(s) < 3:
-            return np.nan
-        return s[0] - s[2]
-
-    conf_series = rider_line.groupby('race_id').apply(conf_gap)
-    conf_series = conf_series.dropna()
-    # 上位1/3を「高自信」とするしきい値(2/3分位点)
-    confidence_threshold = float(np.quantile(conf_series.values, 2 / 3))
+    confidence_threshold = confidence_threshold_of(merged, line_df)
     print(f'自信度しきい値(上位1/3の境界値): {confidence_threshold:.4f}')
 
     # ---- 保存 ----
-    joblib.dump(stage1_model, f'{OUT_DIR}/stage1_model.pkl')
-    joblib.dump(stage2_model, f'{OUT_DIR}/stage2_model.pkl')
-    joblib.dump(cat_maps, f'{OUT_DIR}/category_maps.pkl')
-    joblib.dump(confidence_threshold, f'{OUT_DIR}/confidence_threshold.pkl')
-    joblib.dump({
-        'numeric_feats': NUMERIC_FEATS,
-        'categorical_feats': CATEGORICAL_FEATS,
-        'feature_cols': feature_cols,
-        'cat_indices': cat_indices,
-        'line_feature_cols': LINE_FEATURE_COLS,
-    }, f'{OUT_DIR}/feature_config.pkl')
+    draft.save('confidence_threshold', confidence_threshold)
+    publish(draft, training_manifest(merged, report, cfg), promote)
+
+
+def main_incremental(jobs=1, tail_months=TAIL_MONTHS, weight=BLEND_WEIGHT, promote=True):
+    """直近 tail_months か月だけで学習し直し、CURRENT の全期間モデルと weight で混ぜた新しいバージョンを作る。"""
+    store, start, paths = history_source(tail_months)
+    if store is None:
+        print('差分更新には過去データの保存先(data/history)が必要です。5_combine_data.py で取り込んでください。')
+        return
+
+    print('全期間モデルと特徴量の設定を読み込んでいます...')
+    registry = ModelRegistry(OUT_DIR)
+    current = registry.load(names=['stage1_model', 'stage2_model', 'category_maps', 'feature_config'])
+    print(f'元にするバージョン: {current["version"]}')
+    input_key = cache_key(paths, f'training_tail_{tail_months}')
+    if last_input_key(registry, current['version']) == input_key:
+        print('直近の過去データが前回の差分更新から変わっていないので、学習し直しません'
+              '(settle_races.py / 5_combine_data.py で取り込んでから実行してください)。')
+        return
+    base1 = unwrap(current['stage1_model'])
+    base2 = unwrap(current['stage2_model'])
+    cat_maps = current['category_maps']
+    cfg = current['feature_config']
+
+    merged, line_base = load_or_build(
+        paths, 'training_tail', lambda: build_training_features(store, start), cache_dir=FEATURE_CACHE_DIR
+    )
+    print(f'差分更新の対象: {merged["開催日"].min():%Y-%m-%d}〜{merged["開催日"].max():%Y-%m-%d} '
+          f'{merged["race_id"].nunique()} レース')
+    merged = apply_category_maps(merged, cfg['categorical_feats'], cat_maps)
 
-    print('\n=== 保存完了 ===')
-    for f in os.listdir(OUT_DIR):
-        print(' -', f)
+    X = merged[cfg['feature_cols']].fillna(-999)
+    y = merged['target_top3'].values
+    groups = merged['race_id'].values
+    params1 = dict(STAGE1_PARAMS, categorical_features=cfg['cat_indices'])
+
+    # ---- 検証: 直近 VALID_DAYS 日のうち全期間モデルの学習より後の日を除いて tail を学習し、
+    #      その期間で全期間モデルだけの場合と比べる(全期間モデルが学習した日で測ると当てはめの値になる) ----
+    base_end = base_data_end(registry, current['version'])
+    seen = (merged['開催日'] <= base_end).to_numpy() if base_end is not None else np.ones(len(merged), bool)
+    hold = valid_mask(merged) & ~seen
+    draft = registry.begin('incremental')
+    print(f'新しいバージョン {draft.version} に保存します。')
+    report = {
+        'mode': 'incremental',
+        'tail_months': tail_months,
+        'blend_weight': weight,
+        'base_data_end': None if base_end is None else f'{base_end:%Y-%m-%d}',
+    }
+    if hold.any():
+        period = (merged.loc[hold, '開催日'].min(), merged.loc[hold, '開催日'].max())
+        tail_valid = _fit_hgb(X[~hold].to_numpy(dtype=np.float64), y[~hold], list(X.columns), params1)
+        p_base = base1.predict_proba(X[hold])[:, 1]
+        p_blend = BlendedClassifier(base1, tail_valid, weight).predict_proba(X[hold])[:, 1]
+        report['stage1'] = validation_metrics(y[hold], p_blend, period)
+        report['stage1_base_only'] = validation_metrics(y[hold], p_base, period)
+    else:
+        report['skipped'] = '全期間モデルの学習データより後のレースが無いので検証していません'
+        print(f"[検証] {report['skipped']}(全期間モデルの学習データは {report['base_data_end']} まで)")
+    write_report(draft, report)
+
+    # ---- Stage1: 直近の期間で学習し直して混ぜる(Stage2 用の予測は OOF。全期間モデルが学習した日は tail の OOF だけ) ----
+    print(f'Stage1(個人モデル)を直近 {tail_months} か月で学習中(jobs={jobs})...')
+    tail1, oof_tail = fit_with_oof(X, y, groups, params1, jobs)
+    stage1_model = BlendedClassifier(base1, tail1, weight)
+    merged['indiv_pred_top3'] = blend_out_of_sample(base1.predict_proba(X)[:, 1], oof_tail, weight, seen)
+
+    # ---- Stage2 ----
+    print(f'Stage2(ラインモデル)を直近 {tail_months} か月で学習中(jobs={jobs})...')
+    line_df = add_line_predictions(line_base, merged)
+    Xl = line_df[cfg['line_feature_cols']].fillna(-999)
+    yl = line_df['win_line'].values
+    tail2, oof_line_tail = fit_with_oof(Xl, yl, line_df['race_id'].values, STAGE2_PARAMS, jobs)
+    stage2_model = BlendedClassifier(base2, tail2, weight)
+    seen_line = line_df['race_id'].isin(merged.loc[seen, 'race_id']).to_numpy()
+    line_df['line_power_score'] = blend_out_of_sample(base2.predict_proba(Xl)[:, 1], oof_line_tail, weight, seen_line)
+
+    confidence_threshold = confidence_threshold_of(merged, line_df)
+    print(f'自信度しきい値(上位1/3の境界値): {confidence_threshold:.4f}')
+
+    # ---- 保存(カテゴリ変換表・特徴量の設定は全期間モデルのまま) ----
+    draft.save('stage1_model', stage1_model)
+    draft.save('stage2_model', stage2_model)
+    draft.save('category_maps', cat_maps)
+    draft.save('feature_config', cfg)
+    draft.save('confidence_threshold', confidence_threshold)
+    if promote and not improves(report):
+        print('[検証] 混ぜたモデルが全期間モデルだけより良くなっていない(または検証できない)ので、CURRENT は切り替えません。')
+        promote = False
+    publish(draft, training_manifest(merged, report, cfg, parent=current['version'], input_key=input_key), promote)
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='学習を並列に回すプロセス数(-1 で全コア)。増やすとその分メモリも使う')
+    parser.add_argument('--incremental', action='store_true',
+                        help='直近の期間だけで学習し直し、全期間モデルと混ぜる(差分更新)')
+    parser.add_argument('--tail-months', type=int, default=TAIL_MONTHS, help='差分更新で学習し直す直近の月数')
+    parser.add_argument('--blend', type=float, default=BLEND_WEIGHT, help='差分更新のモデルを混ぜる重み(0〜1)')
+    parser.add_argument('--no-promote', action='store_true',
+                        help='新しいバージョンを作るだけで CURRENT は切り替えない(src/model_registry.py promote で切り替える)')
+    args = parser.parse_args()
+    if args.incremental:
+        main_incremental(jobs=args.jobs, tail_months=args.tail_months, weight=args.blend, promote=not args.no_promote)
+    else:
+        main(jobs=args.jobs, promote=not args.no_promote)
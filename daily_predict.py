@@ -7,6 +7,7 @@ daily_predict.py
 前提:
   - build_production_models.py を事前に1回(または定期的に)実行し、
     models/ フォルダに学習済みモデル一式が保存されていること。
+    models/CURRENT が指すバージョンを使う(--model-version で別のバージョンも指定できる。src/model_registry.py 参照)。
   - today_race_card3.pkl は 1_race_id_scrape.py -> 2_race_data_scrape.py ->
     3_back_sabun.py -> 4_def_line_kyoudo.py と同じ手順で「本日開催分のrace_id」
     だけを対象に作られたもの(t_race.py が読んでいるものと同じ形式)。
@@ -15,23 +16,56 @@ daily_predict.py
 出力:
   - keirin_daily_recommend.csv : 「買い」判定になったレースの推奨3車ボックスのみ
   - keirin_daily_all_races.csv : 全レースの自信度・推奨/見送りステータス一覧(参考用)
+
+モデル一式は1ファイルのバンドル(src/model_bundle.py)から読む。しきい値・設定はヘッダから即座に読み、
+推定器は mmap から戻す(ほとんどの時間は sklearn の import)。推定器はデータより先に読んでおき、
+起動からの経過時間を段階ごとに表示して、データを読み始めてから CSV を書き終えるまでが
+COLD_START_BUDGET 秒を超えたら警告を出す。
+
+出走表・レース情報の行が前回と同じレースは前回の結果を使い、欠車などで変わったレースだけを
+予測し直す(src/race_cache.py)。--full を付けると全レースを予測し直す。特徴量は入力ファイルと
+特徴量の版だけで決まるキャッシュ(feature_builder.load_or_build)に持つので、モデルを替えても作り直さない。
 """
-import pandas as pd
-import numpy as np
-import joblib
-import os
+import time
+
+_T0 = time.perf_counter()
+
+import pandas as pd  # noqa: E402
+import numpy as np  # noqa: E402
+import argparse  # noqa: E402
+import os  # noqa: E402
+import sys  # noqa: E402
 from itertools import permutations
 
 # models/ フォルダはこのスクリプト自身の場所を基準にする(どこから実行しても迷わないように)
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_DIR = os.path.join(SCRIPT_DIR, 'models')
 
+# 特徴量づくりは build_production_models.py と共通(src/feature_builder.py)
+sys.path.insert(0, os.path.join(SCRIPT_DIR, 'src'))
+from feature_builder import (  # noqa: E402
+    FEATURE_VERSION, add_line_predictions, apply_category_maps, line_features, load_or_build, rider_features,
+)
+from model_registry import ModelRegistry  # noqa: E402
+from race_cache import RaceCache, file_salt, race_digests  # noqa: E402
+from rider_master import DEFAULT_ROOT as MASTER_DIR, attach_features, master_paths  # noqa: E402
+
 # 本日のレースデータは、実行時のカレントディレクトリ(スクレイピングの出力先)から読む
 TODAY_CARD_PATH = 'today_race_card3.pkl'
 TODAY_INFO_PATH = 'today_race_info2.pkl'
 
 BOX_COST_PER_COMBO = 100  # 3連単1点あたりの金額
 
+# データを読み始めてから出力を書き終えるまでの目標(秒)
+COLD_START_BUDGET = 1.0
+
+
+def _lap(label, since=None):
+    """起動からの経過時間(since を渡すとそこからの時間)を表示し、今の時刻を返す。"""
+    now = time.perf_counter()
+    print(f'[時間] {label}: {now - (_T0 if since is None else since):.3f}秒')
+    return now
+
 
 def load_today_data():
     card = pd.read_pickle(TODAY_CARD_PATH)
@@ -55,77 +89,76 @@ def load_today_data():
     return card, info
 
 
-def build_features(card, info, cat_maps, numeric_feats, categorical_feats):
-    merged = card.merge(
-        info[['race_id', 'グレード', '天気', '1周', '開催番号']],
-        on='race_id', how='left'
-    )
-    line_size = merged.groupby(['race_id', 'ライン']).size().rename('ライン人数').reset_index()
-    merged = merged.merge(line_size, on=['race_id', 'ライン'], how='left')
+def build_today_features():
+    """本日分の選手単位・ライン単位の特徴量(カテゴリのコード化と Stage1 予測の前まで)を作る。"""
+    card, info = load_today_data()
+    # 累計成績(累計勝率など)は選手マスターから出走者の分だけ引いて付ける
+    merged = rider_features(attach_features(card), info)
+    return merged, line_features(merged), info
+
+
+def build_features(cat_maps, numeric_feats, categorical_feats):
+    """本日分の特徴量を、入力ファイル(出走表・レース情報・選手マスター)が前回と同じならキャッシュから返す。"""
+    paths = [TODAY_CARD_PATH, TODAY_INFO_PATH] + master_paths(MASTER_DIR)
+    merged, line_base, info = load_or_build(paths, 'today', build_today_features)
 
+    # モデル側の設定に合わせる(キャッシュはモデルに依らない形で持っている)
     for c in numeric_feats:
         merged[c] = pd.to_numeric(merged[c], errors='coerce')
+    merged = apply_category_maps(merged, categorical_feats, cat_maps)
+    return merged, line_base, info
 
-    for c in categorical_feats:
-        m = cat_maps[c]
-        merged[c + '_code'] = merged[c].astype(str).map(m).fillna(-1).astype(int)
 
-    return merged
+def load_features(models):
+    """models(ModelRegistry.open の戻り値)の設定に合わせて本日分の特徴量を作る。"""
+    cfg = models['feature_config']
+    return build_features(models['category_maps'], cfg['numeric_feats'], cfg['categorical_feats'])
 
 
-def main():
-    print('モデル一式を読み込んでいます...')
-    stage1_model = joblib.load(f'{MODEL_DIR}/stage1_model.pkl')
-    stage2_model = joblib.load(f'{MODEL_DIR}/stage2_model.pkl')
-    cat_maps = joblib.load(f'{MODEL_DIR}/category_maps.pkl')
-    confidence_threshold = joblib.load(f'{MODEL_DIR}/confidence_threshold.pkl')
-    cfg = joblib.load(f'{MODEL_DIR}/feature_config.pkl')
-
-    numeric_feats = cfg['numeric_feats']
-    categorical_feats = cfg['categorical_feats']
+def predict_today(models, full=False):
+    """
+    本日の全レースの一覧(predict_races の結果)を返す。出走表・レース情報の行が前回と同じレースは
+    前回の結果を使い、変わったレースだけ予測し直す(src/race_cache.py)。full なら全レース。
+    特徴量は load_features のキャッシュ(モデルに依らない)から取るので、モデルだけを替えたときは予測だけをやり直す。
+    """
+    card, info = load_today_data()
+    model_paths = ModelRegistry(MODEL_DIR).artifact_paths(models['version'])
+    salt = file_salt(master_paths(MASTER_DIR) + model_paths, FEATURE_VERSION, models['version'])
+    digests = race_digests([card, info], salt)
+    cache = RaceCache('daily_predict')
+    if full:
+        cache.clear()
+    changed = cache.changed(digests)
+    print(f'本日のレース数: {len(digests)}  出走選手数: {len(card)}  '
+          f'入力が変わったレース: {len(changed)}(残りは前回の結果を使います)')
+
+    frames = {}
+    if changed:
+        merged, line_base, info = load_features(models)
+        merged = merged[merged['race_id'].isin(changed)]
+        line_base = line_base[line_base['race_id'].isin(changed)]
+        info = info[info['race_id'].isin(changed)]
+        frames = {'summary': predict_races(models, merged, line_base, info)}
+    summary = cache.update(digests, frames)['summary']
+    return summary.sort_values(['開始時間', '競輪場', 'レース番号'], na_position='last')
+
+
+def predict_races(models, merged, line_base, info):
+    """Stage1 / Stage2 で全レースの自信度を出し、レース単位の一覧(判定・推奨3車ボックス)を返す。"""
+    stage1_model = models['stage1_model']
+    stage2_model = models['stage2_model']
+    confidence_threshold = models['confidence_threshold']
+    cfg = models['feature_config']
     feature_cols = cfg['feature_cols']
     line_feature_cols = cfg['line_feature_cols']
-
-    print(f'自信度しきい値(この値以上のレースだけ購入対象): {confidence_threshold:.4f}')
-
-    print('本日のレースデータを読み込んでいます...')
-    card, info = load_today_data()
-    print(f'本日のレース数: {card["race_id"].nunique()}  出走選手数: {len(card)}')
-
-    merged = build_features(card, info, cat_maps, numeric_feats, categorical_feats)
+    merged = merged.copy()
 
     # ---- Stage1: 個人の3着以内予測 ----
     X = merged[feature_cols].fillna(-999)
     merged['indiv_pred_top3'] = stage1_model.predict_proba(X)[:, 1]
 
-    # ---- ライン特徴量を構築 ----
-    lead = merged[merged['番手'] == 1].copy().rename(columns={
-        '得点順位': '先頭_得点順位', '競走得点_sa': '先頭_競走得点sa',
-        '逃_sa': '先頭_逃sa', '逃_suu': '先頭_逃suu',
-    })[['race_id', 'ライン', '先頭_得点順位', '先頭_競走得点sa', '先頭_逃sa', '先頭_逃suu']]
-
-    followers = merged[merged['番手'] > 1].groupby(['race_id', 'ライン']).agg(
-        番手以降_平均得点sa=('競走得点_sa', 'mean'),
-        番手以降_平均差sa=('差_sa', 'mean'),
-        番手以降_平均マsa=('マ_sa', 'mean'),
-    ).reset_index()
-
-    line_size2 = merged.groupby(['race_id', 'ライン']).size().reset_index(name='人数')
-    line_agg_pred = merged.groupby(['race_id', 'ライン']).agg(
-        ライン内平均予測score=('indiv_pred_top3', 'mean'),
-    ).reset_index()
-    lead_pred = merged[merged['番手'] == 1][['race_id', 'ライン', 'indiv_pred_top3']]
-
-    line_df = line_size2.merge(lead, on=['race_id', 'ライン'], how='left') \
-                         .merge(followers, on=['race_id', 'ライン'], how='left') \
-                         .merge(line_agg_pred, on=['race_id', 'ライン'], how='left') \
-                         .merge(lead_pred, on=['race_id', 'ライン'], how='left')
-    for c in ['番手以降_平均得点sa', '番手以降_平均差sa', '番手以降_平均マsa']:
-        line_df[c] = line_df[c].fillna(0)
-    line_df['先頭_予測top3score'] = line_df['indiv_pred_top3'].fillna(line_df['ライン内平均予測score'])
-
-    line_max_pred = merged.groupby(['race_id', 'ライン'])['indiv_pred_top3'].max().rename('ライン内最大予測score').reset_index()
-    line_df = line_df.merge(line_max_pred, on=['race_id', 'ライン'], how='left')
+    # ---- ライン特徴量に Stage1 の予測を足す ----
+    line_df = add_line_predictions(line_base, merged)
 
     # ---- Stage2: ラインの勝率予測 ----
     Xl = line_df[line_feature_cols].fillna(-999)
@@ -178,8 +211,11 @@ def main():
         }
         summary_rows.append(row)
 
-    summary = pd.DataFrame(summary_rows).sort_values(['開始時間', '競輪場', 'レース番号'], na_position='last')
+    return pd.DataFrame(summary_rows).sort_values(['開始時間', '競輪場', 'レース番号'], na_position='last')
+
 
+def write_outputs(summary):
+    """全レースの一覧と購入対象のみの一覧を出力する(predict_client.py からも使う)。"""
     summary.to_csv('keirin_daily_all_races.csv', index=False, encoding='utf-8-sig')
     buy_only = summary[summary['判定'] == '購入'].copy()
     buy_only.to_csv('keirin_daily_recommend.csv', index=False, encoding='utf-8-sig')
@@ -192,5 +228,29 @@ def main():
     print('-> keirin_daily_all_races.csv (全レース・自信度付き) を出力しました。')
 
 
+def main(model_version=None, full=False):
+    _lap('起動(import)')
+    print('モデル一式を読み込んでいます...')
+    models = ModelRegistry(MODEL_DIR).open(model_version)
+    print(f'モデルのバージョン: {models["version"]}')
+    # 推定器はバンドルから初めて引いたときに戻すので、データより先に引いておく
+    for name in ('stage1_model', 'stage2_model'):
+        models[name]
+    _lap('モデル読み込み完了')
+    print(f'自信度しきい値(この値以上のレースだけ購入対象): {models["confidence_threshold"]:.4f}')
+
+    print('本日のレースデータを読み込んでいます...')
+    t_data = time.perf_counter()
+    write_outputs(predict_today(models, full))
+
+    elapsed = _lap('データ読み込み〜出力', t_data) - t_data
+    if elapsed > COLD_START_BUDGET:
+        print(f'[WARN] データ読み込みから出力までが目標の {COLD_START_BUDGET:.1f}秒 を超えました({elapsed:.2f}秒)')
+
+
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-version', default=None, help='使うモデルのバージョン(省略時は models/CURRENT)')
+    parser.add_argument('--full', action='store_true', help='前回の結果を使わず全レースを計算し直す')
+    args = parser.parse_args()
+    main(model_version=args.model_version, full=args.full)
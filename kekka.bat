@@ -39,6 +39,17 @@ python "C:\Users\wolfs\Desktop\keirin-ai\src\run_pipeline.py"
 REM ROIが維持できているか確認
 python "C:\Users\wolfs\Desktop\keirin-ai\src\backtest_2shahuku_fixed_rule.py"
 
+REM 確定した当日のレースを過去データ（data/history）に追加
+python "C:\Users\wolfs\Desktop\keirin-ai\src\settle_races.py"
+
+REM 確定したレースを選手ごとの通算成績に足し込み、選手マスターを作り直す（全期間ファイルは読まない）
+python "C:\Users\wolfs\Desktop\keirin-ai\src\8_cumulative_ready.py"
+python "C:\Users\wolfs\Desktop\keirin-ai\src\9_new_player.py"
+
+REM 確定したレースでモデルを差分更新（直近の期間だけ学習し直して全期間モデルと混ぜる）
+REM 過去データが変わっていなければ何もしない。検証で良くなったときだけ CURRENT を切り替える
+python "C:\Users\wolfs\Desktop\keirin-ai\build_production_models.py" --incremental
+
 echo "すべての処理が完了しました。60秒後シャットダウンします"
 
 shutdown /s /t 60
@@ -0,0 +1,191 @@
+"""
+predict_client.py
+------------------
+predict_server.py に問い合わせる薄いクライアント。各スクリプトと同じ CSV をカレントディレクトリに書く。
+
+    python predict_client.py t_race                              (= src/t_race.py の出力)
+    python predict_client.py daily                               (= daily_predict.py の出力)
+    python predict_client.py ev [--bet-type 3rentan|2shahuku]    (= src/ev_ranker.py / ev_ranker_2shahuku.py の出力)
+    python predict_client.py score [RACE_ID ...]                 (選手ごとのスコアを表示)
+    python predict_client.py reload                              (promote / rollback のあとにモデルを読み直させる)
+
+    python predict_client.py bench [--endpoint score|ev|summary|recommend] [--requests 200] [--concurrency 4]
+
+bench は手元で負荷をかけ、応答時間(中央値・95%点・最大)と1秒あたりの処理数を表示する。
+score / ev は1レースずつ、レースを順に替えながら問い合わせる。
+
+接続先は --url(既定 http://127.0.0.1:8765)か --socket(predict_server.py --socket と同じパス)。
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import pandas as pd
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPT_DIR, 'src'))
+
+DEFAULT_URL = 'http://127.0.0.1:8765'
+EV_OUTPUTS = {
+    '3rentan': ('keirin_ev_tickets.csv', 'keirin_ev_race_rank.csv'),
+    '2shahuku': ('keirin_ev_tickets_2shahuku.csv', 'keirin_ev_race_rank_2shahuku.csv'),
+}
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class PredictClient:
+    def __init__(self, url=DEFAULT_URL, socket_path=None, timeout=600):
+        self.url = urlsplit(url)
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _connection(self):
+        if self.socket_path:
+            return UnixHTTPConnection(self.socket_path, self.timeout)
+        return http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=self.timeout)
+
+    def call(self, method, path, payload=None):
+        conn = self._connection()
+        try:
+            body = None if payload is None else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            conn.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+            resp = conn.getresponse()
+            result = json.loads(resp.read().decode('utf-8'))
+        finally:
+            conn.close()
+        if resp.status != 200:
+            raise RuntimeError(f'{method} {path}: {resp.status} {result.get("error")}')
+        return result
+
+    def health(self):
+        return self.call('GET', '/health')
+
+    def reload(self):
+        return self.call('POST', '/reload', {})
+
+    def score(self, race_ids=None):
+        return to_frame(self.call('POST', '/score', {'race_ids': race_ids or []}))
+
+    def ev(self, race_id=None, bet_type='3rentan'):
+        result = self.call('POST', '/ev', {'race_id': race_id, 'bet_type': bet_type})
+        return to_frame(result['tickets']), to_frame(result['races'])
+
+    def summary(self):
+        return to_frame(self.call('GET', '/summary'))
+
+    def recommend(self):
+        return to_frame(self.call('GET', '/recommend'))
+
+
+def to_frame(t):
+    """サーバーが返した表({"columns", "data"})を DataFrame に戻す。"""
+    return pd.DataFrame(t['data'], columns=t['columns'])
+
+
+# ---------------------------------------------------------------------------
+# 各スクリプトの代わり
+# ---------------------------------------------------------------------------
+def run_t_race(client):
+    import t_race
+    t_race.write_outputs(client.score(), client.summary())
+
+
+def run_daily(client):
+    import daily_predict
+    daily_predict.write_outputs(client.recommend())
+
+
+def run_ev(client, bet_type):
+    out_tickets, out_races = EV_OUTPUTS[bet_type]
+    df_tickets, df_race = client.ev(bet_type=bet_type)
+    if df_tickets.empty:
+        raise RuntimeError('EV計算結果が0件でした（オッズ取得/結合に失敗している可能性）')
+    df_tickets.to_csv(out_tickets, encoding='utf-8-sig', index=False)
+    df_race.to_csv(out_races, encoding='utf-8-sig', index=False)
+    print(f'[OK] チケットEV一覧: {out_tickets}')
+    print(f'[OK] レースEVランキング: {out_races}')
+    if bet_type == '3rentan':
+        # ev_ranker.py の __main__ と同じく、書き出したレースEVランキングを読み直して Kelly の賭け金も出す
+        from ev_ranker import add_kelly_for_best_bet
+        df_kelly = add_kelly_for_best_bet(pd.read_csv(out_races, encoding='utf-8-sig'), bankroll=50000)
+        df_kelly.to_csv('keirin_kelly_bets.csv', index=False, encoding='utf-8-sig')
+        print(f'[OK] Kelly 賭け金: keirin_kelly_bets.csv ({len(df_kelly)}件, 合計 {df_kelly["stake"].sum():,}円)')
+    print(df_race.head(20))
+
+
+# ---------------------------------------------------------------------------
+# ベンチマーク
+# ---------------------------------------------------------------------------
+def bench(client, endpoint='score', n_requests=200, concurrency=4, bet_type='3rentan'):
+    """endpoint に n_requests 回(concurrency 本ずつ並行して)問い合わせ、応答時間を表示して返す。"""
+    race_ids = client.score()['race_id'].astype(str).unique().tolist()
+    calls = {
+        'score': lambda i: client.score([race_ids[i % len(race_ids)]]),
+        'ev': lambda i: client.ev(race_ids[i % len(race_ids)], bet_type),
+        'summary': lambda i: client.summary(),
+        'recommend': lambda i: client.recommend(),
+    }
+    call = calls[endpoint]
+
+    def timed(i):
+        t = time.perf_counter()
+        call(i)
+        return time.perf_counter() - t
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        latencies = pd.Series(list(ex.map(timed, range(n_requests)))) * 1000
+    elapsed = time.perf_counter() - t0
+    print(f'{endpoint}: {n_requests}回 / 並行 {concurrency}  {n_requests / elapsed:.1f} 回/秒  '
+          f'中央値 {latencies.median():.1f}ms  95%点 {latencies.quantile(0.95):.1f}ms  最大 {latencies.max():.1f}ms')
+    return latencies
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--socket', default=None, help='predict_server.py --socket のパス')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('t_race', help='src/t_race.py と同じ CSV を書く')
+    sub.add_parser('daily', help='daily_predict.py と同じ CSV を書く')
+    p_ev = sub.add_parser('ev', help='src/ev_ranker.py(--bet-type 2shahuku なら ev_ranker_2shahuku.py)と同じ CSV を書く')
+    p_ev.add_argument('--bet-type', default='3rentan', choices=sorted(EV_OUTPUTS))
+    p_score = sub.add_parser('score', help='選手ごとのスコアを表示する')
+    p_score.add_argument('race_ids', nargs='*')
+    sub.add_parser('reload', help='サーバーにモデルを読み直させる')
+    p_bench = sub.add_parser('bench', help='負荷をかけて応答時間を計る')
+    p_bench.add_argument('--endpoint', default='score', choices=['score', 'ev', 'summary', 'recommend'])
+    p_bench.add_argument('--requests', type=int, default=200)
+    p_bench.add_argument('--concurrency', type=int, default=4)
+    p_bench.add_argument('--bet-type', default='3rentan', choices=sorted(EV_OUTPUTS))
+    args = parser.parse_args()
+
+    client = PredictClient(args.url, args.socket)
+    if args.cmd == 't_race':
+        run_t_race(client)
+    elif args.cmd == 'daily':
+        run_daily(client)
+    elif args.cmd == 'ev':
+        run_ev(client, args.bet_type)
+    elif args.cmd == 'score':
+        print(client.score(args.race_ids).to_string(index=False))
+    elif args.cmd == 'reload':
+        print(f"モデルを読み直しました: {client.reload()['model_version']}")
+    else:
+        bench(client, args.endpoint, args.requests, args.concurrency, args.bet_type)
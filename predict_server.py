@@ -0,0 +1,225 @@
+"""
+predict_server.py
+------------------
+予想の各段階(src/t_race.py / daily_predict.py / src/ev_ranker.py / src/ev_ranker_2shahuku.py)を
+1つのプロセスに常駐させ、HTTP(または Unix ソケット)で呼べるようにするサーバー。
+
+それぞれのスクリプトを別々に起動すると、そのたびに pandas / sklearn の import とモデル・カテゴリ変換表・
+選手マスターの読み込みからやり直すので、欠車やオッズの更新のあとに計算し直すだけでも毎回その分待つことになる。
+ここでは
+
+  - モデル一式(models/CURRENT のバンドル)とクラス別モデル(native_models/)は起動時に1回だけ読む
+  - 選手マスターは開いたものを使い回す(rider_master.open_master。作り直されたら開き直す)
+  - 本日分の入力(出走表・レース情報・選手マスター)は、ファイルが変わったときだけ読み直して予測し直す
+    (変わっていなければ前回の結果をそのまま返す。変わっていても、計算し直すのは行が変わったレースだけ。
+    src/race_cache.py)
+  - オッズは odds_snapshot.load_or_take で取る(odds_poller が動いていれば最新のものを使う)
+
+API(結果は JSON。表は {"columns": [...], "data": [[...], ...]} の形):
+
+  GET  /health                           モデルのバージョンと、今の予測をいつ作ったか
+  POST /score      {"race_ids": [...]}   選手ごとの prediction_score_top3 / prediction_score_1st(省略時は全レース)
+  POST /ev         {"race_id": ..., "bet_type": "3rentan" | "2shahuku"}
+                                         買い目ごとの p / odds / EV と、レースごとの最大EV(race_id 省略時は全レース)
+  GET  /summary                          t_race.py のレース単位集計(A率〜I率・CT値・スコア・運用判定)
+  GET  /recommend                        daily_predict.py の全レースの一覧(自信度・判定・推奨3車ボックス)
+  POST /reload                           モデルを読み直す(model_registry.py で promote / rollback したあと)
+
+    python predict_server.py [--port 8765 | --socket /tmp/keirin_predict.sock] [--model-version VERSION]
+
+同じ CSV を書くクライアントと負荷をかけて計るベンチマークは predict_client.py。
+"""
+import argparse
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import daily_predict  # src を sys.path に足すのもここで行われる
+import ev_ranker
+import ev_ranker_2shahuku
+import odds_snapshot
+import t_race
+from model_registry import ModelRegistry
+
+DEFAULT_PORT = 8765
+RANKERS = {'3rentan': ev_ranker, '2shahuku': ev_ranker_2shahuku}
+
+
+def file_stamp(paths):
+    """入力ファイルの (サイズ, 更新時刻) の並び。変わっていれば予測し直す。"""
+    return [[st.st_size, st.st_mtime_ns] for st in map(os.stat, paths)]
+
+
+def table(df):
+    """DataFrame を JSON で返せる {"columns": [...], "data": [[...], ...]} にする。"""
+    return df.to_dict(orient='split', index=False)
+
+
+class PredictionService:
+    """読み込んだモデルと、本日分の予測結果を持つ。"""
+
+    def __init__(self, model_version=None):
+        self.model_version = model_version
+        self.lock = threading.Lock()
+        self._stamp = None
+        self._today = None
+        self.reload()
+
+    def reload(self, body=None):
+        """モデル一式とクラス別モデルを読み直す(次の問い合わせで予測し直す)。"""
+        models = ModelRegistry(daily_predict.MODEL_DIR).open(self.model_version)
+        for name in ('stage1_model', 'stage2_model'):
+            models[name]
+        models_top3, model_1st = t_race.load_class_models()
+        with self.lock:
+            self.models, self.models_top3, self.model_1st = models, models_top3, model_1st
+            self._stamp = None
+        return self.health()
+
+    def today(self):
+        """本日分の予測。入力ファイルが前回と変わっていれば計算し直す。"""
+        stamp = file_stamp(t_race.today_paths())
+        with self.lock:
+            if stamp != self._stamp:
+                scored, summary = t_race.score_today(self.models_top3, self.model_1st)
+                self._today = {
+                    'predictions': t_race.prediction_table(scored),
+                    'summary': t_race.race_summary_table(summary),
+                    'recommend': daily_predict.predict_today(self.models),
+                    'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                }
+                self._stamp = stamp
+            return self._today
+
+    # ---------------- API ----------------
+    def health(self, body=None):
+        return {
+            'model_version': self.models['version'],
+            'updated_at': self._today['updated_at'] if self._today else None,
+        }
+
+    def score(self, body):
+        pred = self.today()['predictions']
+        race_ids = body.get('race_ids')
+        if race_ids:
+            pred = pred[pred['race_id'].astype(str).isin([str(r) for r in race_ids])]
+        return table(pred)
+
+    def ev(self, body):
+        bet_type = body.get('bet_type', '3rentan')
+        if bet_type not in RANKERS:
+            raise ValueError(f'bet_type は {list(RANKERS)} のどれか: {bet_type}')
+        pred = self.today()['predictions']
+        by_race = dict(tuple(pred.groupby(pred['race_id'].astype(str))))
+        race_ids = [str(body['race_id'])] if body.get('race_id') else list(by_race)
+
+        odds_all = odds_snapshot.load_or_take(race_ids, bet_type)
+        odds_by_race = dict(tuple(odds_snapshot.to_wide(odds_all, bet_type).groupby('race_id')))
+        rows = []
+        for rid in race_ids:
+            rows += RANKERS[bet_type].race_tickets(rid, by_race.get(rid, pred.iloc[:0]), odds_by_race.get(rid))
+        tickets = ev_ranker.ticket_table(rows)
+        races = ev_ranker.rank_races(tickets) if not tickets.empty else tickets
+        return {'tickets': table(tickets), 'races': table(races)}
+
+    def summary(self, body=None):
+        return table(self.today()['summary'])
+
+    def recommend(self, body=None):
+        return table(self.today()['recommend'])
+
+
+ROUTES = {
+    ('GET', '/health'): PredictionService.health,
+    ('POST', '/score'): PredictionService.score,
+    ('POST', '/ev'): PredictionService.ev,
+    ('GET', '/summary'): PredictionService.summary,
+    ('GET', '/recommend'): PredictionService.recommend,
+    ('POST', '/reload'): PredictionService.reload,
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method):
+        route = ROUTES.get((method, urlsplit(self.path).path))
+        if route is None:
+            return self._send(404, {'error': f'{method} {self.path} はありません'})
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+            self._send(200, route(self.server.service, body))
+        except (KeyError, ValueError) as e:
+            self._send(400, {'error': f'{type(e).__name__}: {e}'})
+        except Exception as e:
+            traceback.print_exc()
+            self._send(500, {'error': f'{type(e).__name__}: {e}'})
+
+    def _send(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix ソケットでは client_address が空文字になる
+        return self.client_address[0] if self.client_address else 'unix'
+
+
+if hasattr(socket, 'AF_UNIX'):
+    class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+def serve(service, port=DEFAULT_PORT, socket_path=None):
+    if socket_path:
+        if not hasattr(socket, 'AF_UNIX'):
+            raise SystemExit('この環境では Unix ソケットを使えません(--port を使ってください)')
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server, where = UnixHTTPServer(socket_path, Handler), socket_path
+    else:
+        server, where = ThreadingHTTPServer(('127.0.0.1', port), Handler), f'http://127.0.0.1:{port}'
+    server.service = service
+    print(f'予想サーバーを起動しました: {where}(モデル: {service.models["version"]})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == '__main__':
+    # 出力をUTF-8に強制(t_race.py と同じ)
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', line_buffering=True)
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', line_buffering=True)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--socket', default=None, help='Unix ソケットのパス(指定すると --port は使わない)')
+    parser.add_argument('--model-version', default=None, help='使うモデルのバージョン(省略時は models/CURRENT)')
+    parser.add_argument('--no-warmup', action='store_true', help='起動時に本日分の予測を作らない')
+    args = parser.parse_args()
+
+    service = PredictionService(args.model_version)
+    if not args.no_warmup:
+        service.today()
+    serve(service, args.port, args.socket)
@@ -8,21 +8,57 @@ from datetime import datetime, timedelta
 import calendar
 import sys
 
+import kdreams_http
+from race_id_index import DEFAULT_INDEX_PATH, RaceIdIndex, kaisai_date
 
-def race_id_scrape(kaisai_nengetu) :
 
-    session = requests.Session() # ★★★ 1. セッションオブジェクトを作成 ★★★
-    
-    ul1 = "https://keirin.kdreams.jp/gamboo/schedule/search/" + kaisai_nengetu
-    #res = requests.get(ul1)
-    res = session.get(ul1) # ★★★ 2. session.get() を使用 ★★★
-    res.encoding = ['EUC-JP']
-    soup = BeautifulSoup(res.text, 'html.parser')
-    kaisai_sches = soup.find_all('td',attrs={'class':'kaisai'}) 
+def fetch_soup(url):
+    """
+    url のページを BeautifulSoup にして返す。ページが無い(404)ときは空のページにして、
+    開催日数0・開催中止(レース数が取れない)と同じ扱いにする。
+    それ以外のエラー(5xx など一時的なもの)は None を返す。呼び出し側はその開催日を確定させず、次回取り直す。
+    """
+    try:
+        html = kdreams_http.fetch_text(url)
+    except requests.HTTPError as e:
+        print(url, 'ページを取得できませんでした', e)
+        if e.response is None or e.response.status_code != 404:
+            return None
+        html = ''
+    return BeautifulSoup(html, 'html.parser')
+
+
+def race_id_scrape(kaisai_nengetu, index_path=DEFAULT_INDEX_PATH) :
+    """
+    kaisai_nengetu("YYYY/MM/")に開催される全レースのIDを返す。
+    開催日数・レース数は race_id_index(SQLite)に記録し、確定済みの開催日は再取得しない。
+    月末を過ぎて全開催日が確定済みの月は、スケジュールページも含めて一切アクセスしない。
+    """
+    index = RaceIdIndex(index_path)
+    try:
+        return _race_id_scrape(kaisai_nengetu, index)
+    finally:
+        index.close()
+
+
+def _race_id_scrape(kaisai_nengetu, index):
     nen = kaisai_nengetu[0:4]
     gatu = kaisai_nengetu[5:7]
     first_day = datetime.strptime(kaisai_nengetu + '01',"%Y/%m/%d")
     last_day = datetime.strptime(kaisai_nengetu + str(calendar.monthrange(int(nen), int(gatu))[1]),"%Y/%m/%d")
+    today = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+    month_key = nen + gatu
+
+    # ------------------- 確定済みの月は索引だけで返す -------------------
+    if index.month_complete(month_key):
+        all_race_ids = index.race_ids(index.days_in_range(first_day, last_day))
+        print(' {}年 {}月 は確定済みのため、索引から {} レースのIDを返します。'.format(nen,gatu,len(all_race_ids)))
+        return all_race_ids
+
+    ul1 = "https://keirin.kdreams.jp/gamboo/schedule/search/" + kaisai_nengetu
+    # 取得はキャッシュ・レート制御付きの共通レイヤー経由（--replay でオフライン再実行可）
+    soup = BeautifulSoup(kdreams_http.fetch_text(ul1), 'html.parser')
+    kaisai_sches = soup.find_all('td',attrs={'class':'kaisai'}) 
     kaisai_lists = []
     kaisai_list = []
 
@@ -42,26 +78,32 @@ def race_id_scrape(kaisai_nengetu) :
     print('開催の日数をを調べます。')
     
     race_id_url = 'https://keirin.kdreams.jp/gamboo/keirin-kaisai/race-card/result/'
+    # 取れなかったページがあれば、この月は確定させない(次回取り直す)
+    all_days_complete = True
 
 
     for i in tqdm(range(len(kaisai_lists))): #len(kaisai_lists)
-        
-        
-        # ------------------------URLの生成-------------------------------
-        race_id_2 = kaisai_lists[i]
-        race_id_1 = kaisai_lists[i] [0:10]
-        race_id_3 = '01/'
-        race_url = race_id_url + race_id_1 +"/"+race_id_2+"/"+race_id_3
-        
-        # -----------------------htmlの取得-------------------------------
-        #race_id_res = requests.get(race_url)
-        race_id_res = session.get(race_url) # ★★★ 3. session.get() を使用 ★★★
-        race_id_res.encoding = ['EUC-JP']
-        race_id_soup = BeautifulSoup(race_id_res.text, 'html.parser')
-        
-        # -----------------------開催日数の所得------------------------------
-        day_len = len(race_id_soup.find_all('span',attrs={'class':'day'}))
         date_str = kaisai_lists[i]
+
+        # -----------------------索引に開催日数があれば取得しない--------------
+        day_len = index.series_days(date_str)
+        if day_len is None:
+            # ------------------------URLの生成-------------------------------
+            race_id_2 = kaisai_lists[i]
+            race_id_1 = kaisai_lists[i] [0:10]
+            race_id_3 = '01/'
+            race_url = race_id_url + race_id_1 +"/"+race_id_2+"/"+race_id_3
+
+            # -----------------------htmlの取得-------------------------------
+            race_id_soup = fetch_soup(race_url)
+            if race_id_soup is None:
+                all_days_complete = False
+                continue
+
+            # -----------------------開催日数の所得------------------------------
+            day_len = len(race_id_soup.find_all('span',attrs={'class':'day'}))
+            if day_len > 0:
+                index.set_series_days(date_str, day_len)
         
     
         # -----------------------開催日数分のリストを追加---------------------
@@ -72,14 +114,11 @@ def race_id_scrape(kaisai_nengetu) :
             date_list = ''.join(date_list)
             kaisai_lists.append(date_list) 
     
-        sleep(0.4)        
     kaisai_lists.sort()    
     
     # -----------------------------月始から月末までを抜き取る ----------------
     for lis in kaisai_lists:
-        r_date = datetime.strptime(lis[2:6]+'/'+lis[6:8]+'/'+lis[8:10],"%Y/%m/%d")
-        ad_date = int(lis[10:12])-1
-        r_date = r_date + timedelta(days=ad_date)
+        r_date = kaisai_date(lis)
         
         if first_day <= r_date <= last_day :
             kaisai_list.append(lis)
@@ -94,17 +133,28 @@ def race_id_scrape(kaisai_nengetu) :
     
     for i in tqdm(range(len(kaisai_list))):#len(kaisai_lists)
         race_id_2 = kaisai_list[i]
+
+        # -----------------------確定済みの開催日は索引から--------------------
+        known = index.day(race_id_2)
+        if known is not None and known[1]:
+            all_race_ids.extend(index.race_ids([race_id_2]))
+            continue
+
+        # 前日以前の開催日は、ここで取ったレース数が最終値になる
+        day_is_past = kaisai_date(race_id_2) < today
+        if not day_is_past:
+            all_days_complete = False
+
         race_id_1 = kaisai_list[i] [0:10]
         race_id_3 = '01/'
         race_url = race_id_url + race_id_1 +"/"+race_id_2+"/"+race_id_3
         
         # -----------------------htmlの取得-------------------------------
-        #race_id_res = requests.get(race_url)
-        race_id_res = session.get(race_url) # ★★★ 4. session.get() を使用 ★★★
-        race_id_res.encoding = ['EUC-JP']
-        race_id_soup = BeautifulSoup(race_id_res.text, 'html.parser')
-        
-        sleep(0.4)
+        race_id_soup = fetch_soup(race_url)
+        if race_id_soup is None:
+            # 一時的なエラー。索引には入れず、次回この開催日を取り直す
+            all_days_complete = False
+            continue
         
         #------------------------レース数の取得----------------------------
         try:
@@ -115,17 +165,22 @@ def race_id_scrape(kaisai_nengetu) :
                     all_race_url_num = str(j).zfill(2)
                     all_race_id = str(race_id_2+all_race_url_num)
                     all_race_ids.append(all_race_id)
-                else:
-                    continue
+                index.set_day(race_id_2, race_max_num, day_is_past)
                 
         except AttributeError:
-            print(all_race_id,'開催が中止されています')
+            print(race_id_2,'開催が中止されています')
+            index.set_day(race_id_2, 0, day_is_past)
                     
             
         except IndexError:
             print('レースが中止されています')
+            index.set_day(race_id_2, 0, day_is_past)
             
     
+    # 月末を過ぎ、全開催日のレース数が確定していれば、次回からこの月は一切取得しない
+    if last_day < today and all_days_complete:
+        index.set_month_complete(month_key)
+
     print(' {}年 {}月 の全 {} レースのIDを取得しました。'.format(nen,gatu,len(all_race_ids)))
     
     return all_race_ids
@@ -8,257 +8,302 @@ from datetime import datetime, timedelta
 import calendar
 import sys
 from io import StringIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def race_data_scrape(race_ids):
+import kdreams_http
+import line_formation
+import race_page_parser
+from race_store import RaceStore
+
+RESULT_URL = 'https://keirin.kdreams.jp/gamboo/keirin-kaisai/race-card/result/'
+RACE_GRS = ['ＧＰ','Ｇ１','Ｇ２','Ｇ３','Ｆ１','Ｆ２']
+
+# 同時に投げるリクエスト数。実際のアクセス間隔は kdreams_http のレート制御で決まる
+DEFAULT_MAX_WORKERS = 4
+
+
+def build_result_url(race_id):
+    ur_1 = race_id[:10]
+    ur_2 = race_id[:-2]
+    ur_3 = race_id[-2:]
+    return RESULT_URL + ur_1 + '/' + ur_2 + '/' + ur_3
+
+
+def extract_page_bs4(html_text):
+    """
+    従来方式(BeautifulSoup + ページ全体の pd.read_html)で解析素材を取り出す。
+    本番は race_page_parser.extract_page(lxml 1パース)を使う。こちらはベンチマーク・突き合わせ用。
+    """
+    soup = BeautifulSoup(html_text,'html.parser')
+    p_htm = pd.read_html(StringIO(html_text))
+
+    if len(p_htm) == 8:
+        tables = (pd.DataFrame(p_htm[0]), pd.DataFrame(p_htm[6]), pd.DataFrame(p_htm[7]))
+    elif len(p_htm) > 4:
+        tables = (pd.DataFrame(p_htm[0]), pd.DataFrame(p_htm[3]), pd.DataFrame(p_htm[4]))
+    else:
+        tables = None
+
+    line_div = soup.find('div',attrs={'class':'line_position_inner'})
+    header_div = soup.find('div', attrs={'class': "race_header"})
+    header_span = header_div.find('span') if header_div else None
+    title_div = soup.find('div', attrs={'class': "race_title_header"})
+    title_span = title_div.find('span') if title_div else None
+    stadium_span = soup.find('span', attrs={'class': "velodrome"})
+    name_span = soup.find('span', attrs={'class': "race"})
+    grade_h1 = soup.find('h1', attrs={'class': "section_title"})
+    time_dl = soup.find('dl', attrs={'class': "time"})
+    dd_elements = time_dl.find_all('dd') if time_dl else []
+    weather_p = soup.find('p', attrs={'class': "weather_info"})
+
+    return {
+        'tables': tables,
+        'line_text': line_div.text if line_div else None,
+        'has_header': header_div is not None,
+        'header_text': header_span.text if header_span else None,
+        'has_title': title_div is not None,
+        'title_text': title_span.text if title_span else None,
+        'stadium': stadium_span.text if stadium_span else None,
+        'race_name': name_span.text if name_span else None,
+        'grade_text': grade_h1.text if grade_h1 else None,
+        'start_time': dd_elements[0].text if len(dd_elements) > 0 else None,
+        'weather_spans': [sp.text for sp in weather_p.find_all('span')] if weather_p else None,
+    }
+
+
+def parse_race_page(id_a, html_text, extract=race_page_parser.extract_page):
+    """
+    レース結果ページ1件分のHTMLから (レース情報dict, 出走表DataFrame, 払戻DataFrame) を作る。
+    どこかで解析に失敗したレースは None を返す(従来どおりスキップ扱い)。
+    HTMLの解析は extract(既定は lxml 1パースの race_page_parser.extract_page)に任せる。
+    """
+    race_grs = RACE_GRS
+    try:
+        page = extract(html_text)
+    except Exception as e:
+        print('エラー')
+        return None
+
+    try:
+        pd_racecard, pd_raceresult, pd_harai = page['tables']
+
+        # --- ここから修正コードを挿入 ---
+        # 払戻金テーブルのヘッダーがMultiIndex（階層的）かチェック
+        if isinstance(pd_harai.columns, pd.MultiIndex):
+            # MultiIndexをフラットな1階層のインデックスに変換
+            # 例: ('2車単', '車番') -> '2車単_車番' という文字列に結合
+            pd_harai.columns = ['_'.join(map(str, col)).strip() for col in pd_harai.columns.values]
+        # --- ここまで ---
+
+        #race_grs = ['ＧＰ','Ｇ１','Ｇ２','Ｇ３','Ｆ１','Ｆ２']
+        setcol = [ '予 想', '好 気 合',  '総 評', '枠 番', '車 番','選手名 府県/年齢/期別', '級 班', '脚 質','ギヤ 倍数', '競走得点',  'S', 'B', '逃', '捲', '差', 'マ', '1 着', '2 着', '3 着', '着 外', '勝 率', '2連 対率', '3連 対率', 'level_1','level_2']
+        pd_racecard.columns = setcol
+
+        pd_racecard = pd_racecard.drop(['好 気 合','level_1','level_2'],axis=1)
+        pd_raceresult = pd_raceresult.sort_values('車 番')
+        pd_raceresult = pd_raceresult.drop(['着差','上り','決ま り手','S ／ B','勝敗因'],axis=1)
+
+        pd_racecard = pd.merge(pd_racecard,pd_raceresult,how='inner')
+    except:
+        pass
+
+    # -----------------------選手名 府県/年齢/期別を分ける ----------------
+    try:
+        age = []
+        gr_class = []
+        sensyu = []
+        #　name_sp = pd.DataFrame(columns=['name','age','class'])
+        for name in pd_racecard['選手名 府県/年齢/期別']:
+            if '（欠車）' in name:
+                #print('（欠車）あり')
+                name = name.replace('（欠車）','')
+            age.append(int(name.split('/')[1]))
+            gr_class.append(int(name.split('/')[2]))
+            sensyu.append(name.split(' ')[0] + ' ' + name.split(' ')[1])
+        pd_racecard['選手名'] = sensyu
+        pd_racecard['年齢'] = age
+        pd_racecard['期別'] = gr_class
+        pd_racecard = pd_racecard.drop(['選手名 府県/年齢/期別'],axis=1)
+
+        pd_racecard = pd_racecard.loc[:,['予 想','着 順', '総 評', '枠 番', '車 番', '選手名','競走得点','年齢','期別','級 班', '脚 質', 'ギヤ 倍数','S', 'B',
+            '逃', '捲', '差', 'マ', '1 着', '2 着', '3 着', '着 外', '勝 率', '2連 対率', '3連 対率'
+                ]]
+    except:
+        pass
+
+    #pd_racecard.insert(loc = 0,column ='ID',value =all_race_ids['ID'][i])
+
+    #-----------------------ライン構成の読み取り ----------------
+    try:
+        lines = line_formation.parse_line_text(page['line_text'])
+    except:
+        pass
+
+    #----------------------ライン構成の分析 ------------------
+    try:
+        make_line = line_formation.make_line(lines, len(pd_racecard))
+        line_count, kousei2 = line_formation.line_summary(lines)
+
+        # ----------------------ライン構成を追加 ----------------------------
+        pd_make_line = pd.DataFrame(make_line)
+
+        pd_make_line.columns=['車 番','ライン','番手']
+        pd_racecard2 = pd.merge(pd_racecard,pd_make_line,how='inner')
+
+        # ---------------------競走得点順位を追加 -----------------------
+        toku_jyun = [i for i in range(1,len(pd_make_line)+1)]
+        pd_racecard2 = pd_racecard2.sort_values('競走得点',ascending=False)
+        pd_racecard2['得点順位']=toku_jyun
+        pd_racecard2 = pd_racecard2.sort_values('車 番')
+    except:
+        pass
+
+
+    #----------------------re-suinnfome-syonn ---------------------
+
+    #----------------------re-suinnfome-syonn ---------------------
+    try:
+        if not page['has_header'] or not page['has_title']:
+            raise ValueError('race_header / race_title_header が見つかりません')
+
+        race_header = page['header_text']
+        if race_header is not None:
+            race_info_header = re.findall(r'\w+', race_header)
+            race_info_day = id_a[2:6] + '-' + race_info_header[2][:2] + '-' + race_info_header[2][3:5]
+        else:
+            race_info_header = ['不明'] * 4
+            race_info_day = '不明'
+
+        race_title = page['title_text'] if page['title_text'] is not None else '不明'
+
+        race_stadium = page['stadium'] if page['stadium'] is not None else '不明'
+
+        race_name = "".join(page['race_name'].split('\u3000')) if page['race_name'] is not None else '不明'
+
+        grade_text = page['grade_text']
+        race_gr = [t for t in race_grs if t in grade_text][0] if grade_text is not None else '不明'
+
+        # エラーの原因箇所を修正
+        race_start_time = page['start_time'] if page['start_time'] is not None else '不明'
+
+        # エラーの原因箇所を修正
+        race_condition_weather = '不明'
+        race_condition_wind = '不明'
+        race_condition_spans = page['weather_spans']
+        # weather_infoが見つかった場合のみ、中の情報を探しにいく
+        if race_condition_spans is not None:
+            # 取得したspanが1つ以上あれば、1つ目から天気を取得
+            if len(race_condition_spans) > 0:
+                race_condition_weather = race_condition_spans[0][-1]
+            # 取得したspanが2つ以上あれば、2つ目から風速を取得
+            if len(race_condition_spans) > 1:
+                race_condition_wind = race_condition_spans[1][2:-1]
+
+        info = {'レースタイトル': race_title, '競輪場': race_stadium, 'レース名': race_name, 'グレード': race_gr,
+                        '開始時間': race_start_time, '天気': race_condition_weather, '風速': race_condition_wind,
+                        'レース番号': race_info_header[0], '開催日': race_info_day, '開催番号': race_info_header[3], '車立': len(pd_racecard),
+                        'ライン数': line_count, 'ライン構成': kousei2}
+
+        # ★ここが最重要：race_cardに race_id 列を付ける
+        pd_racecard2["race_id"] = str(id_a)
+
+        # （任意）indexにも残すならOK            
+        pd_racecard2.index = [id_a] * len(pd_racecard2)
+    
+        # ★払戻も後で使うなら列を付ける（強く推奨）
+        pd_harai["race_id"] = str(id_a)
+
+        pd_harai.index = [id_a] * len(pd_harai)
+
+        return info, pd_racecard2, pd_harai
+
+    except Exception as e:
+        # 修正後もエラーが出る場合は、ここで確認
+        print(f"--- 情報取得ブロックで予期せぬエラー ---")
+        print(f"レースID: {id_a}")
+        print(f"エラー内容: {e}")
+        print(f"------------------------------------")
+        return None
+
+def _scrape_one(race_id):
+    try:
+        html_text = kdreams_http.fetch_text(build_result_url(race_id))
+    except Exception as e:
+        print('エラー')
+        return None
+    return parse_race_page(race_id, html_text)
+
+
+def race_data_scrape(race_ids, max_workers=DEFAULT_MAX_WORKERS, store_dir=None):
+    """
+    race_ids のレース結果ページを max_workers 本並列で取得・解析する。
+    アクセス間隔はホスト単位のトークンバケット(kdreams_http)で制御するので、
+    並列数を増やしてもサーバーへの負荷は一定のまま、往復待ちだけが重なって速くなる。
+    戻り値は従来どおり (info_table, entry_table, return_table) で、並びは race_ids の順。
+
+    store_dir を指定すると、解析できたレースを race_store.RaceStore(開催日ごとのpickle +
+    進捗manifest)へ開催日がそろうたびに書き出し、全期間ぶんはメモリに溜めない。途中で落ちても、
+    同じ store_dir で再実行すれば保存済みの race_id は飛ばして続きから取得する。
+    戻り値は最後に store から読み直したもの。
+    """
+    store = RaceStore(store_dir) if store_dir is not None else None
+    targets = store.pending(race_ids) if store is not None else list(race_ids)
+    if store is not None:
+        if len(targets) < len(race_ids):
+            print(f'保存済みの {len(race_ids) - len(targets)} レースをスキップします。')
+        store.expect(targets)
+
+    results = {}
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {executor.submit(_scrape_one, race_id): race_id for race_id in targets}
+    try:
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            race_id = futures[future]
+            parsed = future.result()
+            if store is None:
+                if parsed is not None:
+                    results[race_id] = parsed
+            elif parsed is None:
+                store.skip(race_id)
+            else:
+                store.append(race_id, *parsed)
+    except BaseException:
+        # Ctrl-C や解析エラーで止まったら、待ち行列に残っている取得は捨てる
+        # (with 文のように全部の取得が終わるのを待つと、長期間の取得では何時間も止まらない)
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    else:
+        executor.shutdown()
+    finally:
+        # 途中で止まっても、そこまでに届いたレースは書き出しておく
+        if store is not None:
+            store.close()
+
+    if store is not None:
+        return store.load(race_ids)
+
+    info_table = {}
     entry_table = {}
     return_table = {}
-    info_table = {}
+    for race_id in race_ids:
+        if race_id not in results:
+            continue
+        info_table[race_id], entry_table[race_id], return_table[race_id] = results[race_id]
 
-    race_grs = ['ＧＰ','Ｇ１','Ｇ２','Ｇ３','Ｆ１','Ｆ２']
-
-    session = requests.Session() # ループの前にセッションオブジェクトを作成
-
-    try:  
-        for i in tqdm(range(len(race_ids))):
-            try:
-                ur_1 = race_ids[i][:10]
-                ur_2 = race_ids[i][:-2]
-                ur_3 = race_ids[i][-2:]
-                url = 'https://keirin.kdreams.jp/gamboo/keirin-kaisai/race-card/result/'+ur_1+'/'+ur_2+'/'+ur_3       
-                #html = requests.get(url)
-                html = session.get(url) # requests.get()の代わりにsession.get()を使う
-                html.encoding = ["EUC-JP"]
-                soup = BeautifulSoup(html.text,'html.parser')
-                #p_htm = pd.read_html(url)
-                p_htm = pd.read_html(StringIO(html.text))
-
-                id_a = race_ids[i]
-            except Exception as e:
-                print('エラー')
-                
-            sleep(0.4)
-            try:
-                if len(p_htm) == 8:
-                    pd_racecard = pd.DataFrame(p_htm[0])
-                    pd_raceresult = pd.DataFrame(p_htm[6])
-                    pd_harai = pd.DataFrame(p_htm[7])
-                else:
-                    pd_racecard = pd.DataFrame(p_htm[0])
-                    pd_raceresult = pd.DataFrame(p_htm[3])
-                    pd_harai = pd.DataFrame(p_htm[4]) 
-                
-                # --- ここから修正コードを挿入 ---
-                # 払戻金テーブルのヘッダーがMultiIndex（階層的）かチェック
-                if isinstance(pd_harai.columns, pd.MultiIndex):
-                    # MultiIndexをフラットな1階層のインデックスに変換
-                    # 例: ('2車単', '車番') -> '2車単_車番' という文字列に結合
-                    pd_harai.columns = ['_'.join(map(str, col)).strip() for col in pd_harai.columns.values]
-                # --- ここまで ---
-
-                #race_grs = ['ＧＰ','Ｇ１','Ｇ２','Ｇ３','Ｆ１','Ｆ２']
-                setcol = [ '予 想', '好 気 合',  '総 評', '枠 番', '車 番','選手名 府県/年齢/期別', '級 班', '脚 質','ギヤ 倍数', '競走得点',  'S', 'B', '逃', '捲', '差', 'マ', '1 着', '2 着', '3 着', '着 外', '勝 率', '2連 対率', '3連 対率', 'level_1','level_2']
-                pd_racecard.columns = setcol
-
-                pd_racecard = pd_racecard.drop(['好 気 合','level_1','level_2'],axis=1)
-                pd_raceresult = pd_raceresult.sort_values('車 番')
-                pd_raceresult = pd_raceresult.drop(['着差','上り','決ま り手','S ／ B','勝敗因'],axis=1)
-
-                pd_racecard = pd.merge(pd_racecard,pd_raceresult,how='inner')
-            except:
-                pass
-                
-            # -----------------------選手名 府県/年齢/期別を分ける ----------------
-            try:
-                age = []
-                gr_class = []
-                sensyu = []
-                #　name_sp = pd.DataFrame(columns=['name','age','class'])
-                for name in pd_racecard['選手名 府県/年齢/期別']:
-                    if '（欠車）' in name:
-                        #print('（欠車）あり')
-                        name = name.replace('（欠車）','')
-                    age.append(int(name.split('/')[1]))
-                    gr_class.append(int(name.split('/')[2]))
-                    sensyu.append(name.split(' ')[0] + ' ' + name.split(' ')[1])
-                pd_racecard['選手名'] = sensyu
-                pd_racecard['年齢'] = age
-                pd_racecard['期別'] = gr_class
-                pd_racecard = pd_racecard.drop(['選手名 府県/年齢/期別'],axis=1)
-
-                pd_racecard = pd_racecard.loc[:,['予 想','着 順', '総 評', '枠 番', '車 番', '選手名','競走得点','年齢','期別','級 班', '脚 質', 'ギヤ 倍数','S', 'B',
-                    '逃', '捲', '差', 'マ', '1 着', '2 着', '3 着', '着 外', '勝 率', '2連 対率', '3連 対率'
-                        ]]
-            except:
-                pass
-
-            #pd_racecard.insert(loc = 0,column ='ID',value =all_race_ids['ID'][i])
-
-            #-----------------------ライン構成の読み取り ----------------
-            try:
-                line_position = soup.find('div',attrs={'class':'line_position_inner'}).text
-                p = line_position.replace('\n',"P")
-                line_n = ['mmmmmm','mmmmmm','mmmmmm','mmmmmm','mmmmmm','mmmmmm','mmmmmm','mmmmmm','mmmmmm',
-                            'mmmmmm','mmmmmm','mmmmmm','mmmmmm','mmmmmm','mmmmmm','mmmmmm','mmmmmm','mmmmmm']
-                
-                n = 0
-                for i in range(len(p)):
-                    
-                    po_1 = p[i-2]
-                    po_2 = p[i-1]
-
-                    if re.findall(r'\d+',p[i]):
-                        n += 1
-                        line_n[n] = str(p[i])
-                        
-                        if po_1 == po_2:
-                            line_n[n] = str("mmmmmm")
-                            n += 1
-                            line_n[n] = str(p[i])
-                        
-                line_n = "".join(line_n) + 'mmmmmm'
-            except:
-                pass
-
-            #----------------------ライン構成の分析 ------------------
-            try:
-                make_line = []
-
-                syusso_n = len(pd_racecard)
-                for j in range(1,syusso_n+1,1):
-                    for k in range(len(line_n)):
-                        check_str = line_n[k]
-                        if str(j) == check_str :
-                            if line_n[k-1]=='m' :
-                                if line_n[k+1] == 'm':
-                                    make_line.append([j,line_n[k],0]) #単騎
-                                else:    
-                                    make_line.append([j,line_n[k],1]) #先頭
-                            else:    
-                                if line_n[k-2] == 'm':
-                                    make_line.append([j,line_n[k-1],2]) #番手
-                                else:
-                                    if line_n[k-3] == 'm':
-                                        make_line.append([j,line_n[k-2],3]) #３番手
-                                    else:
-                                        if line_n[k-4] == 'm':
-                                            make_line.append([j,line_n[k-3],4]) #４番手
-                                        else:
-                                            if line_n[-5] == 'm':
-                                                make_line.append([j,line_n[k-4],5])  #５番手
-                                                
-                line_k = re.findall(r'\d+',line_n)
-                kousei = str()
-                kousei2 = str()
-                for i in range(len(line_k)):
-                    kousei += str(len(line_k[i]))
-                kousei = sorted(kousei,reverse=True)
-                for i in range(len(kousei)):
-                    kousei2 += kousei[i]+'-'
-                kousei2 = kousei2[:-1]
-                
-                # ----------------------ライン構成を追加 ----------------------------
-                pd_make_line = pd.DataFrame(make_line)
-
-                pd_make_line.columns=['車 番','ライン','番手']
-                pd_racecard2 = pd.merge(pd_racecard,pd_make_line,how='inner')
-
-                # ---------------------競走得点順位を追加 -----------------------
-                toku_jyun = [i for i in range(1,len(pd_make_line)+1)]
-                pd_racecard2 = pd_racecard2.sort_values('競走得点',ascending=False)
-                pd_racecard2['得点順位']=toku_jyun
-                pd_racecard2 = pd_racecard2.sort_values('車 番')
-            except:
-                pass
-
-            
-            #----------------------re-suinnfome-syonn ---------------------
-        
-            #----------------------re-suinnfome-syonn ---------------------
-            try:
-                race_header_span = soup.find('div', attrs={'class': "race_header"}).find('span')
-                if race_header_span:
-                    race_header = race_header_span.text
-                    race_info_header = re.findall(r'\w+', race_header)
-                    race_info_day = id_a[2:6] + '-' + race_info_header[2][:2] + '-' + race_info_header[2][3:5]
-                else:
-                    race_info_header = ['不明'] * 4
-                    race_info_day = '不明'
-
-                race_title_span = soup.find('div', attrs={'class': "race_title_header"}).find('span')
-                race_title = race_title_span.text if race_title_span else '不明'
-            
-                race_stadium_span = soup.find('span', attrs={'class': "velodrome"})
-                race_stadium = race_stadium_span.text if race_stadium_span else '不明'
-            
-                race_name_span = soup.find('span', attrs={'class': "race"})
-                race_name = "".join(race_name_span.text.split('\u3000')) if race_name_span else '不明'
-            
-                grade_h1 = soup.find('h1', attrs={'class': "section_title"})
-                race_gr = [t for t in race_grs if t in grade_h1.text][0] if grade_h1 else '不明'
-
-                # エラーの原因箇所を修正
-                race_start_time = '不明'
-                time_dl = soup.find('dl', attrs={'class': "time"})
-                dd_elements = time_dl.find_all('dd') if time_dl else []
-                if len(dd_elements) > 0:
-                    race_start_time = dd_elements[0].text
-
-                # エラーの原因箇所を修正
-                race_condition_weather = '不明'
-                race_condition_wind = '不明'
-                weather_p = soup.find('p', attrs={'class': "weather_info"})
-                # weather_pが見つかった場合のみ、中の情報を探しにいく
-                if weather_p:
-                    race_condition_spans = weather_p.find_all('span') # spanタグをすべて取得
-                    # 取得したspanタグが1つ以上あれば、1つ目から天気を取得
-                    if len(race_condition_spans) > 0:
-                        race_condition_weather = race_condition_spans[0].text[-1]
-                    # 取得したspanタグが2つ以上あれば、2つ目から風速を取得
-                    if len(race_condition_spans) > 1:
-                        race_condition_wind = race_condition_spans[1].text[2:-1]
-
-                info_table[id_a] = {'レースタイトル': race_title, '競輪場': race_stadium, 'レース名': race_name, 'グレード': race_gr,
-                                '開始時間': race_start_time, '天気': race_condition_weather, '風速': race_condition_wind,
-                                'レース番号': race_info_header[0], '開催日': race_info_day, '開催番号': race_info_header[3], '車立': len(pd_racecard),
-                                'ライン数': len(line_k), 'ライン構成': kousei2}
-
-                # ★ここが最重要：race_cardに race_id 列を付ける
-                pd_racecard2["race_id"] = str(id_a)
-
-                # （任意）indexにも残すならOK            
-                pd_racecard2.index = [id_a] * len(pd_racecard2)
-                entry_table[id_a] = pd_racecard2
-
-                # ★払戻も後で使うなら列を付ける（強く推奨）
-                pd_harai["race_id"] = str(id_a)
-            
-                pd_harai.index = [id_a] * len(pd_harai)
-                return_table[id_a] = pd_harai
-            
-            except Exception as e:
-                # 修正後もエラーが出る場合は、ここで確認
-                print(f"--- 情報取得ブロックで予期せぬエラー ---")
-                print(f"レースID: {id_a}")
-                print(f"エラー内容: {e}")
-                print(f"------------------------------------")
-                pass
-        
-    except IndexError:
-        print('中止みたいです')
-        print(id_a) 
-  
-        #---------------------------------------------
+    #---------------------------------------------
     info_table = pd.DataFrame(info_table).T
-    entry_table = pd.concat([entry_table[key] for key in entry_table])        
-    return_table = pd.concat([return_table[key] for key in return_table])          
-            
+    entry_table = pd.concat([entry_table[key] for key in entry_table])
+    return_table = pd.concat([return_table[key] for key in return_table])
+
     return info_table,entry_table,return_table
 
 # main関数
 if __name__ == '__main__':
     #race_ids = pd.read_pickle('race_id_202106-202206.pkl')
     race_ids = pd.read_pickle('race_id_202604-202606.pkl')
-    race_data = race_data_scrape(race_ids)
+    # 途中で落ちても同じフォルダを指定して再実行すれば続きから取得する
+    race_data = race_data_scrape(race_ids, store_dir='race_store_202604-202606')
     pd.to_pickle(race_data[0],'race_info_202604-202606.pkl')
     pd.to_pickle(race_data[1],'race_card_202604-202606.pkl')
     pd.to_pickle(race_data[2].iloc[:,:11],'race_return_202604-202606.pkl')
\ No newline at end of file
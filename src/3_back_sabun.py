@@ -7,12 +7,87 @@ from tqdm import tqdm
 from datetime import datetime, timedelta
 import calendar
 import sys
+import argparse
+
+import numpy as np
+
+import velodrome
+
+# 差分を取る成績列（この順に列が追加される）
+S_LISTS = ['競走得点','B', '逃','捲','差','マ']
+# 1位と2位の差(_sa2)・10以上の人数(_suu)も出す列
+S_LISTS_TOP2 = ('B', '逃')
+
+
+def _car_col(card):
+    # 列名ゆれに対応（車 番 / 車_番）
+    return '車 番' if '車 番' in card.columns else ('車_番' if '車_番' in card.columns else None)
+
+
+def _desc_keys(values):
+    """降順・NaN最後 の並べ替えキー(np.lexsort 用。後ろのキーほど優先)。"""
+    v = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+    nan = np.isnan(v)
+    return [np.where(nan, 0.0, -v), nan]
+
 
 def back_sabun(r_card):
+    """
+    レースごとに、各成績列の「レース内最大値との差」(_sa)、B・逃の「1位と2位の差」(_sa2)と
+    「10以上の人数」(_suu) を付ける。行はレースの登場順、レース内は車番順に並べる。
+
+    全レースを groupby/transform でまとめて計算する(レースごとに card[card.index == id] で
+    抜き出していた back_sabun_loop と同じ結果になる。python src/3_back_sabun.py --check で確認できる。
+    データファイルが無いときは --check-sample で合成した出走表を使う)。
+    車番列が無い場合だけは、同値の行どうしの並びが従来版(安定でない並べ替え)と変わることがある。
+    """
+    card = r_card.copy()
+
+    # レース番号(index)を登場順の連番にする。index が NaN の行は従来どおり落とす
+    codes = pd.factorize(card.index)[0]
+    card = card[codes >= 0]
+    codes = codes[codes >= 0]
+    sizes = np.bincount(codes)[codes]
+
+    for s_list in S_LISTS:
+        values = card[s_list]
+        grouped = values.groupby(codes)
+        card[s_list + '_sa'] = grouped.transform('max') - values
+
+        if s_list in S_LISTS_TOP2:
+            # 降順(NaN最後)に並べたときのレース内1位と2位の差。2行未満のレースは0
+            order = pd.DataFrame({'g': codes, 'v': values.to_numpy()}).sort_values(
+                ['g', 'v'], ascending=[True, False], na_position='last', kind='mergesort')
+            rank = order.groupby('g').cumcount().to_numpy()
+            top1 = pd.Series(order['v'].to_numpy()[rank == 0], index=order['g'].to_numpy()[rank == 0])
+            top2 = pd.Series(order['v'].to_numpy()[rank == 1], index=order['g'].to_numpy()[rank == 1])
+            sa2 = np.where(sizes >= 2, (top1 - top2).reindex(codes).to_numpy(), 0)
+            # 従来はレースごとにスカラーを代入していたので、整数列(または全レース1行)なら整数になる
+            if values.dtype.kind in 'iu' or not (sizes >= 2).any():
+                sa2 = sa2.astype('int64')
+            card[s_list + '_sa2'] = sa2
+
+            card[s_list + '_suu'] = (values >= 10).groupby(codes).transform('sum')
+
+    # 並び順: レースの登場順 -> 車番(NaN最後) -> 従来の並べ替えの名残(最後の成績列の降順 ...)
+    keys = [np.arange(len(card))]
+    for s_list in S_LISTS:
+        keys += _desc_keys(card[s_list])
+    sort_col = _car_col(card)
+    if sort_col is not None:
+        car = pd.to_numeric(card[sort_col], errors='coerce').to_numpy(dtype=float)
+        keys += [np.where(np.isnan(car), 0.0, car), np.isnan(car)]
+    keys.append(codes)
+
+    return card.iloc[np.lexsort(keys)]
+
+
+def back_sabun_loop(r_card):
+    """従来のレースごとのループ版(突き合わせ用)。"""
     card = r_card.copy()
     race_card = {}
     
-    s_lists = ['競走得点','B', '逃','捲','差','マ']
+    s_lists = S_LISTS
     i_lists = card.index.unique()
     for i_list in tqdm(i_lists):
         df = card[card.index == i_list]
@@ -51,6 +126,16 @@ def back_sabun(r_card):
     return race_card
 
 def bankcho(r_info):
+    """競輪場の周長(1周)を data/velodromes.csv から引いて付ける。表に無い競輪場は '400'。"""
+    df = r_info.copy()
+    bank = velodrome.load_velodromes()['1周']
+    stadium = df['競輪場']
+    df['1周'] = velodrome.venue_name(stadium.astype(str)).map(bank).fillna(velodrome.DEFAULT_BANK).where(stadium.notna())
+    return df
+
+
+def bankcho_loop(r_info):
+    """従来の1行ずつ代入する版(突き合わせ用)。"""
     df = r_info.copy()
     list_1 = ['前橋','松戸','小田原','伊東','富山','奈良','防府']
     list_2 = ['大宮','宇都宮','高知','熊本']
@@ -68,12 +153,72 @@ def bankcho(r_info):
         
     return df
 
+def check(r_card, r_info=None):
+    """ベクトル化版とループ版の結果が一致するかを確かめる。"""
+    import time
+    pairs = [('back_sabun', back_sabun, back_sabun_loop, r_card)]
+    if r_info is not None:
+        pairs.append(('bankcho', bankcho, bankcho_loop, r_info))
+
+    for name, fast, loop, data in pairs:
+        t0 = time.perf_counter()
+        expected = loop(data)
+        t1 = time.perf_counter()
+        actual = fast(data)
+        t2 = time.perf_counter()
+        pd.testing.assert_frame_equal(actual, expected)
+        print(f'{name} 一致しました: {len(actual)} 行 / ループ版 {t1 - t0:.1f} 秒, ベクトル化版 {t2 - t1:.2f} 秒')
+
+
+def sample_data(n_races=80, seed=0):
+    """
+    突き合わせ用の合成した (出走表, レース情報)。データファイルが無くても check を回せるように、
+    1〜9車のレース・同じ値の選手・欠損・整数列と小数列・レースの行が離れて並ぶ出走表を混ぜて作る。
+    """
+    rng = np.random.default_rng(seed)
+    race_ids = [f'2320260401{i:04d}' for i in range(n_races)]
+    sizes = rng.integers(1, 10, n_races)
+    rows = []
+    for race_id, size in zip(race_ids, sizes):
+        for car in rng.permutation(size) + 1:
+            rows.append({
+                'race_id': race_id,
+                '車 番': int(car),
+                '競走得点': round(float(rng.normal(95, 8)), 2) if rng.random() > 0.05 else np.nan,
+                'B': int(rng.integers(0, 15)),
+                '逃': int(rng.integers(0, 12)),
+                '捲': float(rng.integers(0, 12)) if rng.random() > 0.1 else np.nan,
+                '差': int(rng.integers(0, 4)),
+                'マ': int(rng.integers(0, 4)),
+            })
+    card = pd.DataFrame(rows).sample(frac=1, random_state=seed).set_index('race_id')
+    card.index.name = None
+
+    venues = list(velodrome.load_velodromes().index) + ['架空']
+    info = pd.DataFrame({'競輪場': [venues[i] + '競輪' for i in rng.integers(0, len(venues), n_races)]},
+                        index=race_ids)
+    return card, info
+
+
 # main関数
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--check', action='store_true', help='ループ版との一致を確認して終了する')
+    parser.add_argument('--check-sample', action='store_true',
+                        help='データファイルを使わず、合成した出走表でループ版との一致を確認して終了する')
+    args = parser.parse_args()
+
+    if args.check_sample:
+        check(*sample_data())
+        sys.exit()
+
     r_syu= pd.read_pickle('race_card_202604-202606.pkl')
+    r_inf = pd.read_pickle('race_info_202604-202606.pkl')
+    if args.check:
+        check(r_syu, r_inf)
+        sys.exit()
     r_syu_s = back_sabun(r_syu)
 
-    r_inf = pd.read_pickle('race_info_202604-202606.pkl')
     r_inf_b = bankcho(r_inf)
 
     pd.to_pickle(r_syu_s,'race_card2_202604-202606.pkl')
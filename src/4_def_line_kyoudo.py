@@ -7,8 +7,122 @@ from tqdm import tqdm
 from datetime import datetime, timedelta
 import calendar
 import sys
+import argparse
 
-def line_kyoudo(race_card):
+import numpy as np
+
+# 強度・強度２・強度３ のライン記号(並べ替え後の位置 -> 記号)
+LINE_LETTERS = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I']
+LINE_LETTERS2 = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i']
+LINE_LETTERS3 = ['AA', 'BB', 'CC', 'DD', 'EE', 'FF', 'GG', 'HH', 'II']
+
+# (出力列, [(並べ替え列, 昇順か), ...], 記号)。並べ替えは 番手 -> (B/捲 の降順) -> 得点順位
+KYOUDO_SPECS = [
+    ('強度', [('番手', True), ('得点順位', True)], LINE_LETTERS),
+    ('強度２', [('番手', True), ('B', False), ('得点順位', True)], LINE_LETTERS2),
+    ('強度３', [('番手', True), ('捲', False), ('得点順位', True)], LINE_LETTERS3),
+]
+
+ERROR_COLUMNS = ['race_id', '理由', '行数']
+
+
+def _sort_keys(values, ascending):
+    """昇順/降順・NaN最後 の並べ替えキー(np.lexsort 用。後ろのキーほど優先)。"""
+    v = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+    nan = np.isnan(v)
+    v = np.where(nan, 0.0, v if ascending else -v)
+    return [v, nan]
+
+
+def _kyoudo_codes(card, codes, ban, sort_spec, letters):
+    """
+    レースごとに sort_spec の順で並べ、その位置(先頭9人まで)をライン記号にして「記号 + 番手」を作る。
+    同じラインが複数回出てきたときは、従来(dict 内包表記で後勝ち)どおり最後に出てきた位置の記号を使う。
+    """
+    keys = [np.arange(len(card))]
+    for col, ascending in reversed(sort_spec):
+        keys += _sort_keys(ban if col == '番手' else card[col], ascending)
+    keys.append(codes)
+    order = np.lexsort(keys)
+
+    sorted_codes = codes[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(sorted_codes)) + 1]
+    pos = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+
+    line = card['ライン'].to_numpy()[order]
+    ranked = pd.DataFrame({'g': sorted_codes, 'line': line, 'pos': pos})
+    ranked = ranked[ranked['pos'] < len(letters)]
+    # ライン欠損(NaN)も従来どおり1つのラインとして扱う
+    last_pos = ranked.groupby(['g', 'line'], sort=False, dropna=False)['pos'].max()
+
+    letter_of = pd.Series(np.asarray(letters, dtype=object)[last_pos.to_numpy()], index=last_pos.index)
+    row_letter = letter_of.reindex(pd.MultiIndex.from_arrays([codes, card['ライン'].to_numpy()])).fillna('')
+    return row_letter.to_numpy(dtype=object) + ban.astype(str).to_numpy(dtype=object)
+
+
+def _race_errors(card, race_ids, codes):
+    """強度が正しく決まらないレース(欠損・車番重複・10車以上)を理由つきで一覧にする。"""
+    checks = [
+        ('ライン欠損', card['ライン'].isna()),
+        ('番手欠損', card['番手'].isna()),
+        ('得点順位欠損', card['得点順位'].isna()),
+        ('車番重複', pd.Series(list(zip(codes, card['車 番'])), index=card.index).duplicated()),
+    ]
+    rows = []
+    sizes = np.bincount(codes)
+    for reason, mask in checks:
+        for g in np.unique(codes[mask.to_numpy()]):
+            rows.append((race_ids[g], reason, sizes[g]))
+    for g in np.flatnonzero(sizes > len(LINE_LETTERS)):
+        rows.append((race_ids[g], '10車以上', sizes[g]))
+    return pd.DataFrame(rows, columns=ERROR_COLUMNS)
+
+
+def line_kyoudo(race_card, return_errors=False):
+    """
+    ライン内の位置と並び順から 強度 / 強度２ / 強度３ を全レースまとめて付ける。
+      強度   : (番手, 得点順位) の順にラインへ A,B,C... を振る
+      強度２ : (番手, B降順, 得点順位) の順に a,b,c...
+      強度３ : (番手, 捲降順, 得点順位) の順に AA,BB,CC...
+    行はレースの登場順、レース内は元の順番のまま(従来のレースごとのループ版 line_kyoudo_loop と同じ結果)。
+
+    強度が正しく決まらないレースは、従来は error_id に入れて黙って落としていたが、
+    ここでは行は残したうえで理由を別表にする。return_errors=True なら (結果, エラー表) を返す。
+    """
+    card = race_card.copy()
+    codes, race_ids = pd.factorize(card.index)
+    card = card[codes >= 0]
+    codes = codes[codes >= 0]
+    # レースの登場順にまとめる(レース内は元の順番)
+    grouped = np.argsort(codes, kind='stable')
+    card = card.iloc[grouped]
+    codes = codes[grouped]
+
+    # 番手が0のもの(単騎)を1に置換
+    ban = card['番手'].replace(0, 1)
+
+    left = card.reset_index(drop=True)
+    left.insert(0, '_g', codes)
+    for out_col, sort_spec, letters in KYOUDO_SPECS:
+        strength = pd.DataFrame({'_g': codes, '車 番': card['車 番'].to_numpy()})
+        strength[out_col] = _kyoudo_codes(card, codes, ban, sort_spec, letters)
+        # 従来と同じく 車番 で突き合わせる(同じ車番が2行あれば従来どおり掛け合わせになる)
+        strength = strength.sort_values(['_g', '車 番'], kind='mergesort')
+        left = left.merge(strength, on=['_g', '車 番'])
+
+    out = left.drop(columns='_g')
+    out.index = race_ids[left['_g'].to_numpy()]
+
+    errors = _race_errors(card, race_ids, codes)
+    if len(errors):
+        print(f'強度を正しく決められないレース: {errors["race_id"].nunique()} 件(理由は別表)')
+    if return_errors:
+        return out, errors
+    return out
+
+
+def line_kyoudo_loop(race_card):
+    """従来のレースごとのループ版(突き合わせ用)。"""
     card = race_card.copy()
     id_lists = card.index.unique()
     dic = {}
@@ -87,10 +201,31 @@ def line_kyoudo(race_card):
     dic = pd.concat([dic[key] for key in dic])
     return dic
 
+def check(race_card):
+    """ベクトル化版とループ版の結果が一致するかを確かめる。"""
+    import time
+    t0 = time.perf_counter()
+    expected = line_kyoudo_loop(race_card)
+    t1 = time.perf_counter()
+    actual = line_kyoudo(race_card)
+    t2 = time.perf_counter()
+    pd.testing.assert_frame_equal(actual, expected)
+    print(f'一致しました: {len(actual)} 行 / ループ版 {t1 - t0:.1f} 秒, ベクトル化版 {t2 - t1:.2f} 秒')
+
+
 # main関数
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--check', action='store_true', help='ループ版との一致を確認して終了する')
+    args = parser.parse_args()
+
     r_syu= pd.read_pickle('race_card2_202604-202606.pkl')
-    r_syu_s = line_kyoudo(r_syu)
+    if args.check:
+        check(r_syu)
+        sys.exit()
+
+    r_syu_s, errors = line_kyoudo(r_syu, return_errors=True)
+    pd.to_pickle(errors,'race_card3_202604-202606_errors.pkl')
     #r_syu2= pd.read_pickle('race_card2_20250712.pkl')
     #r_syu_s2 = line_kyoudo(r_syu2)
 
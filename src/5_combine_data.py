@@ -1,29 +1,38 @@
 import pandas as pd
 
+from history_store import DATE_COL, HistoryStore
+
+# 過去データの保存先（開催年月ごとの Parquet。history_store.py 参照）
+HISTORY_DIR = 'data/history'
+
 # 結合するファイル名のリスト
-# ('既存ファイル', '追加ファイル', '結合後のファイル名')
+# ('テーブル', '既存ファイル', '追加ファイル', '結合後のファイル名')
+# 既存ファイルは保存先が空のとき（初回）だけ取り込む
 files_to_combine = [
-    ('race_info2_202106-202601.pkl', 'race_info2_202604-202606.pkl', 'race_info2_202106-202606.pkl'),
-    ('race_card3_202106-202601.pkl', 'race_card3_202604-202606.pkl', 'race_card3_202106-202606.pkl'),
-    ('race_return_202106-202601.pkl', 'race_return_202604-202606.pkl', 'race_return_202106-202606.pkl')
+    ('info', 'race_info2_202106-202601.pkl', 'race_info2_202604-202606.pkl', 'race_info2_202106-202606.pkl'),
+    ('card', 'race_card3_202106-202601.pkl', 'race_card3_202604-202606.pkl', 'race_card3_202106-202606.pkl'),
+    ('return', 'race_return_202106-202601.pkl', 'race_return_202604-202606.pkl', 'race_return_202106-202606.pkl')
 ]
 
-for existing_file, past_file, output_file in files_to_combine:
-    try:
-        df_existing = pd.read_pickle(existing_file)
-        df_past = pd.read_pickle(past_file)
+store = HistoryStore(HISTORY_DIR)
 
-        # ignore_index=True を外し、race_idインデックスを保持したまま結合
-        df_combined = pd.concat([df_existing, df_past])
+for table, existing_file, past_file, output_file in files_to_combine:
+    try:
+        if not store.months(table):
+            n = store.append(table, pd.read_pickle(existing_file))
+            print(f"初回のため '{existing_file}' を取り込みました（{n} 件）。")
 
-        # 念のため：内容が完全一致する重複行だけを除去（インデックスは巻き込まない）
-        df_combined = df_combined[~df_combined.duplicated(keep='first')]
+        # 追加分の開催年月のファイルだけを書き直す（同じ race_id の行は追加分で置き換える）
+        n = store.append(table, pd.read_pickle(past_file))
+        print(f"'{past_file}' を {table} に追加しました（{n} 件, {len(store.months(table))} か月分）。")
 
+        # まだ全期間の pickle を読む工程（8_cumulative_ready.py など）向けに、従来の形（race_idインデックス）でも書き出す
+        df_combined = store.read(table).drop(columns=[DATE_COL]).set_index('race_id')
+        df_combined.index.name = None
         pd.to_pickle(df_combined, output_file)
-        print(f"'{existing_file}' と '{past_file}' を結合し、'{output_file}' として保存しました。")
-        print(f"結合後のデータ数: {len(df_combined)} 件（インデックス保持済み）")
+        print(f"'{output_file}' として保存しました。結合後のデータ数: {len(df_combined)} 件")
 
-    except FileNotFoundError:
-        print(f"エラー: ファイル '{existing_file}' または '{past_file}' が見つかりません。")
+    except FileNotFoundError as e:
+        print(f"エラー: ファイルが見つかりません: {e.filename}")
     except Exception as e:
-        print(f"エラーが発生しました: {e}")
\ No newline at end of file
+        print(f"エラーが発生しました: {e}")
@@ -150,6 +150,14 @@ final_model = finalize_model(tuned_model)
 save_model(final_model, 'keirin_model_1st_place_challenge') # ← 新しい名前を指定
 print(f"\n1着予測モデルが 'keirin_model_1st_place_challenge.pkl' として保存されました。")
 
+# t_race.py が PyCaret 無しで予測できるように書き出す（native_class_model.py。書き出せなければ PyCaret で予測される）
+from native_class_model import export_model
+try:
+    diff = export_model(final_model, 'keirin_model_1st_place_challenge')
+    print(f"PyCaret 無しの予測用に書き出しました（元のモデルとの最大差 {diff:.3g}）")
+except ValueError as e:
+    print(f"⚠️PyCaret 無しの予測用には書き出せませんでした: {e}")
+
 # --- 5. 評価と診断 ---
 # 正しい列の順序を保存
 correct_columns = data_train.drop('target', axis=1).columns.tolist()
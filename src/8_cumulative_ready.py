@@ -1,37 +1,63 @@
-import pandas as pd
-
-# 1. データの読み込み
-df = pd.read_pickle('race_card3_202106-202606.pkl')
-
-# 2. 型変換とクリーニング
-df['着 順'] = pd.to_numeric(df['着 順'], errors='coerce')
-
-# 3. 1着・2着・3着の判定フラグ（計算用）
-df['is_1st'] = (df['着 順'] == 1).astype(int)
-df['is_2nd_up'] = (df['着 順'] <= 2).astype(int)
-df['is_3rd_up'] = (df['着 順'] <= 3).astype(int)
-
-print("累積計算を開始します...")
+"""
+8_cumulative_ready.py
+----------------------
+選手ごとの通算成績の保存先(rider_stats.py)に、確定したレースを足し込む。
+
+  python src/8_cumulative_ready.py            : 毎日用。過去データの保存先(data/history。settle_races.py が
+                                                確定したレースを足していく)から、取り込み済みの最終開催日以降の
+                                                出走表だけを読んで足し込む。全期間ファイルは読まない
+  python src/8_cumulative_ready.py --ready    : 学習用。全期間の出走表(CARD_PATH)の未取り込み分を足し込み、
+                                                各行にそのレース日時点の累計特徴量を付けた race_card3_cumulative_ready.pkl を書く
+  python src/8_cumulative_ready.py --rebuild  : 全期間の出走表から保存先を作り直し、--ready と同じファイルも書く
+
+予想に使う選手マスター(9_new_player.py)は保存先の state だけから作るので、毎日は引数なしで回せばよい。
+"""
+import argparse
 
-# 4. groupby と transform / cumsum を組み合わせたベクトル演算 (apply非使用)
-# 各選手の通算出走数（行インデックス）: 0, 1, 2, ...
-df['累計出走数'] = df.groupby('選手名').cumcount().astype(float)
-
-# 0割りを回避するため、0をNaNに置換
-denom = df['累計出走数'].replace(0, pd.NA)
-
-# shift(1) で「今回のレース」を含めずに累積
-df['累計勝率'] = (df.groupby('選手名')['is_1st'].cumsum().shift(1) / denom).fillna(0.0)
-df['累計2連対率'] = (df.groupby('選手名')['is_2nd_up'].cumsum().shift(1) / denom).fillna(0.0)
-df['累計3連対率'] = (df.groupby('選手名')['is_3rd_up'].cumsum().shift(1) / denom).fillna(0.0)
-
-# 選手ごとの最初の行（shiftによって前選手のデータが入ってしまう箇所）を 0.0 に補正
-first_race_mask = (df['累計出走数'] == 0)
-df.loc[first_race_mask, ['累計勝率', '累計2連対率', '累計3連対率']] = 0.0
-
-# 5. 判定用フラグを削除
-df = df.drop(columns=['is_1st', 'is_2nd_up', 'is_3rd_up'])
+import pandas as pd
 
-# 6. 保存
-df.to_pickle('race_card3_cumulative_ready.pkl')
-print("完了しました。 'race_card3_cumulative_ready.pkl' として保存されました。")
\ No newline at end of file
+from history_store import DEFAULT_ROOT as HISTORY_DIR, HistoryStore
+from rider_stats import FEATURE_COLS, RiderStatsStore
+
+# 選手ごとの通算成績の保存先（rider_stats.py 参照）
+STORE_DIR = 'rider_stats'
+# 学習用の全期間の出走表と、累計特徴量を付けた出力
+CARD_PATH = 'race_card3_202106-202606.pkl'
+READY_PATH = 'race_card3_cumulative_ready.pkl'
+# 通算成績を数えるのに使う出走表の列
+FOLD_COLS = ['選手名', '期別', '着 順']
+
+
+def fold_settled(store, history_dir=HISTORY_DIR):
+    """過去データの保存先から、取り込み済みの最終開催日以降の出走表だけを読んで足し込み、取り込んだ行数を返す。"""
+    # 最終開催日の当日分も読む(同じ日の残りのレースが後から届くことがある。取り込み済みのレースは manifest で飛ばす)
+    card = HistoryStore(history_dir).read('card', columns=FOLD_COLS, start=store.last_date())
+    return store.fold(card)
+
+
+def write_ready(store, df, path=READY_PATH):
+    """各行に「そのレースの開催日より前」の通算成績を付けて保存する（当日以降の結果は含めない）。"""
+    print("累積特徴量を付けています...")
+    df = df.drop(columns=[c for c in FEATURE_COLS if c in df.columns])
+    df = pd.concat([df, store.features(df)], axis=1)
+    df.to_pickle(path)
+    print(f"完了しました。 '{path}' として保存されました。")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ready', action='store_true', help=f'全期間の出走表に累計特徴量を付けて {READY_PATH} を書く')
+    parser.add_argument('--rebuild', action='store_true', help='全期間の出走表から通算成績の保存先を作り直す')
+    parser.add_argument('--history', default=HISTORY_DIR, help='毎日の取り込みに使う過去データの保存先')
+    args = parser.parse_args()
+
+    store = RiderStatsStore(STORE_DIR)
+    if args.ready or args.rebuild:
+        df = pd.read_pickle(CARD_PATH)
+        n = store.rebuild(df) if args.rebuild else store.fold(df)
+    else:
+        n = fold_settled(store, args.history)
+    print(f"通算成績に {n} 行を取り込みました（最終開催日: {store.last_date()}）")
+
+    if args.ready or args.rebuild:
+        write_ready(store, df)
@@ -1,16 +1,22 @@
 import pandas as pd
 
-# 累積計算済みの全データを読み込む
-df_all = pd.read_pickle('race_card3_cumulative_ready.pkl')
+from rider_master import DEFAULT_ROOT as MASTER_DIR, build_master
+from rider_stats import COUNT_COLS, FEATURE_COLS, rates, RiderStatsStore
 
-# 各選手の「最新（最後）の1行」だけを抽出してマスターにする
-# ※日付がないため、データの末尾が最新とみなします
-player_master = df_all.groupby('選手名').tail(1).copy()
+# 8_cumulative_ready.py で更新した通算成績の保存先（rider_stats.py 参照）
+STORE_DIR = 'rider_stats'
 
-# 必要な列だけを保持（選手名と累計項目）
-cumulative_features = ['選手名', '累計勝率', '累計2連対率', '累計3連対率', '累計出走数']
-player_master = player_master[cumulative_features]
+# 各選手の最新の通算成績（state）だけを使うので、累積済みの全期間ファイルは読まない
+state = RiderStatsStore(STORE_DIR).state()
 
-# 保存
+# 予想時に当日の出走者だけを引くための選手マスター（rider_id = 選手名_期別 で引く。rider_master.py 参照）
+n = build_master(state, MASTER_DIR)
+
+# 従来の選手名で引くマスターも残しておく（従来どおり1選手名1行・選手名と累計項目だけ）
+# 同姓同名の選手がいるときは、最後に出走した方（従来の「データの末尾が最新」と同じ）を残す
+latest = state.assign(選手名=state.index.str.rsplit('_', n=1).str[0])
+latest = latest.sort_values('最終出走日', kind='mergesort').groupby('選手名').tail(1)
+player_master = pd.concat([latest[['選手名']], rates(latest[COUNT_COLS].astype(int))], axis=1)
+player_master = player_master[['選手名'] + FEATURE_COLS].reset_index(drop=True)
 player_master.to_pickle('player_cumulative_master.pkl')
-print("最新の選手マスターを作成しました。")
\ No newline at end of file
+print(f"最新の選手マスターを作成しました（{n} 人）。")
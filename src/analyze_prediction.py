@@ -3,93 +3,19 @@ import numpy as np
 import subprocess # Gitコマンド実行のために追加
 import datetime # コミットメッセージのために追加
 
-def process_race(race_group):
-    """
-    1つのレースグループを受け取り、集計結果を返す関数
-    """
-    num_racers = len(race_group)
-    start_time = race_group.iloc[0]['開始時間']
-    start_num = race_group.iloc[0]['開催番号']
-    race_title = str(race_group.iloc[0]['レースタイトル'])[:1]
+from race_summary import summarize_races
 
-    # --- 3着以内モデルの3連単 ---
-    race_group_top3 = race_group.sort_values(by='prediction_score_top3', ascending=False)
-    try:
-        t1 = int(race_group_top3.iloc[0]['車_番'])
-        t2 = int(race_group_top3.iloc[1]['車_番'])
-        t3 = int(race_group_top3.iloc[2]['車_番'])
-        sanrentan_top3 = f'="{t1}-{t2}-{t3}"'
-        
-        remaining_cars_top3 = [str(int(x)) for x in race_group_top3['車_番'].iloc[3:].tolist()]
-        if remaining_cars_top3:
-            top3_hoketsu = f'="{ "-".join(remaining_cars_top3) }"'
-        else:
-            top3_hoketsu = ""
-    except Exception:
-        sanrentan_top3, top3_hoketsu = "N/A", "N/A"
-    
-    # --- 1着モデルの3連単 ---
-    race_group_1st = race_group.sort_values(by='prediction_score_1st', ascending=False)
-    try:
-        w1 = int(race_group_1st.iloc[0]['車_番'])
-        w2 = int(race_group_1st.iloc[1]['車_番'])
-        w3 = int(race_group_1st.iloc[2]['車_番'])
-        nirentan_1st = f'="{w1}-{w2}"'
-        sanrentan_1st = f'="{w1}-{w2}-{w3}"'
-        
-        remaining_cars_1st = [str(int(x)) for x in race_group_1st['車_番'].iloc[3:].tolist()]
-        if remaining_cars_1st:
-            st1_hoketsu = f'="{ "-".join(remaining_cars_1st) }"'
-        else:
-            st1_hoketsu = ""
-    except Exception:
-        nirentan_1st, sanrentan_1st, st1_hoketsu = "N/A", "N/A", "N/A"
-
-    # --- 新しい指標・各率（A率〜I率）の計算 ---
-    scores_sorted = race_group_1st['prediction_score_1st'].tolist()
-    
-    rate_labels = ['A率', 'B率', 'C率', 'D率', 'E率', 'F率', 'G率', 'H率', 'I率']
-    rates_dict = {}
-    for i, label in enumerate(rate_labels):
-        if i < len(scores_sorted):
-            rates_dict[label] = round(scores_sorted[i], 2)
-        else:
-            rates_dict[label] = ""
 
-    try:
-        a_rate = scores_sorted[0] if len(scores_sorted) > 0 else 0
-        b_rate = scores_sorted[1] if len(scores_sorted) > 1 else 0
-        c_rate = scores_sorted[2] if len(scores_sorted) > 2 else 0
-        d_rate = scores_sorted[3] if len(scores_sorted) > 3 else (scores_sorted[-1] if len(scores_sorted) > 0 else 0)
-        avg = sum(scores_sorted) / len(scores_sorted) if len(scores_sorted) > 0 else 0
-
-        ct_value = (a_rate - d_rate) / a_rate if a_rate > 0 else 0
-        ct_value2 = (a_rate - avg) / a_rate if avg > 0 else 0
-        score_value = (a_rate * 50) + (ct_value * 25) + (ct_value2 * 25)
-    except Exception:
-        ct_value, score_value = 0, 0
-
-    res_dict = {
-        '開始時間': start_time,
-        '開始日目': start_num,
-        'レース区分': race_title,
-        '2車単': nirentan_1st,
-        '3連単_1着': sanrentan_1st,
-        '1着_補欠': st1_hoketsu,
-        '3連単_3着以内': sanrentan_top3,
-        '3着以内_補欠': top3_hoketsu,
-    }
-    
-    # A率〜I率の格納
-    res_dict.update(rates_dict)
-    
-    res_dict.update({
-        'CT値': round(ct_value, 2),
-        'スコア': round(score_value, 2),
-        '選手数': num_racers
-    })
-
-    return pd.Series(res_dict)
+def process_races(df):
+    """
+    選手単位の予測をレース(競輪場・レース番号)ごとに集計する。A率〜I率は1着モデルのスコア順(race_summary.py)
+    """
+    summary = summarize_races(
+        df, ['競輪場', 'レース番号', 'レース番号_数値'], 'prediction_score_1st',
+        first_cols=['開始時間', '開催番号', 'レースタイトル']
+    )
+    summary['レースタイトル'] = summary['レースタイトル'].astype(str).str[:1]
+    return summary.rename(columns={'開催番号': '開始日目', 'レースタイトル': 'レース区分'})
 
 
 # ★★★ 新・運用ロジック判定関数 ★★★
@@ -169,7 +95,7 @@ if __name__ == '__main__':
     )
     
     # レースごとに集計処理を実行
-    race_summary = df_sorted.groupby(['競輪場', 'レース番号', 'レース番号_数値']).apply(process_race).reset_index()
+    race_summary = process_races(df_sorted)
 
     # 最終的な出力順を開始時間でソート
     final_result = race_summary.sort_values(by='開始時間', ascending=True)
@@ -0,0 +1,69 @@
+"""
+dtype_plan.py
+--------------
+出走表・レース情報の DataFrame を、列ごとの方針(スキーマ)に沿って省メモリな型にする。
+
+  - CATEGORY_COLS の文字列列(脚質・級班・強度・競輪場・選手名 など、種類が少なく何度も出てくる列)
+      object -> category
+  - 整数の列 -> int8 / int16 / int32 のうち値が収まる最小の型
+  - 小数の列 -> 欠損が無く全部整数値なら整数と同じ扱い、それ以外は float32
+      (float32 に直しても相対誤差が FLOAT_RTOL 以内に収まる列だけ。収まらない列は float64 のまま)
+
+race_id・ライン のような結合や groupby のキーになる列は、CATEGORY_COLS に入れないこと
+(category の groupby は出てこない組み合わせまで作ってしまう)。
+
+学習用の全期間データは、読み込んだ直後に compact() を通してから結合する。変換前後の使用量を表示する。
+"""
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_float_dtype, is_integer_dtype
+
+# category にする列(列名の半角スペースを '_' にした名前でも同じ扱い)
+CATEGORY_COLS = ['脚 質', '級 班', '強度', '強度２', '強度３', '競輪場', 'レースタイトル', 'ライン構成', '選手名',
+                 'グレード', '天気', '開催番号']
+# float32 にしてよい相対誤差
+FLOAT_RTOL = 1e-6
+
+_CATEGORY_NAMES = {c for base in CATEGORY_COLS for c in (base, base.replace(' ', '_'))}
+_FLOAT32_MAX = float(np.finfo(np.float32).max)
+
+
+def _downcast_float(s):
+    values = s.to_numpy()
+    finite = values[np.isfinite(values)]
+    if len(finite) == len(values) and len(values) and np.array_equal(finite, np.round(finite)):
+        return pd.to_numeric(s, downcast='integer')
+    if len(finite) and np.abs(finite).max() > _FLOAT32_MAX:
+        return s
+    f32 = values.astype(np.float32)
+    if not np.allclose(f32, values, rtol=FLOAT_RTOL, atol=0, equal_nan=True):
+        return s
+    return pd.Series(f32, index=s.index, name=s.name)
+
+
+def compact(df, name='', verbose=True):
+    """df の列をその場で省メモリな型に置き換え、df を返す(コピーを作らないので元の df も変わる)。"""
+    before = df.memory_usage(deep=True).sum()
+    for col in df.columns:
+        s = df[col]
+        if col in _CATEGORY_NAMES and s.dtype == object:
+            df[col] = s.astype('category')
+        elif is_bool_dtype(s):
+            continue
+        elif is_integer_dtype(s):
+            df[col] = pd.to_numeric(s, downcast='integer')
+        elif is_float_dtype(s) and s.dtype != np.float32:
+            df[col] = _downcast_float(s)
+    if verbose:
+        after = df.memory_usage(deep=True).sum()
+        label = f' {name}' if name else ''
+        print(f'[dtype]{label}: {before / 2**20:,.1f}MB -> {after / 2**20:,.1f}MB '
+              f'({(before - after) / 2**20:,.1f}MB 削減, {len(df):,} 行)')
+    return df
+
+
+def plan(df):
+    """compact() がどの列をどの型にするかを (列名, 変換前, 変換後) の DataFrame で返す(df は変えない)。"""
+    sample = compact(df.copy(), verbose=False)
+    rows = [(c, str(df[c].dtype), str(sample[c].dtype)) for c in df.columns if df[c].dtype != sample[c].dtype]
+    return pd.DataFrame(rows, columns=['列', '変換前', '変換後'])
@@ -1,135 +1,25 @@
-import re
-import time
 import math
-import requests
 import pandas as pd
-from bs4 import BeautifulSoup
 from tqdm import tqdm
 import numpy as np
 
-
-BASE = "https://keirin.kdreams.jp/gamboo/keirin-kaisai/race-card/odds"
+import odds_snapshot
+from race_cache import RaceCache, file_salt, race_digests
 
 
 def build_odds_url(race_id: str) -> str:
-    """
-    race_id例: 73202601290401
-      - race_id_1: 7320260129 (10桁)
-      - kaisai_id: 732026012904 (12桁)
-      - race_no: 1..12 (末尾2桁)
-    既知URL形式:
-      /odds/{race_id_1}/{kaisai_id}00/{race_no}/3rentan/#detail
-    """
-    race_id_1 = race_id[:10]
-    kaisai_id = race_id[:12]
-    race_no = int(race_id[-2:])  # "01" -> 1
-    return f"{BASE}/{race_id_1}/{kaisai_id}00/{race_no}/3rentan/#detail"
-
-
-def _text_to_float(s: str):
-    s = s.strip()
-    if not s:
-        return None
-    s = s.replace(",", "")
-    try:
-        return float(s)
-    except:
-        return None
+    """3連単オッズページのURL（形式は odds_snapshot.build_odds_url を参照）"""
+    return odds_snapshot.build_odds_url(race_id, "3rentan")
 
 
-def fetch_sanrentan_odds(race_id: str, session: requests.Session, timeout=20, sleep_sec=0.2) -> pd.DataFrame:
+def fetch_sanrentan_odds(race_id: str, timeout=20) -> pd.DataFrame:
     """
     3連単オッズ（全通り）を DataFrame にして返す
     columns: first, second, third, odds
+    1レースだけ取りたいとき用。main は odds_snapshot で全レースをまとめて取得する
     """
-    url = build_odds_url(race_id)
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-        "Accept-Language": "ja,en-US;q=0.8,en;q=0.6",
-    }
-
-    r = session.get(url, headers=headers, timeout=timeout)
-    r.raise_for_status()
-    html = r.text
-
-    # ページに odds_table が無い場合は空を返す
-    if "odds_table" not in html:
-        return pd.DataFrame(columns=["first", "second", "third", "odds"])
-
-    soup = BeautifulSoup(html, "html.parser")
-    tables = soup.select("table.odds_table")
-    rows = []
-
-    for tb in tables:
-        trs = tb.find_all("tr")
-        if len(trs) < 4:
-            continue
-
-        # first：display:none でない th の span.number
-        first_num = None
-        for th in trs[0].find_all("th"):
-            style = (th.get("style") or "").replace(" ", "").lower()
-            if "display:none" in style:
-                continue
-            sp = th.select_one("span.number")
-            if sp and sp.get_text(strip=True).isdigit():
-                first_num = int(sp.get_text(strip=True))
-                break
-        if first_num is None:
-            continue
-
-        # third_nums：2行目の th（rowspanなし）から列番号
-        third_nums = []
-        for th in trs[1].find_all("th"):
-            if th.get("rowspan"):
-                continue
-            cls = " ".join(th.get("class") or [])
-            m = re.search(r"n(\d+)", cls)
-            if m:
-                third_nums.append(int(m.group(1)))
-
-        if not third_nums:
-            continue
-
-        # データ行
-        for tr in trs[3:]:
-            th = tr.find("th")
-            if not th:
-                continue
-            cls = " ".join(th.get("class") or [])
-            m = re.search(r"n(\d+)", cls)
-            if not m:
-                continue
-            #second_num = int(m.group(1))
-            third_num = int(m.group(1))
-
-            tds = tr.find_all("td")
-            if not tds:
-                continue
-
-            for k, td in enumerate(tds):
-                if k >= len(third_nums):
-                    break
-                #third_num = third_nums[k]
-                second_num = third_nums[k]
-
-                # emptyセルはスキップ（ただし列位置は進む）
-                td_cls = " ".join(td.get("class") or [])
-                if "empty" in td_cls:
-                    continue
-
-                odds = _text_to_float(td.get_text(" ", strip=True))
-                if odds is None:
-                    continue
-
-                rows.append((first_num, second_num, third_num, odds))
-
-    df = pd.DataFrame(rows, columns=["first", "second", "third", "odds"])
-    # 念のため重複除去
-    df = df.drop_duplicates(subset=["first", "second", "third"]).reset_index(drop=True)
-
-    time.sleep(sleep_sec)
-    return df
+    df = odds_snapshot.fetch_one(str(race_id), "3rentan", timeout=timeout)
+    return odds_snapshot.to_wide(df, "3rentan", race_id)
 
 
 def pl_prob_triplet(order_triplet: tuple[int, int, int], win_scores: dict, top3_scores: dict) -> float:
@@ -160,6 +50,96 @@ def pl_prob_triplet(order_triplet: tuple[int, int, int], win_scores: dict, top3_
     return p1 * p2 * p3
 
 
+def race_tickets(rid, g: pd.DataFrame, df_odds) -> list[dict]:
+    """
+    1レース分の予測(g: 車_番, prediction_score_1st, prediction_score_top3, 競輪場...)と
+    3連単オッズ(df_odds: first, second, third, odds)から、全買い目の p と EV を計算する
+    選手が3人未満のレース・オッズの無いレースは空
+    """
+    # 欠場等で選手が少ないレースは除外
+    if len(g) < 3:
+        return []
+
+    # 車番をintに
+    g = g.copy()
+    g["車_番"] = g["車_番"].astype(int)
+
+    # win/top3 スコア辞書
+    win_scores = dict(zip(g["車_番"], g["prediction_score_1st"].astype(float)))
+    top3_scores = dict(zip(g["車_番"], g["prediction_score_top3"].astype(float)))
+
+    # オッズ（スナップショットに無いレースは取得失敗）
+    if df_odds is None or df_odds.empty:
+        return []
+
+    # 表示用情報
+    one = g.iloc[0]
+    place = one.get("競輪場", "")
+    raceno = one.get("レース番号", "")
+    st = one.get("開始時間", "")
+
+    # EV計算（全買い目）
+    rows = []
+    for _, r in df_odds.iterrows():
+        a = int(r["first"]); b = int(r["second"]); c = int(r["third"])
+        odds = float(r["odds"])
+
+        p = pl_prob_triplet((a, b, c), win_scores, top3_scores)
+        ev = p * odds - 1.0  # 1単位賭けの期待値
+
+        rows.append({
+            "race_id": str(rid),
+            "競輪場": place,
+            "レース番号": raceno,
+            "開始時間": st,
+            "買い目": f"{a}-{b}-{c}",
+            "first": a,
+            "second": b,
+            "third": c,
+            "odds": odds,
+            "p": p,
+            "EV": ev,
+        })
+    return rows
+
+
+def compute_tickets(df_pred: pd.DataFrame, odds_wide: pd.DataFrame, race_ids: list, race_tickets,
+                    kind: str, desc="EV") -> pd.DataFrame:
+    """
+    race_ids の各レースについて race_tickets(rid, 予測, オッズ) を呼び、全レース分の買い目を1つにする（並びはレース順）
+    予測の行・オッズの行が前回と同じレースは前回の結果を使い、変わったレースだけ計算し直す（race_cache.py）
+    """
+    found = race_digests([df_pred, odds_wide], file_salt([], kind))
+    digests = {str(rid): found.get(str(rid), "") for rid in race_ids}
+    cache = RaceCache(kind)
+    changed = cache.changed(digests)
+    print(f"予測・オッズが変わったレース: {len(changed)} / {len(digests)}（残りは前回の結果を使います）")
+
+    pred_by_race = dict(tuple(df_pred.groupby(df_pred["race_id"].astype(str))))
+    odds_by_race = dict(tuple(odds_wide.groupby(odds_wide["race_id"].astype(str))))
+    rows = []
+    for rid in tqdm(changed, desc=desc):
+        rows += race_tickets(rid, pred_by_race.get(rid, df_pred.iloc[:0]), odds_by_race.get(rid))
+    result = cache.update(digests, {"tickets": pd.DataFrame(rows)})
+    return result.get("tickets", pd.DataFrame())
+
+
+def ticket_table(ticket_rows) -> pd.DataFrame:
+    """チケット単位：EV順（ticket_rows は race_tickets の行のリストか compute_tickets の結果）"""
+    df_tickets = pd.DataFrame(ticket_rows)
+    if df_tickets.empty:
+        return df_tickets
+    return df_tickets.sort_values(["EV"], ascending=False).reset_index(drop=True)
+
+
+def rank_races(df_tickets: pd.DataFrame) -> pd.DataFrame:
+    """レース単位：各レースの最大EVを代表に"""
+    idx = df_tickets.groupby("race_id")["EV"].idxmax()
+    df_race = df_tickets.loc[idx].sort_values("EV", ascending=False)
+    df_race = df_race.rename(columns={"買い目": "best_bet", "EV": "max_EV", "p": "best_p", "odds": "best_odds"})
+    return df_race.sort_values("max_EV", ascending=False).reset_index(drop=True)
+
+
 def main():
     # 入力
     PRED_CSV = "keirin_prediction_result_combined.csv"
@@ -196,76 +176,19 @@ def main():
     # レース一覧
     race_ids = race_info["race_id"].astype(str).unique().tolist()
 
-    session = requests.Session()
-
-    ticket_rows = []
-
-    for rid in tqdm(race_ids, desc="odds+EV"):
-        # レースの予測データ
-        g = df_pred[df_pred["race_id"].astype(str) == str(rid)].copy()
-
-        # 欠場等で選手が少ないレースは除外
-        if len(g) < 3:
-            continue
-
-        # 車番をintに
-        g["車_番"] = g["車_番"].astype(int)
-
-        # win/top3 スコア辞書
-        win_scores = dict(zip(g["車_番"], g["prediction_score_1st"].astype(float)))
-        top3_scores = dict(zip(g["車_番"], g["prediction_score_top3"].astype(float)))
-
-        # オッズ取得
-        try:
-            df_odds = fetch_sanrentan_odds(str(rid), session=session)
-        except Exception:
-            continue
-
-        if df_odds.empty:
-            continue
-
-        # 表示用情報
-        one = g.iloc[0]
-        place = one.get("競輪場", "")
-        raceno = one.get("レース番号", "")
-        st = one.get("開始時間", "")
-
-        # EV計算（全買い目）
-        for _, r in df_odds.iterrows():
-            a = int(r["first"]); b = int(r["second"]); c = int(r["third"])
-            odds = float(r["odds"])
-
-            p = pl_prob_triplet((a, b, c), win_scores, top3_scores)
-            ev = p * odds - 1.0  # 1単位賭けの期待値
-
-            ticket_rows.append({
-                "race_id": str(rid),
-                "競輪場": place,
-                "レース番号": raceno,
-                "開始時間": st,
-                "買い目": f"{a}-{b}-{c}",
-                "first": a,
-                "second": b,
-                "third": c,
-                "odds": odds,
-                "p": p,
-                "EV": ev,
-            })
+    # オッズは全レース・全券種を1回で並列取得（2車複側も同じスナップショットを使う）
+    odds_all = odds_snapshot.load_or_take(race_ids, "3rentan")
+    odds_wide = odds_snapshot.to_wide(odds_all, "3rentan")
 
-    df_tickets = pd.DataFrame(ticket_rows)
+    # 予測・オッズが前回と同じレースは前回の買い目を使う
+    df_tickets = ticket_table(compute_tickets(df_pred, odds_wide, race_ids, race_tickets, "ev_3rentan"))
     if df_tickets.empty:
         raise RuntimeError("EV計算結果が0件でした（オッズ取得/結合に失敗している可能性）")
 
-    # チケット単位：EV順
-    df_tickets = df_tickets.sort_values(["EV"], ascending=False).reset_index(drop=True)
     print("df_tickets columns:", df_tickets.columns.tolist())
     df_tickets.to_csv(OUT_TICKETS, encoding="utf-8-sig", index=False)
 
-    # レース単位：各レースの最大EVを代表に
-    idx = df_tickets.groupby("race_id")["EV"].idxmax()
-    df_race = df_tickets.loc[idx].sort_values("EV", ascending=False)
-    df_race = df_race.rename(columns={"買い目": "best_bet", "EV": "max_EV", "p": "best_p", "odds": "best_odds"})
-    df_race = df_race.sort_values("max_EV", ascending=False).reset_index(drop=True)
+    df_race = rank_races(df_tickets)
     df_race.to_csv(OUT_RACES, encoding="utf-8-sig", index=False)
 
     print(f"[OK] チケットEV一覧: {OUT_TICKETS}")
@@ -0,0 +1,219 @@
+"""
+feature_builder.py
+-------------------
+学習と予測で共通に使う特徴量づくり。
+
+これまで build_production_models.main と daily_predict.build_features / main が
+「レース情報の結合・ライン人数・カテゴリ変換・ライン特徴量(lead / followers / line_agg_pred)」を、
+t_race.py と train_by_class_model.py が PyCaret 用の前処理を、それぞれ別々に書いていた。
+どちらの組も、学習側と予測側がこのモジュールの同じ関数を呼ぶ。
+
+2段モデル(build_production_models / daily_predict):
+  rider_features(card, info)        : 選手単位。レース情報の結合・ライン人数・数値変換
+  line_features(merged)             : ライン単位のうち予測に依らない部分(人数・先頭・番手以降)
+  add_line_predictions(line, merged): Stage1 の予測からライン内平均・最大・先頭の予測値を足す
+  build_category_maps / apply_category_maps : カテゴリ -> コード(未知は -1)
+
+PyCaret モデル(train_by_class_model / t_race):
+  prepare_pycaret_frame(df) : 発走時・列名の整形・数値変換・欠損埋め
+  detect_race_class(row)    : girls / challenge / a_class / s_class / other
+
+キャッシュ:
+  load_or_build(paths, kind, build) は、入力ファイルの中身のハッシュと FEATURE_VERSION から作ったキーで
+  data/feature_cache/{kind}_{key}.pkl を探し、あれば build() を呼ばずにそれを返す。
+  モデルだけを変えて学習し直す・予測し直すときは、特徴量づくりを丸ごと飛ばせる。
+  特徴量の作り方を変えたら FEATURE_VERSION を上げること(古いキャッシュは使われなくなる)。
+  カテゴリのコードはモデルごとの変換表に依るので、キャッシュには変換前の値を入れておく。
+"""
+import glob
+import hashlib
+import os
+
+import pandas as pd
+
+from rider_stats import FEATURE_COLS as CUMULATIVE_FEATS
+
+FEATURE_VERSION = 2
+DEFAULT_CACHE_DIR = os.path.join('data', 'feature_cache')
+
+LINE_KEYS = ['race_id', 'ライン']
+
+# ---- 2段モデルの特徴量 ----
+NUMERIC_FEATS = ['競走得点', '年齢', '期別', '得点順位', '競走得点_sa',
+                 'S', 'B', 'B_sa', 'B_sa2', 'B_suu',
+                 '逃', '逃_sa', '逃_sa2', '逃_suu',
+                 '捲', '捲_sa', '差', '差_sa', 'マ', 'マ_sa',
+                 '勝 率', '2連 対率', '3連 対率', '番手', 'ライン人数']
+CATEGORICAL_FEATS = ['脚 質', '級 班', '強度', 'グレード', '天気', '1周', '開催番号']
+LINE_FEATURE_COLS = ['人数', '先頭_得点順位', '先頭_競走得点sa', '先頭_逃sa', '先頭_逃suu',
+                     '番手以降_平均得点sa', '番手以降_平均差sa', '番手以降_平均マsa',
+                     '先頭_予測top3score', 'ライン内平均予測score', 'ライン内最大予測score']
+# 出走表に付けるレース情報の列
+RACE_INFO_COLS = ['グレード', '天気', '1周', '開催番号']
+
+# ---- PyCaret モデルの特徴量 ----
+PYCARET_CATEGORICAL_FEATS = ['枠_番', '車_番', '級_班', '脚_質', '期別', '競輪場', 'グレード', '天気', 'レース番号',
+                             'レースタイトル', '開催番号', '強度', '強度２', '強度３', 'ライン構成', '1周']
+PYCARET_NON_NUMERIC = PYCARET_CATEGORICAL_FEATS + ['index', '総_評', 'レース名', '開催日', '開始時間', '予_想', '選手名']
+
+
+# ---------------------------------------------------------------------------
+# 2段モデル
+# ---------------------------------------------------------------------------
+def build_category_maps(df, cat_cols):
+    """学習データから 文字列 -> コード の対応表を作る。予測時は同じ表を使い、
+    未知のカテゴリ値は -1(unknown)扱いにする。"""
+    maps = {}
+    for c in cat_cols:
+        uniques = pd.unique(df[c].astype(str))
+        maps[c] = {v: i for i, v in enumerate(uniques)}
+    return maps
+
+
+def apply_category_maps(df, cat_cols, maps):
+    out = df.copy()
+    for c in cat_cols:
+        m = maps[c]
+        out[c + '_code'] = out[c].astype(str).map(m).fillna(-1).astype(int)
+    return out
+
+
+def rider_features(card, info, info_cols=RACE_INFO_COLS, numeric_feats=NUMERIC_FEATS):
+    """出走表にレース情報とライン人数を付け、数値特徴量を数値にした選手単位の表を返す。"""
+    merged = card.merge(info[['race_id'] + list(info_cols)], on='race_id', how='left')
+    line_size = merged.groupby(LINE_KEYS).size().rename('ライン人数').reset_index()
+    merged = merged.merge(line_size, on=LINE_KEYS, how='left')
+    for c in numeric_feats:
+        merged[c] = pd.to_numeric(merged[c], errors='coerce')
+    return merged
+
+
+def line_features(merged):
+    """ライン単位の特徴量のうち、Stage1 の予測に依らないもの(人数・先頭・番手以降)。"""
+    lead = merged[merged['番手'] == 1].copy().rename(columns={
+        '得点順位': '先頭_得点順位', '競走得点_sa': '先頭_競走得点sa',
+        '逃_sa': '先頭_逃sa', '逃_suu': '先頭_逃suu',
+    })[LINE_KEYS + ['先頭_得点順位', '先頭_競走得点sa', '先頭_逃sa', '先頭_逃suu']]
+
+    followers = merged[merged['番手'] > 1].groupby(LINE_KEYS).agg(
+        番手以降_平均得点sa=('競走得点_sa', 'mean'),
+        番手以降_平均差sa=('差_sa', 'mean'),
+        番手以降_平均マsa=('マ_sa', 'mean'),
+    ).reset_index()
+
+    line_size = merged.groupby(LINE_KEYS).size().reset_index(name='人数')
+    line_df = line_size.merge(lead, on=LINE_KEYS, how='left') \
+                       .merge(followers, on=LINE_KEYS, how='left')
+    for c in ['番手以降_平均得点sa', '番手以降_平均差sa', '番手以降_平均マsa']:
+        line_df[c] = line_df[c].fillna(0)
+    return line_df
+
+
+def add_line_predictions(line_df, merged, pred_col='indiv_pred_top3'):
+    """Stage1 の予測(pred_col)から ライン内平均予測score / ライン内最大予測score / 先頭_予測top3score を足す。
+    先頭の予測が無いライン(番手1が欠けている)は、ライン内平均で埋める。"""
+    agg = merged.groupby(LINE_KEYS).agg(
+        ライン内平均予測score=(pred_col, 'mean'),
+        ライン内最大予測score=(pred_col, 'max'),
+    ).reset_index()
+    lead_pred = merged[merged['番手'] == 1][LINE_KEYS + [pred_col]]
+    out = line_df.merge(agg, on=LINE_KEYS, how='left') \
+                 .merge(lead_pred, on=LINE_KEYS, how='left')
+    out['先頭_予測top3score'] = out[pred_col].fillna(out['ライン内平均予測score'])
+    return out.drop(columns=[pred_col])
+
+
+# ---------------------------------------------------------------------------
+# PyCaret モデル
+# ---------------------------------------------------------------------------
+def prepare_pycaret_frame(df):
+    """出走表とレース情報を結合した表に、PyCaret モデル共通の前処理をかける。"""
+    # 「開始時間」から「時(Hour)」を抽出して数値化する (例: "15:40" -> 15)
+    df['発走時'] = df['開始時間'].apply(lambda x: int(str(x).split(':')[0]) if pd.notna(x) and ':' in str(x) else 0)
+
+    # 列名のクリーニング
+    df.columns = df.columns.str.strip().str.replace(' ', '_')
+
+    # 数値化 (「発走時」や累積特徴量もここで数値になる)
+    for col in df.columns:
+        if col not in PYCARET_NON_NUMERIC:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    # 欠損値補正
+    numeric_cols = df.select_dtypes(include=['number']).columns
+    df[numeric_cols] = df[numeric_cols].fillna(0)
+
+    object_cols = df.select_dtypes(include=['object']).columns
+    df[object_cols] = df[object_cols].fillna('unknown')
+
+    # category にした列(dtype_plan.compact)も同じく 'unknown' で埋める
+    for col in df.select_dtypes(include=['category']).columns:
+        if df[col].isna().any():
+            if 'unknown' not in df[col].cat.categories:
+                df[col] = df[col].cat.add_categories('unknown')
+            df[col] = df[col].fillna('unknown')
+    return df
+
+
+def detect_race_class(row):
+    kyu_han = str(row['級_班']).strip().upper()
+    race_title = str(row['レースタイトル']) if 'レースタイトル' in row else ''
+
+    # ガールズ判定
+    if 'L' in kyu_han or 'ガールズ' in race_title:
+        return 'girls'
+    # チャレンジ判定（A3班、またはタイトルに「チャレンジ」「チ」が含まれる）
+    elif 'チャレンジ' in race_title or 'チ' in race_title or 'A3' in kyu_han:
+        return 'challenge'
+    # A級判定（1班・2班）
+    elif 'A' in kyu_han:
+        return 'a_class'
+    # S級判定
+    elif 'S' in kyu_han:
+        return 's_class'
+    else:
+        return 'other'
+
+
+# ---------------------------------------------------------------------------
+# キャッシュ
+# ---------------------------------------------------------------------------
+def file_digest(path, chunk_size=1 << 20):
+    """ファイルの中身の sha1。"""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_key(paths, kind):
+    """入力ファイルの中身・種類(kind)・FEATURE_VERSION から決まるキャッシュキー。"""
+    h = hashlib.sha1(f'{kind}:{FEATURE_VERSION}'.encode('utf-8'))
+    for path in paths:
+        h.update(os.path.basename(path).encode('utf-8'))
+        h.update(file_digest(path).encode('ascii'))
+    return h.hexdigest()[:16]
+
+
+def load_or_build(paths, kind, build, cache_dir=DEFAULT_CACHE_DIR, refresh=False):
+    """
+    paths の中身が前回と同じならキャッシュを返し、違えば build() の結果を保存して返す。
+    同じ kind の古いキャッシュは消す(入力が毎日変わる予測側でファイルがたまらないように)。
+    """
+    key = cache_key(paths, kind)
+    path = os.path.join(cache_dir, f'{kind}_{key}.pkl')
+    if not refresh and os.path.exists(path):
+        print(f'[cache] 特徴量をキャッシュから読み込みました: {path}')
+        return pd.read_pickle(path)
+
+    result = build()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = path + '.tmp'
+    pd.to_pickle(result, tmp)
+    os.replace(tmp, path)
+    for old in glob.glob(os.path.join(cache_dir, f'{kind}_*.pkl')):
+        if old != path:
+            os.remove(old)
+    print(f'[cache] 特徴量を保存しました: {path}')
+    return result
@@ -0,0 +1,181 @@
+"""
+history_store.py
+-----------------
+過去データ(レース情報・出走表・払戻)を開催年月ごとの Parquet に分けて持つ保存先。
+
+従来は race_card3_202106-202606_FIXED.csv.gz や race_info2_….pkl / race_return_….pkl のような
+全期間1ファイルを、5_combine_data.py が毎回まるごと書き直し、build_production_models.py が毎回
+数百MBの gzip CSV を展開して読んでいた。ここでは
+
+  root/
+    info/{yyyymm}.parquet
+    card/{yyyymm}.parquet
+    return/{yyyymm}.parquet
+
+のように開催年月(race_id から求めた開催日の年月)で分けて持つ。
+
+  - race_id は常に文字列の列として持つ(index には置かない)
+  - 日付 列(開催日, date)を全テーブルに足しておき、期間の絞り込みに使う
+  - read() は必要な月のファイルの、必要な列だけを読む(列の射影と期間の絞り込み)
+  - append() は届いたデータの月のファイルだけを書き直す。同じ race_id の行は新しい方で置き換える
+
+Parquet の列には型が1つしか持てないので、文字列と数値が混ざった列(着順の '失' など)は文字列にする。
+数値として使う側は、従来どおり pd.to_numeric(errors='coerce') で読むこと。
+
+    python src/history_store.py import card race_card3_202106-202606.pkl
+    python src/history_store.py show
+"""
+import argparse
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from race_id_index import kaisai_date
+
+TABLES = ('info', 'card', 'return')
+DEFAULT_ROOT = os.path.join('data', 'history')
+DATE_COL = '日付'
+
+
+def _month(ts):
+    return pd.Timestamp(ts).strftime('%Y%m')
+
+
+def normalize(df):
+    """race_id を文字列の列にし、日付 列を足し、Parquet に書けない混在列を文字列にしたものを返す。"""
+    if 'race_id' not in df.columns:
+        df = df.reset_index()
+        df = df.rename(columns={df.columns[0]: 'race_id'})
+    else:
+        df = df.reset_index(drop=True)
+    df['race_id'] = df['race_id'].astype(str)
+
+    kaisai = df['race_id'].str[:12]
+    uniq = kaisai.unique()
+    dates = pd.Series(pd.to_datetime([kaisai_date(k) for k in uniq]), index=uniq)
+    df[DATE_COL] = kaisai.map(dates).to_numpy()
+
+    df = df.infer_objects()
+    for col in df.columns[df.dtypes == object]:
+        if col == 'race_id':
+            continue
+        kinds = df[col].dropna().map(type).unique()
+        if len(kinds) > 1 or (len(kinds) == 1 and kinds[0] is not str):
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+class HistoryStore:
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+        for name in TABLES:
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+
+    def _partition_path(self, table, month):
+        return os.path.join(self.root, table, f'{month}.parquet')
+
+    def months(self, table):
+        d = os.path.join(self.root, table)
+        return sorted(f[:-8] for f in os.listdir(d) if f.endswith('.parquet'))
+
+    def paths(self, table, start=None, end=None):
+        """期間 [start, end] にかかる月のファイルのパス(開催年月順)。"""
+        months = self.months(table)
+        if start is not None:
+            months = [m for m in months if m >= _month(start)]
+        if end is not None:
+            months = [m for m in months if m <= _month(end)]
+        return [self._partition_path(table, m) for m in months]
+
+    def columns(self, table):
+        """保存されている列名(どれかの月にある列をすべて、最初に出てきた順で)。"""
+        cols = []
+        for path in self.paths(table):
+            for c in pq.read_schema(path).names:
+                if c not in cols:
+                    cols.append(c)
+        return cols
+
+    # ---------------- 書き込み ----------------
+    def append(self, table, df):
+        """df(race_id の列か index を持つ)を月ごとのファイルに足し込み、書いた行数を返す。"""
+        df = normalize(df)
+        for month, part in df.groupby(df[DATE_COL].dt.strftime('%Y%m'), sort=True):
+            path = self._partition_path(table, month)
+            if os.path.exists(path):
+                old = pd.read_parquet(path)
+                old = old[~old['race_id'].isin(part['race_id'].unique())]
+                part = normalize(pd.concat([old, part], ignore_index=True))
+            part = part.sort_values([DATE_COL, 'race_id'], kind='mergesort').reset_index(drop=True)
+            tmp = path + '.tmp'
+            part.to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+        return len(df)
+
+    # ---------------- 読み込み ----------------
+    def read(self, table, columns=None, start=None, end=None, race_ids=None):
+        """
+        table を読む。columns で列を、start / end(その日を含む)で開催日の期間を、race_ids でレースを絞る。
+        race_id は columns に無くても必ず付く。どの月にも無い列は NaN になる。
+        """
+        filters = []
+        if start is not None:
+            filters.append((DATE_COL, '>=', pd.Timestamp(start)))
+        if end is not None:
+            filters.append((DATE_COL, '<=', pd.Timestamp(end)))
+        if race_ids is not None:
+            filters.append(('race_id', 'in', [str(r) for r in race_ids]))
+
+        want = None if columns is None else ['race_id'] + [c for c in columns if c != 'race_id']
+        frames = []
+        for path in self.paths(table, start, end):
+            names = pq.read_schema(path).names
+            cols = None if want is None else [c for c in want if c in names]
+            frames.append(pd.read_parquet(path, columns=cols, filters=filters or None))
+        if not frames:
+            return pd.DataFrame(columns=want or ['race_id', DATE_COL])
+        df = pd.concat(frames, ignore_index=True)
+        if want is not None:
+            df = df.reindex(columns=want)
+        return df
+
+    def last_months_start(self, table, n_months):
+        """保存されている最後の開催年月から数えて n_months か月分の、最初の日(保存が無ければ None)。"""
+        months = self.months(table)
+        if not months:
+            return None
+        last = pd.Period(months[-1], freq='M')
+        return (last - (n_months - 1)).to_timestamp()
+
+    def read_last_months(self, table, n_months, columns=None):
+        """保存されている最後の開催年月から数えて n_months か月分を読む。"""
+        return self.read(table, columns=columns, start=self.last_months_start(table, n_months))
+
+
+def _read_legacy(path):
+    if path.endswith('.csv.gz') or path.endswith('.csv'):
+        return pd.read_csv(path, encoding='utf-8-sig', dtype={'race_id': str})
+    return pd.read_pickle(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', default=DEFAULT_ROOT)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_import = sub.add_parser('import', help='全期間の pickle / csv.gz を取り込む')
+    p_import.add_argument('table', choices=TABLES)
+    p_import.add_argument('files', nargs='+')
+    sub.add_parser('show', help='テーブルごとの月数と列数を表示する')
+    args = parser.parse_args()
+
+    store = HistoryStore(args.root)
+    if args.cmd == 'import':
+        for f in args.files:
+            n = store.append(args.table, _read_legacy(f))
+            print(f"'{f}' から {n} 行を {args.table} に取り込みました。")
+    else:
+        for table in TABLES:
+            months = store.months(table)
+            span = f'{months[0]}〜{months[-1]}' if months else '-'
+            print(f'{table}: {len(months)} か月 ({span}) / {len(store.columns(table))} 列')
@@ -0,0 +1,218 @@
+"""
+kdreams_http.py
+----------------
+kdreams へのHTTPアクセスを一か所にまとめた共通モジュール。
+
+  - ホスト単位のトークンバケットでアクセス間隔を制御する(スレッド間で共有)
+  - requests.Session はスレッドごとに1つ持つ(Session はスレッドセーフではないため)
+  - 取得したページは URL をキーに gzip 圧縮してディスクに保存し、URLの種類ごとの
+    有効期限(TTL)内なら再取得しない(開催日の翌日以降に取ったレース結果は期限なし、オッズは短め)
+  - --replay 付きで起動する(または環境変数 KDREAMS_REPLAY=1)と、ネットワークには
+    一切アクセスせずキャッシュだけで動く。キャッシュに無いURLは ReplayMiss になる
+
+これまで各スクリプトが個別に入れていた sleep(0.4) 等の代わりに、
+ここのレート制御を通すことで、並列に投げても相手サーバーへの負荷は一定に保たれる。
+"""
+import gzip
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import requests
+
+# 1ホストあたりの許容リクエスト数(毎秒)。従来の sleep(0.4) 相当
+DEFAULT_RATE_PER_SEC = 2.5
+# 瞬間的に連続で投げてよい件数
+DEFAULT_BURST = 2
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+    "Accept-Language": "ja,en-US;q=0.8,en;q=0.6",
+}
+
+
+class TokenBucket:
+    """トークンバケット方式のレート制御。acquire() はトークンが貯まるまでブロックする。"""
+
+    def __init__(self, rate_per_sec=DEFAULT_RATE_PER_SEC, burst=DEFAULT_BURST):
+        self.rate = float(rate_per_sec)
+        self.capacity = float(max(burst, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# キャッシュの保存先(実行時のカレントディレクトリ基準。スクレイピングの出力先と同じ)
+CACHE_DIR = os.environ.get("KDREAMS_CACHE_DIR", os.path.join("data", "http_cache"))
+
+# URLの種類ごとの有効期限(秒)。None は期限なし
+TTL_ODDS = 60
+TTL_RESULT_OPEN = 10 * 60    # 当日・未来開催のレースページ(出走表として使う段階)
+TTL_HARAILIST = 30 * 60
+TTL_SCHEDULE = 6 * 60 * 60
+TTL_DEFAULT = 60 * 60
+
+_RESULT_RE = re.compile(r"/race-card/result/\d{10}/(\d{12})")
+_HARAILIST_RE = re.compile(r"/harailist/(\d{4})/(\d{2})/(\d{2})")
+
+REPLAY = "--replay" in sys.argv or os.environ.get("KDREAMS_REPLAY") == "1"
+
+
+class ReplayMiss(requests.exceptions.RequestException):
+    """--replay 中にキャッシュに存在しないURLを要求した。"""
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_local = threading.local()
+
+
+def set_rate(host, rate_per_sec, burst=DEFAULT_BURST):
+    """ホストごとのレートを変更する(バックフィル時に緩める/締める用)。"""
+    with _buckets_lock:
+        _buckets[host] = TokenBucket(rate_per_sec, burst)
+
+
+def get_bucket(host):
+    with _buckets_lock:
+        if host not in _buckets:
+            _buckets[host] = TokenBucket()
+        return _buckets[host]
+
+
+def get_session():
+    """スレッドごとの requests.Session を返す。"""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(DEFAULT_HEADERS)
+        _local.session = session
+    return session
+
+
+def set_replay(enabled=True):
+    global REPLAY
+    REPLAY = bool(enabled)
+
+
+def _kaisai_day(kaisai_id):
+    """開催ID(12桁: 場2桁 + 初日yyyymmdd + 日目2桁)から、その日目の開催日を求める。"""
+    first_day = datetime.strptime(kaisai_id[2:10], "%Y%m%d")
+    return first_day + timedelta(days=int(kaisai_id[10:12]) - 1)
+
+
+def ttl_for(url, stored_at=None):
+    """
+    URLの種類から有効期限(秒)を決める。None は期限なし。
+    stored_at はキャッシュを保存した時刻(datetime)。レース結果・払戻一覧は、
+    開催日が終わってから保存したものだけを期限なしにする(当日に取った結果前のページは期限付き)。
+    """
+    if "/odds/" in url:
+        return TTL_ODDS
+
+    m = _RESULT_RE.search(url)
+    if m:
+        try:
+            race_day = _kaisai_day(m.group(1))
+        except ValueError:
+            return TTL_RESULT_OPEN
+        return None if _settled(race_day, stored_at) else TTL_RESULT_OPEN
+
+    m = _HARAILIST_RE.search(url)
+    if m:
+        day = datetime(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        return None if _settled(day, stored_at) else TTL_HARAILIST
+
+    if "/schedule/" in url:
+        return TTL_SCHEDULE
+
+    return TTL_DEFAULT
+
+
+def _settled(race_day, stored_at):
+    """race_day の翌日0時より後に保存したページか(結果が確定してから取ったものか)。"""
+    return stored_at is not None and stored_at >= race_day + timedelta(days=1)
+
+
+def cache_key(url):
+    # '#detail' などのフラグメントはサーバーに送られないのでキーから外す
+    return hashlib.sha256(url.split("#", 1)[0].encode("utf-8")).hexdigest()
+
+
+def cache_path(url):
+    key = cache_key(url)
+    return os.path.join(CACHE_DIR, key[:2], key + ".gz")
+
+
+def _read_cache(url, ignore_ttl=False):
+    path = cache_path(url)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    age = time.time() - mtime
+
+    ttl = ttl_for(url, datetime.fromtimestamp(mtime))
+    if not ignore_ttl and ttl is not None and age > ttl:
+        return None
+
+    with gzip.open(path, "rb") as f:
+        return f.read()
+
+
+def _write_cache(url, content):
+    path = cache_path(url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 並列取得中に読みかけのファイルを掴まないよう、一時ファイルに書いてから置き換える
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with gzip.open(tmp, "wb", compresslevel=6) as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def fetch_bytes(url, timeout=20, headers=None, use_cache=True):
+    """
+    url の本文をバイト列で返す。キャッシュが有効ならそれを使い、無ければ取得して保存する。
+    ステータスが200以外なら requests.HTTPError を送出する(エラーページはキャッシュしない)。
+    """
+    if REPLAY:
+        content = _read_cache(url, ignore_ttl=True)
+        if content is None:
+            raise ReplayMiss(f"キャッシュにありません(--replay): {url}")
+        return content
+
+    if use_cache:
+        content = _read_cache(url)
+        if content is not None:
+            return content
+
+    get_bucket(urlsplit(url).netloc).acquire()
+    res = get_session().get(url, headers=headers, timeout=timeout)
+    res.raise_for_status()
+
+    if use_cache:
+        _write_cache(url, res.content)
+    return res.content
+
+
+def fetch_text(url, timeout=20, headers=None, encoding="utf-8", use_cache=True):
+    """url の本文を文字列で返す(fetch_bytes の結果をデコードしたもの)。"""
+    content = fetch_bytes(url, timeout=timeout, headers=headers, use_cache=use_cache)
+    return content.decode(encoding, errors="replace")
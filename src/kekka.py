@@ -5,6 +5,8 @@ from datetime import datetime
 import re
 from itertools import permutations
 
+import kdreams_http
+
 def parse_numbers(value):
     """セルの値（ハイフン繋ぎやExcel保護用 ="1-2-3" 形式）から数字のみを抽出してリスト化"""
     if pd.isna(value):
@@ -69,16 +71,14 @@ def fetch_race_odds_dict(race_id):
         f"https://keirin.kdreams.jp/racedetail/{race_id}/odds/3rentan/"
     ]
     
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
     odds_dict = {}
 
     for odds_url in urls:
         try:
-            res = requests.get(odds_url, headers=headers, timeout=5)
-            if res.status_code != 200:
-                continue
-            
-            soup = BeautifulSoup(res.text, 'html.parser')
+            # 200以外は HTTPError になり、下の except で次のURLへ進む
+            html_text = kdreams_http.fetch_text(odds_url, timeout=5)
+
+            soup = BeautifulSoup(html_text, 'html.parser')
             elements = soup.find_all(['tr', 'li', 'div', 'td'])
             for elem in elements:
                 text = elem.get_text(strip=True)
@@ -124,10 +124,7 @@ def fetch_and_update_keirin_data(csv_file, date_str):
 
     try:
         print(f"URL: {url} から払戻金一覧を取得中...")
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        html_content = response.text
+        html_content = kdreams_http.fetch_text(url, timeout=10)
         print("払戻金一覧情報の取得に成功しました。")
     except requests.exceptions.RequestException as e:
         print(f"エラー: ウェブサイトへのアクセスに失敗しました。{e}")
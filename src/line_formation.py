@@ -0,0 +1,173 @@
+"""
+line_formation.py
+------------------
+レース結果ページの並び予想(div.line_position_inner のテキスト)をラインの並びに直すパーサー。
+
+従来は race_data_scrape の中で、18枠の 'mmmmmm' リストに1文字ずつ書き込んで文字列にし、
+出走者ごとにその文字列を走査し直して line_n[k-1]=='m' ... と入れ子の if で番手を判定していた。
+ここではテキストを1回なめるだけでラインごとの車番リストを作り、そこから
+  ライン   : ラインの先頭の車番(文字列)
+  番手     : 0=単騎, 1=先頭, 2=番手, 3=3番手, 4=4番手, 5=5番手以降
+  ライン数 / ライン構成("3-2-2" のようにライン人数の降順)
+を出す。区切りの判定や番手・ラインの値は従来の結果と同じになるようにしてある
+(6番手以降は従来どおり 番手=5、ライン=4つ前の車番)。
+
+ラインの区切り: 数字の直前の2文字が同じ(改行2つ等)ならそこから新しいライン。
+直前の2文字は従来どおり先頭では末尾に回り込んで見る。
+
+実データのライン構成の一覧(data/line_formations.csv, 2021-06〜2026-06 の race_info から集計)を使って、
+従来の文字列処理と結果が一致するかを確認できる:
+    python src/line_formation.py --check
+"""
+import argparse
+import itertools
+import os
+import random
+
+import pandas as pd
+
+FORMATION_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "data", "line_formations.csv")
+
+TANKI = 0
+# 番手はここで打ち止め(従来どおり)
+MAX_BANTE = 5
+
+
+def parse_line_text(text):
+    """
+    line_position_inner のテキストを [[先頭, 2番目, ...], ...](車番は文字列)にする。
+    テキストが無い(None)・短すぎるときは例外になる(従来と同じくそのレースは取り込まない)。
+    """
+    p = text.replace('\n', 'P')
+    if len(p) < 2:
+        raise ValueError(f'ライン表記が短すぎます: {text!r}')
+
+    lines = []
+    current = None
+    for i, ch in enumerate(p):
+        if not ch.isdecimal():
+            continue
+        if current is None or p[i - 2] == p[i - 1]:
+            current = []
+            lines.append(current)
+        current.append(ch)
+    return lines
+
+
+def bante_of(line, pos):
+    """ライン内の位置 pos(0始まり)から (ライン, 番手) を返す。"""
+    if pos == 0:
+        return line[0], (TANKI if len(line) == 1 else 1)
+    if pos < MAX_BANTE - 1:
+        return line[0], pos + 1
+    return line[pos - (MAX_BANTE - 1)], MAX_BANTE
+
+
+def make_line(lines, syusso_n):
+    """
+    車番 1..syusso_n の [車番, ライン, 番手] を車番順に返す(並び予想に無い車番は含めない)。
+    同じ車番が2回出てきたら、出てきた順に2行になる(従来と同じ)。
+    """
+    where = {}
+    for line in lines:
+        for pos, car in enumerate(line):
+            where.setdefault(car, []).append((line, pos))
+
+    rows = []
+    for j in range(1, syusso_n + 1):
+        for line, pos in where.get(str(j), ()):
+            head, bante = bante_of(line, pos)
+            rows.append([j, head, bante])
+    return rows
+
+
+def line_summary(lines):
+    """(ライン数, ライン構成) を返す。ライン構成はライン人数の降順を '-' でつないだもの。"""
+    # 人数は1桁の想定。従来どおり人数を1文字ずつ並べ替える(10人以上のラインは桁ごとに分かれる)
+    sizes = sorted(''.join(str(len(line)) for line in lines), reverse=True)
+    return len(lines), '-'.join(sizes)
+
+
+# ---------------------------------------------------------------------------
+# 従来の文字列処理(突き合わせ用)
+# ---------------------------------------------------------------------------
+def _legacy(text, syusso_n):
+    import re
+    p = text.replace('\n', "P")
+    line_n = ['mmmmmm'] * 18
+    n = 0
+    for i in range(len(p)):
+        po_1 = p[i - 2]
+        po_2 = p[i - 1]
+        if re.findall(r'\d+', p[i]):
+            n += 1
+            line_n[n] = str(p[i])
+            if po_1 == po_2:
+                line_n[n] = str("mmmmmm")
+                n += 1
+                line_n[n] = str(p[i])
+    line_n = "".join(line_n) + 'mmmmmm'
+
+    make = []
+    for j in range(1, syusso_n + 1, 1):
+        for k in range(len(line_n)):
+            if str(j) == line_n[k]:
+                if line_n[k - 1] == 'm':
+                    make.append([j, line_n[k], 0 if line_n[k + 1] == 'm' else 1])
+                elif line_n[k - 2] == 'm':
+                    make.append([j, line_n[k - 1], 2])
+                elif line_n[k - 3] == 'm':
+                    make.append([j, line_n[k - 2], 3])
+                elif line_n[k - 4] == 'm':
+                    make.append([j, line_n[k - 3], 4])
+                elif line_n[-5] == 'm':
+                    make.append([j, line_n[k - 4], 5])
+
+    line_k = re.findall(r'\d+', line_n)
+    kousei = sorted("".join(str(len(x)) for x in line_k), reverse=True)
+    return make, len(line_k), '-'.join(kousei)
+
+
+def _texts_for(formation, rng, n_variants):
+    """ライン構成("3-2-2")から、車番の並べ方と区切り文字を変えた並び予想テキストを作る。"""
+    sizes = [int(x) for x in formation.split('-')]
+    cars = [str(c) for c in range(1, sum(sizes) + 1)]
+    seps = [('\n', '\n\n'), (' ', '  '), ('\n', '\n \n\n'), ('←', '\n\n')]
+    for _ in range(n_variants):
+        rng.shuffle(cars)
+        inner, outer = rng.choice(seps)
+        it = iter(cars)
+        groups = [inner.join(itertools.islice(it, s)) for s in rng.sample(sizes, len(sizes))]
+        yield '\n' + outer.join(groups) + rng.choice(['\n', '\n\n', ' '])
+
+
+def check(path=FORMATION_CSV, n_variants=20, seed=0):
+    """実データのライン構成すべてについて、従来処理と同じ結果になるかを確かめる。"""
+    rng = random.Random(seed)
+    formations = pd.read_csv(path, encoding='utf-8')['ライン構成']
+    total = mismatch = 0
+    for formation in formations:
+        for text in _texts_for(formation, rng, n_variants):
+            syusso_n = sum(int(x) for x in formation.split('-'))
+            try:
+                expected = _legacy(text, syusso_n)
+            except IndexError:
+                # 従来処理は18枠を使い切ると落ちていた(そのレースは取り込まれなかった)
+                continue
+            lines = parse_line_text(text)
+            actual = (make_line(lines, syusso_n),) + line_summary(lines)
+            total += 1
+            if actual != expected:
+                mismatch += 1
+                if mismatch <= 5:
+                    print(f'不一致: {formation} {text!r}\n  従来: {expected}\n  新  : {actual}')
+    print(f'ライン構成 {len(formations)} 種 / {total} 通り / 不一致 {mismatch}')
+    return mismatch == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--check', action='store_true')
+    args = parser.parse_args()
+    if args.check:
+        check()
@@ -0,0 +1,40 @@
+"""
+model_blend.py
+---------------
+全期間で学習したモデル(base)と、直近の期間だけで学習し直したモデル(tail)の予測確率を混ぜる分類器。
+
+build_production_models.py --incremental で作り、stage1_model / stage2_model としてそのままバンドルに入れる。
+predict_proba を持つので、daily_predict.py からは普通のモデルと同じように使える
+(読み戻すとき、このモジュールが import できる場所に src/ があること)。
+
+  予測確率 = (1 - weight) * base + weight * tail
+
+差分更新を何度繰り返しても、base は最後に全期間で学習したモデルのまま入れ子にしない(unwrap 参照)。
+"""
+import numpy as np
+
+
+class BlendedClassifier:
+    def __init__(self, base, tail, weight):
+        self.base = base
+        self.tail = tail
+        self.weight = float(weight)
+
+    @property
+    def classes_(self):
+        return self.base.classes_
+
+    @property
+    def feature_names_in_(self):
+        return self.base.feature_names_in_
+
+    def predict_proba(self, X):
+        return (1 - self.weight) * self.base.predict_proba(X) + self.weight * self.tail.predict_proba(X)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def unwrap(model):
+    """BlendedClassifier なら中の全期間モデルを、そうでなければ model をそのまま返す。"""
+    return model.base if isinstance(model, BlendedClassifier) else model
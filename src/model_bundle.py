@@ -0,0 +1,107 @@
+"""
+model_bundle.py
+----------------
+本番用モデル一式(Stage1 / Stage2 / カテゴリ変換表 / 自信度しきい値 / 特徴量の設定)を1ファイルにまとめた形式。
+
+従来は5つの .pkl をそれぞれ joblib.load していた。ここでは model_registry.py の各バージョンに
+bundle.kbundle を1つだけ置き、
+
+  MAGIC(8バイト) | ヘッダ長(8バイト, little endian) | ヘッダ(JSON) | 推定器の pickle と配列の中身(64バイト境界)
+
+の形で持つ。
+
+  - 軽いもの(カテゴリ変換表・しきい値・特徴量の設定・manifest)はヘッダの JSON に入れる。開くときに読むのはここだけ
+  - 推定器(Stage1 / Stage2)は pickle protocol 5 で、numpy 配列の中身を pickle の外(out-of-band)に書く。
+    初めて使うときにファイルを mmap して pickle を戻す。配列は mmap した領域をそのまま指す(コピーしない、読み取り専用)
+
+開いただけでは sklearn も joblib も import しないので、しきい値や設定だけ見たい処理はすぐ終わる。
+"""
+import json
+import mmap
+import os
+import pickle
+import struct
+
+MAGIC = b'KRNBNDL1'
+BUNDLE_NAME = 'bundle.kbundle'
+LIGHT = ('category_maps', 'confidence_threshold', 'feature_config')
+HEAVY = ('stage1_model', 'stage2_model')
+ALIGN = 64
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_bundle(path, artifacts, manifest=None):
+    """artifacts({名前: オブジェクト}、LIGHT と HEAVY がすべて必要)を path に1ファイルで書く。"""
+    # 推定器ごとに pickle 本体と配列のバッファを並べ、データ部の先頭からの位置を決める
+    segments, heavy, pos = [], {}, 0
+    for name in HEAVY:
+        buffers = []
+        payload = pickle.dumps(artifacts[name], protocol=5, buffer_callback=buffers.append)
+        entry = {'pickle': [pos, len(payload)], 'buffers': []}
+        segments.append((pos, payload))
+        pos = _align(pos + len(payload))
+        for buf in buffers:
+            raw = buf.raw()
+            entry['buffers'].append([pos, raw.nbytes])
+            segments.append((pos, raw))
+            pos = _align(pos + raw.nbytes)
+        heavy[name] = entry
+
+    header = json.dumps({
+        'manifest': manifest or {},
+        'light': {name: artifacts[name] for name in LIGHT},
+        'heavy': heavy,
+    }, ensure_ascii=False).encode('utf-8')
+    data_start = _align(16 + len(header))
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        for offset, data in segments:
+            f.seek(data_start + offset)
+            f.write(data)
+        f.truncate(data_start + pos)
+    os.replace(tmp, path)
+
+
+class ModelBundle:
+    """bundle.kbundle を開く。model['stage1_model'] のように名前で引く(推定器は初めて引いたときに読む)。"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(8) != MAGIC:
+                raise ValueError(f'モデルのバンドルではありません: {path}')
+            (n,) = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(n).decode('utf-8'))
+        self._data_start = _align(16 + n)
+        self._light = header['light']
+        self._heavy = header['heavy']
+        self._loaded = {}
+        self._mm = None
+        self.manifest = header['manifest']
+        self.version = self.manifest.get('version')
+
+    def keys(self):
+        return list(LIGHT) + list(HEAVY) + ['version']
+
+    def _view(self, offset, length):
+        if self._mm is None:
+            with open(self.path, 'rb') as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = self._data_start + offset
+        return memoryview(self._mm)[start:start + length]
+
+    def __getitem__(self, name):
+        if name == 'version':
+            return self.version
+        if name in self._light:
+            return self._light[name]
+        if name not in self._loaded:
+            entry = self._heavy[name]
+            buffers = [self._view(o, n) for o, n in entry['buffers']]
+            self._loaded[name] = pickle.loads(self._view(*entry['pickle']), buffers=buffers)
+        return self._loaded[name]
@@ -0,0 +1,270 @@
+"""
+model_registry.py
+------------------
+本番用モデル一式(build_production_models.py が作るもの)をバージョンごとに分けて持つ置き場。
+
+従来は models/stage1_model.pkl などを学習のたびにその場で上書きしていたので、学習の途中で
+daily_predict.py が動くと新旧のファイルが混ざるうえ、前のモデルに戻すこともできなかった。ここでは
+
+  models/
+    versions/{version}/
+      bundle.kbundle     : stage1_model / stage2_model / category_maps / confidence_threshold / feature_config
+                           をまとめた1ファイル(model_bundle.py 参照)
+      validation_report.json
+      manifest.json      : 作成日時・モード・学習データの期間・検証指標・特徴量設定のハッシュ・元にしたバージョン
+    CURRENT              : 本番で使うバージョン名(1行)
+    promote.log          : CURRENT を切り替えた履歴(rollback 用。rollback した行には rollback の印を付ける)
+
+のように持つ。
+
+  - 学習中は versions/.{version}.tmp/ に書き、全部そろってから versions/{version}/ に名前を変える
+    (途中で落ちても、書きかけのバージョンは一覧にも CURRENT にも出てこない)
+  - 一度できたバージョンのフォルダは書き換えない
+  - CURRENT は別名で書いてから os.replace で置き換えるので、読み手は必ず古いか新しいかのどちらかを見る
+  - open(version) / load(version) でどのバージョンでも読める。version を省略すると CURRENT のもの
+  - CURRENT が無い(このしくみを入れる前の)models/ や、バンドルの無いバージョンは、.pkl を従来どおり読む
+
+    python src/model_registry.py list
+    python src/model_registry.py show [VERSION]
+    python src/model_registry.py promote VERSION
+    python src/model_registry.py rollback
+    python src/model_registry.py bundle VERSION     (.pkl だけのバージョンにバンドルを足す)
+"""
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from model_bundle import BUNDLE_NAME, ModelBundle, write_bundle
+
+DEFAULT_ROOT = 'models'
+ARTIFACTS = ['stage1_model', 'stage2_model', 'category_maps', 'confidence_threshold', 'feature_config']
+LEGACY = 'legacy'
+
+
+def config_hash(cfg):
+    """特徴量の設定(feature_config)のハッシュ。同じ特徴量の並びで学習したモデルかどうかを manifest で見分ける。"""
+    text = json.dumps(cfg, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _load_pickles(path, names):
+    import joblib
+    return {name: joblib.load(os.path.join(path, f'{name}.pkl')) for name in names}
+
+
+def _write_atomic(path, text):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Draft:
+    """書きかけのバージョン。save() でモデル一式を1つずつ受け取り、publish() でバンドルに書いて確定させる。"""
+
+    def __init__(self, registry, version, mode):
+        self.registry = registry
+        self.version = version
+        self.mode = mode
+        self.path = os.path.join(registry.versions_dir, f'.{version}.tmp')
+        self.artifacts = {}
+        os.makedirs(self.path)
+
+    def save(self, name, obj):
+        self.artifacts[name] = obj
+
+    def write_json(self, name, data):
+        with open(os.path.join(self.path, f'{name}.json'), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    def publish(self, manifest, promote=True):
+        """バンドルと manifest.json を書いてバージョンを確定し(promote なら CURRENT にもし)、バージョン名を返す。"""
+        missing = [n for n in ARTIFACTS if n not in self.artifacts]
+        if missing:
+            raise ValueError(f'モデル一式がそろっていません: {missing}')
+        manifest = {'version': self.version, 'created_at': _now(), 'mode': self.mode, **manifest}
+        write_bundle(os.path.join(self.path, BUNDLE_NAME), self.artifacts, manifest)
+        self.write_json('manifest', manifest)
+        os.replace(self.path, self.registry.version_dir(self.version))
+        if promote:
+            self.registry.promote(self.version)
+        return self.version
+
+
+class ModelRegistry:
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+        self.versions_dir = os.path.join(root, 'versions')
+        self.current_path = os.path.join(root, 'CURRENT')
+        self.log_path = os.path.join(root, 'promote.log')
+        os.makedirs(self.versions_dir, exist_ok=True)
+
+    def version_dir(self, version):
+        return os.path.join(self.versions_dir, version)
+
+    def versions(self):
+        """確定済みのバージョン名(古い順)。"""
+        return sorted(d for d in os.listdir(self.versions_dir)
+                      if not d.startswith('.') and os.path.isdir(self.version_dir(d)))
+
+    def current(self):
+        """CURRENT のバージョン名(無ければ None)。"""
+        if not os.path.exists(self.current_path):
+            return None
+        with open(self.current_path, encoding='utf-8') as f:
+            return f.read().strip() or None
+
+    # ---------------- 書き込み ----------------
+    def begin(self, mode):
+        """新しいバージョンの書き込みを始める(バージョン名は 作成日時-モード)。"""
+        base = f'{datetime.now():%Y%m%d-%H%M%S}-{mode}'
+        version, n = base, 1
+        while os.path.exists(self.version_dir(version)) or os.path.exists(
+                os.path.join(self.versions_dir, f'.{version}.tmp')):
+            n += 1
+            version = f'{base}-{n}'
+        return Draft(self, version, mode)
+
+    def promote(self, version):
+        """version を CURRENT にする。"""
+        self._switch(version)
+
+    def _switch(self, version, action=None):
+        if version not in self.versions():
+            raise ValueError(f'バージョンがありません: {version}')
+        _write_atomic(self.current_path, version + '\n')
+        fields = [_now()] + ([action] if action else []) + [version]
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write('\t'.join(fields) + '\n')
+
+    def history(self):
+        """
+        promote.log を頭から読み、CURRENT にしてきたバージョンを古い順に返す(最後が今の CURRENT)。
+        rollback の行では戻した先より上を取り除くので、rollback を続けるとさらに前のバージョンへ戻っていく
+        (A → B → C から rollback, rollback で B, A)。
+        """
+        stack = []
+        if not os.path.exists(self.log_path):
+            return stack
+        with open(self.log_path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) >= 3 and fields[1] == 'rollback':
+                    while stack and stack[-1] != fields[2]:
+                        stack.pop()
+                    if not stack:
+                        stack.append(fields[2])
+                else:
+                    stack.append(fields[-1])
+        return stack
+
+    def rollback(self):
+        """CURRENT を、その前に CURRENT だったバージョンに戻し、戻した先のバージョン名を返す。"""
+        current = self.current()
+        available = set(self.versions())
+        for version in reversed(self.history()):
+            if version != current and version in available:
+                self._switch(version, 'rollback')
+                return version
+        raise ValueError('戻せるバージョンがありません')
+
+    # ---------------- 読み込み ----------------
+    def _resolve(self, version):
+        version = version or self.current()
+        if version is None:
+            return LEGACY, self.root
+        if version not in self.versions():
+            raise ValueError(f'バージョンがありません: {version}')
+        return version, self.version_dir(version)
+
+    def artifact_paths(self, version=None):
+        """
+        version のモデル一式のファイル(バンドルがあればそれ、無ければ .pkl)。予測結果のキャッシュのキーに使う
+        ('legacy' はバージョン名が変わらないので、ファイルで作り直しを見分ける)。
+        """
+        version, path = (LEGACY, self.root) if version == LEGACY else self._resolve(version)
+        bundle_path = os.path.join(path, BUNDLE_NAME)
+        if os.path.exists(bundle_path):
+            return [bundle_path]
+        return [os.path.join(path, f'{name}.pkl') for name in ARTIFACTS]
+
+    def manifest(self, version=None):
+        version, path = self._resolve(version)
+        manifest_path = os.path.join(path, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            return {'version': version}
+        with open(manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def open(self, version=None):
+        """
+        version(省略時は CURRENT)のモデル一式を、models['stage1_model'] のように名前で引ける形で返す。
+        バンドルがあれば ModelBundle(推定器は初めて引いたときに読む)、無ければ .pkl を全部読んだ dict。
+        CURRENT が無ければ models/ 直下の従来のファイルを読む(バージョン名は 'legacy')。
+        """
+        version, path = self._resolve(version)
+        bundle_path = os.path.join(path, BUNDLE_NAME)
+        if os.path.exists(bundle_path):
+            return ModelBundle(bundle_path)
+        return {**_load_pickles(path, ARTIFACTS), 'version': version}
+
+    def load(self, version=None, names=ARTIFACTS):
+        """open() したものから names を読み出して {名前: オブジェクト} で返す。バージョン名は 'version' に入る。"""
+        models = self.open(version)
+        return {**{name: models[name] for name in names}, 'version': models['version']}
+
+    def add_bundle(self, version):
+        """.pkl だけで持っているバージョンにバンドルを足す(確定済みのファイルは書き換えない)。"""
+        version, path = self._resolve(version)
+        if version == LEGACY:
+            raise ValueError('CURRENT の無い models/ にはバンドルを足せません')
+        write_bundle(os.path.join(path, BUNDLE_NAME), _load_pickles(path, ARTIFACTS), self.manifest(version))
+
+
+def _print_manifest(m, current=None):
+    mark = '*' if m.get('version') == current else ' '
+    span = '〜'.join(m.get('data_range') or ['-'])
+    s1 = (m.get('metrics') or {}).get('stage1') or {}
+    metric = f"logloss={s1['logloss']:.4f}" if 'logloss' in s1 else ''
+    print(f"{mark} {m.get('version'):<28} {m.get('mode', '-'):<11} {span}  {metric}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', default=DEFAULT_ROOT)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('list', help='バージョンの一覧(* が CURRENT)')
+    p_show = sub.add_parser('show', help='manifest を表示する(省略時は CURRENT)')
+    p_show.add_argument('version', nargs='?')
+    p_promote = sub.add_parser('promote', help='指定したバージョンを CURRENT にする')
+    p_promote.add_argument('version')
+    sub.add_parser('rollback', help='CURRENT を1つ前に使っていたバージョンに戻す')
+    p_bundle = sub.add_parser('bundle', help='.pkl だけのバージョンにバンドルを足す')
+    p_bundle.add_argument('version')
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.root)
+    if args.cmd == 'list':
+        current = registry.current()
+        for v in registry.versions():
+            _print_manifest(registry.manifest(v), current)
+    elif args.cmd == 'show':
+        print(json.dumps(registry.manifest(args.version), ensure_ascii=False, indent=2))
+    elif args.cmd == 'promote':
+        registry.promote(args.version)
+        print(f'CURRENT -> {args.version}')
+    elif args.cmd == 'bundle':
+        registry.add_bundle(args.version)
+        print(f'{args.version} に {BUNDLE_NAME} を作りました。')
+    else:
+        print(f'CURRENT -> {registry.rollback()}')
@@ -0,0 +1,274 @@
+"""
+native_class_model.py
+----------------------
+t_race.py のクラス別モデル(PyCaret の save_model で保存したパイプライン)を、PyCaret を使わずに
+numpy と LightGBM の Booster だけで予測するための書き出しと読み込み。
+
+PyCaret は import だけで数秒かかり、predict_model は呼ぶたびに前処理のパイプライン全体
+(欠損補完・エンコーディング・特徴量選択・列名の整形)を通す。t_race.py がモデルに渡す入力は
+align_features_strictly で全部 float にした列なので、前処理は「入力の1列 -> 出力のいくつかの列」という
+列ごとの変換になっている。書き出しでは学習済みのパイプラインに値を流してみて、この変換を
+
+  - そのまま通す列(数値の列)
+  - 値 -> 出力 の対応表(カテゴリの列。ワンホット・ターゲットエンコーディングなど。表に無い値は未知の値と同じ出力)
+  - 定数の列(どの入力にもよらない列)
+
+の配列に書き直す。最後の推定器は LightGBM なら Booster のモデル文字列、それ以外(1着モデルのスタッキングなど)は
+sklearn の推定器のまま持つ。書き出した直後に、ランダムな入力で元のパイプラインと予測確率が一致するかを確かめる。
+
+  native_models/{モデル名}.native.pkl
+
+スコアは predict_model の prediction_score と同じ「予測ラベルの確率(小数4桁に丸め)」。
+元の {モデル名}.pkl が書き出した後に作り直されていたら、読み込まずに None を返す(t_race.py は PyCaret で予測する)。
+
+    python src/native_class_model.py export       (PyCaret が入っている環境で、モデルのあるフォルダで実行)
+"""
+import argparse
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+NATIVE_DIR = 'native_models'
+CLASS_MODELS = {
+    'girls': 'keirin_model_3rd_girls',
+    'challenge': 'keirin_model_3rd_challenge',
+    'a_class': 'keirin_model_3rd_a_class',
+    's_class': 'keirin_model_3rd_s_class',
+}
+FIRST_MODEL = 'keirin_model_1st_place_challenge'
+
+# 列ごとの変換を調べるときに流す値(SENTINEL はどのカテゴリにも無い値として使う)
+PROBE_VALUES = [1.5, -2.25, 1234.5]
+SENTINEL = -987654.321
+N_CHECK = 500
+
+
+def native_path(name, native_dir=NATIVE_DIR):
+    return os.path.join(native_dir, f'{name}.native.pkl')
+
+
+def source_stamp(path):
+    """元のモデルファイルの (サイズ, 更新時刻)。作り直されたかどうかの判定に使う。"""
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def required_features(model):
+    """モデルに渡す入力列(t_race.align_features_strictly と同じ決め方)。"""
+    if hasattr(model, 'feature_names_in_'):
+        return list(model.feature_names_in_)
+    return list(model.steps[0][1].feature_names_in_)
+
+
+def input_matrix(df, inputs):
+    """align_features_strictly と同じく、入力列を数値にして欠損・無い列を 0 にした float の行列。"""
+    out = np.zeros((len(df), len(inputs)))
+    for i, col in enumerate(inputs):
+        if col in df.columns:
+            out[:, i] = pd.to_numeric(df[col], errors='coerce').fillna(0.0).to_numpy(dtype=float)
+    return out
+
+
+# ---------------------------------------------------------------------------
+# 書き出し(PyCaret のパイプラインを読める環境で使う)
+# ---------------------------------------------------------------------------
+def _preprocess(pipeline, X):
+    for _, step in pipeline.steps[:-1]:
+        out = step.transform(X)
+        X = out[0] if isinstance(out, tuple) else out
+    return X
+
+
+def _category_values(obj, found, depth=0):
+    """パイプラインの中のエンコーダが知っているカテゴリ値を 列 -> 値の集合 で集める。"""
+    if obj is None or depth > 4:
+        return
+    for enc in (obj, getattr(obj, 'ordinal_encoder', None)):
+        mapping = getattr(enc, 'mapping', None)
+        if isinstance(mapping, list):
+            for m in mapping:
+                if isinstance(m, dict) and 'col' in m and hasattr(m.get('mapping'), 'index'):
+                    found.setdefault(m['col'], set()).update(m['mapping'].index)
+    categories = getattr(obj, 'categories_', None)
+    if categories is not None and hasattr(obj, 'feature_names_in_'):
+        for col, values in zip(obj.feature_names_in_, categories):
+            found.setdefault(col, set()).update(values)
+    for name in ('transformer', 'estimator'):
+        _category_values(getattr(obj, name, None), found, depth + 1)
+    for item in getattr(obj, 'steps', None) or getattr(obj, 'transformers_', None) or []:
+        _category_values(item[1], found, depth + 1)
+
+
+def _probe_keys(values):
+    keys = pd.to_numeric(pd.Series(list(values), dtype=object), errors='coerce').dropna().astype(float)
+    return np.unique(np.append(keys.to_numpy(), 0.0))
+
+
+def compile_preprocessing(pipeline, inputs):
+    """パイプラインの前処理を、入力の列ごとの変換(通す列・対応表・定数)の配列に書き直す。"""
+    found = {}
+    for _, step in pipeline.steps[:-1]:
+        _category_values(step, found)
+
+    # 入力の列ごとに、その列だけを動かした行をまとめて流す(他の列は 0)
+    base = _preprocess(pipeline, pd.DataFrame(np.zeros((1, len(inputs))), columns=inputs))
+    out_cols = list(base.columns)
+    base = base.to_numpy(dtype=float)[0]
+    probes, blocks = [], []
+    for i, col in enumerate(inputs):
+        keys = _probe_keys(found.get(col, ()))
+        values = np.concatenate([keys, PROBE_VALUES, [SENTINEL]])
+        rows = np.zeros((len(values), len(inputs)))
+        rows[:, i] = values
+        blocks.append((i, keys, values, sum(len(p) for p in probes)))
+        probes.append(rows)
+    outputs = _preprocess(pipeline, pd.DataFrame(np.vstack(probes), columns=inputs))
+    outputs = outputs[out_cols].to_numpy(dtype=float)
+
+    owner = np.full(len(out_cols), -1)
+    passes, lookups = [], []
+    for i, keys, values, start in blocks:
+        block = outputs[start:start + len(values)]
+        changed = np.flatnonzero((block != base).any(axis=0))
+        if len(changed) == 0:
+            continue  # 特徴量選択で落ちた列
+        if (owner[changed] >= 0).any():
+            raise ValueError(f'{inputs[i]}: 複数の入力列にまたがる変換には対応していません')
+        owner[changed] = i
+        if len(changed) == 1 and np.array_equal(block[:, changed[0]], values):
+            passes.append((i, int(changed[0])))
+            continue
+        default = block[-1, changed]
+        if not (block[len(keys):, changed] == default).all():
+            raise ValueError(f'{inputs[i]}: カテゴリでも素通しでもない変換には対応していません')
+        lookups.append({'src': i, 'out': changed, 'keys': keys, 'values': block[:len(keys)][:, changed],
+                        'default': default})
+
+    const = np.flatnonzero(owner < 0)
+    return {
+        'inputs': list(inputs),
+        'out_cols': out_cols,
+        'const_out': const,
+        'const_values': base[const],
+        'pass_src': np.array([p[0] for p in passes], dtype=int),
+        'pass_out': np.array([p[1] for p in passes], dtype=int),
+        'lookups': lookups,
+    }
+
+
+def export_model(pipeline, name, source_dir='.', native_dir=NATIVE_DIR):
+    """学習済みのパイプラインを書き出し、元のパイプラインとの予測確率の最大差を返す。"""
+    spec = compile_preprocessing(pipeline, required_features(pipeline))
+    est = pipeline.steps[-1][1]
+    booster = getattr(est, 'booster_', None)
+    if booster is not None and hasattr(booster, 'model_to_string'):
+        spec['estimator'] = ('lightgbm', booster.model_to_string())
+    else:
+        spec['estimator'] = ('sklearn', est)
+    spec['name'] = name
+    spec['source'] = source_stamp(os.path.join(source_dir, f'{name}.pkl'))
+
+    # ランダムな入力(カテゴリの列は対応表の値が多め)で、元のパイプラインと比べる
+    rng = np.random.default_rng(0)
+    X = rng.normal(scale=10, size=(N_CHECK, len(spec['inputs'])))
+    for lk in spec['lookups']:
+        pick = rng.random(N_CHECK) < 0.8
+        X[pick, lk['src']] = rng.choice(lk['keys'], pick.sum())
+    expected = pipeline.predict_proba(pd.DataFrame(X, columns=spec['inputs']))[:, 1]
+    model = NativeClassModel(spec)
+    diff = float(np.abs(model.predict_proba_matrix(X) - expected).max())
+    if diff > 1e-9:
+        raise ValueError(f'{name}: 書き出したモデルの予測が元のパイプラインと一致しません(最大差 {diff:.3g})')
+
+    os.makedirs(native_dir, exist_ok=True)
+    tmp = native_path(name, native_dir) + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(spec, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, native_path(name, native_dir))
+    return diff
+
+
+# ---------------------------------------------------------------------------
+# 予測(PyCaret 不要)
+# ---------------------------------------------------------------------------
+class NativeClassModel:
+    def __init__(self, spec):
+        self.spec = spec
+        self.name = spec.get('name')
+        self.inputs = spec['inputs']
+        self.feature_names_in_ = np.array(self.inputs, dtype=object)
+        kind, est = spec['estimator']
+        if kind == 'lightgbm':
+            import lightgbm as lgb
+            self._booster = lgb.Booster(model_str=est)
+            self._estimator = None
+        else:
+            self._booster = None
+            self._estimator = est
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls(pickle.load(f))
+
+    def transform_matrix(self, X):
+        """入力の行列(input_matrix)を、最後の推定器に渡す特徴量の行列にする。"""
+        s = self.spec
+        out = np.empty((len(X), len(s['out_cols'])))
+        out[:, s['const_out']] = s['const_values']
+        out[:, s['pass_out']] = X[:, s['pass_src']]
+        for lk in s['lookups']:
+            x = X[:, lk['src']]
+            pos = np.minimum(np.searchsorted(lk['keys'], x), len(lk['keys']) - 1)
+            hit = lk['keys'][pos] == x
+            out[:, lk['out']] = np.where(hit[:, None], lk['values'][pos], lk['default'])
+        return out
+
+    def predict_proba_matrix(self, X):
+        """入力の行列から、クラス 1 の予測確率。"""
+        features = self.transform_matrix(X)
+        if self._booster is not None:
+            return self._booster.predict(features)
+        return self._estimator.predict_proba(pd.DataFrame(features, columns=self.spec['out_cols']))[:, 1]
+
+    def predict_proba(self, df):
+        return self.predict_proba_matrix(input_matrix(df, self.inputs))
+
+    def prediction_score(self, df):
+        """predict_model の prediction_score と同じ値(予測ラベルの確率を小数4桁に丸めたもの)。"""
+        p = self.predict_proba(df)
+        return np.round(np.maximum(p, 1 - p), 4)
+
+
+def load_native(name, native_dir=NATIVE_DIR, source_dir='.'):
+    """書き出したモデルを読む。無い、または元のモデルが書き出し後に作り直されていれば None。"""
+    path = native_path(name, native_dir)
+    if not os.path.exists(path):
+        return None
+    model = NativeClassModel.load(path)
+    source = os.path.join(source_dir, f'{name}.pkl')
+    if os.path.exists(source) and source_stamp(source) != model.spec['source']:
+        print(f"  [⚠️警告] {name}.pkl が書き出し後に更新されています。"
+              f"python src/native_class_model.py export で書き出し直してください。")
+        return None
+    return model
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_export = sub.add_parser('export', help='PyCaret のモデルを PyCaret 無しで予測できる形に書き出す')
+    p_export.add_argument('names', nargs='*', help='モデル名(省略時は t_race.py で使う5つ)')
+    p_export.add_argument('--out', default=NATIVE_DIR)
+    args = parser.parse_args()
+
+    from pycaret.classification import load_model
+
+    for name in args.names or list(CLASS_MODELS.values()) + [FIRST_MODEL]:
+        try:
+            diff = export_model(load_model(name, verbose=False), name, native_dir=args.out)
+            print(f'  [成功] {name} -> {native_path(name, args.out)}(元のモデルとの最大差 {diff:.3g})')
+        except (FileNotFoundError, ValueError) as e:
+            print(f'  [⚠️失敗] {name}: {e}')
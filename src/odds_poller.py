@@ -0,0 +1,116 @@
+"""
+odds_poller.py
+---------------
+today_race_info2.pkl の「開始時間」から各レースのオッズ取得予定を立て、発走まで繰り返し取得して
+odds_store に積んでいく常駐スクリプト。発走が近いレースほど間隔を詰める(POLL_SCHEDULE)。
+
+  発走60分以上前 : 15分ごと
+  30〜60分前     : 10分ごと
+  10〜30分前     : 5分ごと
+  3〜10分前      : 2分ごと
+  3分前〜発走    : 1分ごと(オッズページのキャッシュ有効期限 TTL_ODDS と同じ)
+
+1回の取得では「今取るべきレース」をまとめて odds_snapshot.snapshot で並列に取る。
+発走時刻を過ぎたレースは対象から外し、全レースが終わったら終了する。
+
+ev_ranker / ev_ranker_2shahuku は odds_snapshot.load_or_take 経由でこのストアの最新分を使うので、
+ポーラーを動かしておけばランカー実行時の取得待ちがほぼ無くなる。
+
+    python src/odds_poller.py [--race-info today_race_info2.pkl] [--once]
+"""
+import argparse
+import re
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import kdreams_http
+import odds_snapshot
+from odds_store import OddsStore
+from race_id_index import kaisai_date
+
+# (発走までの残り秒数がこれ以上なら, 取得間隔(秒))。上から順に判定する
+POLL_SCHEDULE = [
+    (60 * 60, 15 * 60),
+    (30 * 60, 10 * 60),
+    (10 * 60, 5 * 60),
+    (3 * 60, 2 * 60),
+    (0, kdreams_http.TTL_ODDS),
+]
+
+_RE_HHMM = re.compile(r"(\d{1,2}):(\d{2})")
+
+
+def post_time_of(race_id, start_time):
+    """race_id(開催日) と 開始時間("15:40" など) から発走日時を作る。読めなければ None。"""
+    m = _RE_HHMM.search(str(start_time))
+    if not m:
+        return None
+    day = kaisai_date(str(race_id)[:12])
+    return day + timedelta(hours=int(m.group(1)), minutes=int(m.group(2)))
+
+
+def poll_interval(seconds_to_post):
+    for threshold, interval in POLL_SCHEDULE:
+        if seconds_to_post >= threshold:
+            return interval
+    return POLL_SCHEDULE[-1][1]
+
+
+def post_times(race_info):
+    """race_info から {race_id: 発走日時} を作る。"""
+    out = {}
+    for rid, st in zip(race_info["race_id"].astype(str), race_info["開始時間"]):
+        t = post_time_of(rid, st)
+        if t is None:
+            print(f"[WARN] 開始時間が読めないためポーリング対象外: {rid} {st!r}")
+            continue
+        out[rid] = t
+    return out
+
+
+def poll(race_posts, store=None, once=False, bet_types=odds_snapshot.BET_TYPES):
+    """
+    race_posts({race_id: 発走日時}) の各レースを、発走まで POLL_SCHEDULE の間隔で取得し続ける。
+    once=True なら、今取るべきレースを1回取得して終わる。
+    """
+    store = store or OddsStore()
+    next_due = {rid: datetime.min for rid in race_posts}
+
+    while True:
+        now = datetime.now()
+        # 発走済みのレースは外す
+        for rid in [r for r in next_due if race_posts[r] <= now]:
+            del next_due[rid]
+        if not next_due:
+            print("[OK] 全レースが発走済みのため終了します。")
+            return
+
+        due = [rid for rid, t in next_due.items() if t <= now]
+        if due:
+            df = odds_snapshot.snapshot(due, bet_types=bet_types)
+            store.append(df)
+            done = now.strftime("%H:%M:%S")
+            print(f"[{done}] {len(due)} レース / {len(df)} 行を保存")
+            for rid in due:
+                left = (race_posts[rid] - now).total_seconds()
+                next_due[rid] = now + timedelta(seconds=poll_interval(left))
+
+        if once:
+            return
+
+        wake = min(next_due.values())
+        time.sleep(max(1.0, (wake - datetime.now()).total_seconds()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--race-info", default="today_race_info2.pkl")
+    parser.add_argument("--once", action="store_true")
+    args = parser.parse_args()
+
+    race_info = pd.read_pickle(args.race_info)
+    race_posts = post_times(race_info)
+    print(f"ポーリング対象: {len(race_posts)} レース")
+    poll(race_posts, once=args.once)
@@ -0,0 +1,294 @@
+"""
+odds_snapshot.py
+-----------------
+当日の全レース・全券種のオッズをまとめて取得し、1枚の縦長テーブルにするモジュール。
+
+  race_id | bet_type | combination | odds | fetched_at
+  (combination は 3連単 "1-2-3"、2車複 "1-2"(小さい車番が先))
+
+ev_ranker / ev_ranker_2shahuku はそれぞれ race_id ごとに直列で取得し、ページごとに
+BeautifulSoup で解析していた。ここでは (race_id, 券種) の全ページをスレッドプールで並列に取り
+(アクセス間隔は kdreams_http のレート制御が守る)、lxml + 事前コンパイル済み XPath で解析する。
+
+取得結果は odds_store(時系列の追記専用ストア)に積み、有効期限(kdreams_http.TTL_ODDS)内なら
+両ランカーで使い回す。ev_ranker を実行すると両券種が一度に取れるので、続けて
+ev_ranker_2shahuku を実行しても再取得しない。
+
+fetched_at はページを実際に取得した時刻(キャッシュファイルの更新時刻。--replay 時は元の取得時刻)。
+
+単体実行(today_race_info2.pkl の全レースを1回取得して odds_store に追記):
+    python src/odds_snapshot.py
+"""
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import lxml.html
+import pandas as pd
+from lxml import etree
+from tqdm import tqdm
+
+import kdreams_http
+from odds_store import OddsStore
+
+BASE = "https://keirin.kdreams.jp/gamboo/keirin-kaisai/race-card/odds"
+
+BET_TYPES = ("3rentan", "2shahuku")
+COLUMNS = ["race_id", "bet_type", "combination", "odds", "fetched_at"]
+
+DEFAULT_MAX_WORKERS = 8
+
+_X_ODDS_TABLES = etree.XPath(
+    "//table[contains(concat(' ', normalize-space(@class), ' '), ' odds_table ')]"
+)
+_X_TR = etree.XPath(".//tr")
+_X_TH = etree.XPath(".//th")
+_X_TD = etree.XPath(".//td")
+_X_NUMBER_SPAN = etree.XPath(
+    "(.//span[contains(concat(' ', normalize-space(@class), ' '), ' number ')])[1]"
+)
+_RE_CAR = re.compile(r"n(\d+)")
+
+
+def build_odds_url(race_id: str, bet_type: str) -> str:
+    """
+    /odds/{race_id_1}/{kaisai_id}00/{race_no}/{bet_type}/#detail
+    """
+    race_id_1 = race_id[:10]
+    kaisai_id = race_id[:12]
+    race_no = int(race_id[-2:])
+    return f"{BASE}/{race_id_1}/{kaisai_id}00/{race_no}/{bet_type}/#detail"
+
+
+def _text_to_float(s: str):
+    s = s.strip()
+    if not s:
+        return None
+    s = s.replace(",", "")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def _cell_text(node):
+    # BeautifulSoup の get_text(" ", strip=True) と同じ
+    return " ".join(t.strip() for t in node.itertext() if t.strip())
+
+
+def _car_no(node):
+    m = _RE_CAR.search(node.get("class") or "")
+    return int(m.group(1)) if m else None
+
+
+def _is_empty(td):
+    return "empty" in (td.get("class") or "").split()
+
+
+def parse_3rentan(html: str):
+    """3連単オッズページから [(1着, 2着, 3着, オッズ), ...] を返す。"""
+    if "odds_table" not in html:
+        return []
+
+    rows = []
+    seen = set()
+    for tb in _X_ODDS_TABLES(lxml.html.fromstring(html)):
+        trs = _X_TR(tb)
+        if len(trs) < 4:
+            continue
+
+        # 1着：display:none でない th の span.number
+        first_num = None
+        for th in _X_TH(trs[0]):
+            if "display:none" in (th.get("style") or "").replace(" ", "").lower():
+                continue
+            found = _X_NUMBER_SPAN(th)
+            if found:
+                t = _cell_text(found[0]).replace(" ", "")
+                if t.isdigit():
+                    first_num = int(t)
+                    break
+        if first_num is None:
+            continue
+
+        # 2着：2行目の th（rowspanなし）の列番号
+        second_nums = [n for n in (_car_no(th) for th in _X_TH(trs[1]) if not th.get("rowspan")) if n is not None]
+        if not second_nums:
+            continue
+
+        # データ行：行頭 th が3着
+        for tr in trs[3:]:
+            ths = _X_TH(tr)
+            if not ths:
+                continue
+            third_num = _car_no(ths[0])
+            if third_num is None:
+                continue
+
+            for second_num, td in zip(second_nums, _X_TD(tr)):
+                # emptyセルはスキップ（ただし列位置は進む）
+                if _is_empty(td):
+                    continue
+                odds = _text_to_float(_cell_text(td))
+                if odds is None:
+                    continue
+                key = (first_num, second_num, third_num)
+                if key in seen:
+                    continue
+                seen.add(key)
+                rows.append((first_num, second_num, third_num, odds))
+    return rows
+
+
+def parse_2shahuku(html: str):
+    """2車複オッズページから [(a, b, オッズ), ...](a<b) を返す。"""
+    if "odds_table" not in html:
+        return []
+
+    tables = _X_ODDS_TABLES(lxml.html.fromstring(html))
+    if not tables:
+        return []
+    trs = _X_TR(tables[0])
+    if len(trs) < 3:
+        return []
+
+    # 1行目：列ヘッダ（th.n1..n7）。class が無ければ数字のテキスト
+    col_nums = [n for n in (_car_no(th) for th in _X_TH(trs[0])) if n is not None]
+    if not col_nums:
+        col_nums = [int(t) for t in (_cell_text(th).replace(" ", "") for th in _X_TH(trs[0])) if t.isdigit()]
+    if not col_nums:
+        return []
+
+    rows = []
+    seen = set()
+    # trs[1] は選手名行。trs[2:] がオッズ行列
+    for tr in trs[2:]:
+        ths = _X_TH(tr)
+        if not ths:
+            continue
+        row_num = _car_no(ths[0])
+        if row_num is None:
+            t = _cell_text(ths[0]).replace(" ", "")
+            if not t.isdigit():
+                continue
+            row_num = int(t)
+
+        for col_num, td in zip(col_nums, _X_TD(tr)):
+            if _is_empty(td):
+                continue
+            odds = _text_to_float(_cell_text(td))
+            if odds is None:
+                continue
+            a, b = sorted([row_num, col_num])
+            if a == b or (a, b) in seen:
+                continue
+            seen.add((a, b))
+            rows.append((a, b, odds))
+    return rows
+
+
+PARSERS = {
+    "3rentan": parse_3rentan,
+    "2shahuku": parse_2shahuku,
+}
+
+
+def _fetched_at(url):
+    try:
+        return datetime.fromtimestamp(os.path.getmtime(kdreams_http.cache_path(url)))
+    except OSError:
+        return datetime.now()
+
+
+def fetch_one(race_id: str, bet_type: str, timeout=20) -> pd.DataFrame:
+    """1レース・1券種分のオッズを縦長形式で返す。"""
+    url = build_odds_url(race_id, bet_type)
+    html = kdreams_http.fetch_text(url, timeout=timeout)
+    fetched_at = _fetched_at(url)
+
+    rows = PARSERS[bet_type](html)
+    return pd.DataFrame({
+        "race_id": race_id,
+        "bet_type": bet_type,
+        "combination": ["-".join(str(n) for n in r[:-1]) for r in rows],
+        "odds": [r[-1] for r in rows],
+        "fetched_at": fetched_at,
+    }, columns=COLUMNS)
+
+
+def snapshot(race_ids, bet_types=BET_TYPES, max_workers=DEFAULT_MAX_WORKERS, timeout=20) -> pd.DataFrame:
+    """
+    race_ids × bet_types の全オッズページを並列に取得し、縦長テーブル1枚にして返す。
+    取得に失敗したページは飛ばす(従来のランカーと同じく、そのレースだけ欠ける)。
+    """
+    jobs = [(str(rid), bt) for rid in race_ids for bt in bet_types]
+    frames = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        futures = {ex.submit(fetch_one, rid, bt, timeout): (rid, bt) for rid, bt in jobs}
+        for fut in tqdm(as_completed(futures), total=len(futures), desc="odds snapshot"):
+            try:
+                frames[futures[fut]] = fut.result()
+            except Exception as e:
+                rid, bt = futures[fut]
+                print(f"[WARN] オッズ取得失敗: {rid} {bt}: {e}")
+
+    ordered = [frames[j] for j in jobs if j in frames and not frames[j].empty]
+    if not ordered:
+        return pd.DataFrame(columns=COLUMNS)
+    return pd.concat(ordered, ignore_index=True)
+
+
+def load_or_take(race_ids, bet_type, store=None, max_age=kdreams_http.TTL_ODDS, **kwargs) -> pd.DataFrame:
+    """
+    odds_store に max_age 秒以内の取得分があるレースはそれを使い、無いレースだけ全券種をまとめて取り直す。
+    取り直した分は odds_store に追記する(もう一方のランカーやバックテストもそれを使える)。
+    odds_poller を動かしていれば、発走直前でも最新のオッズがそのまま使われる。
+    """
+    store = store or OddsStore()
+    race_ids = [str(r) for r in race_ids]
+
+    fresh = store.latest(race_ids, max_age=max_age)
+    have = set(fresh.loc[fresh["bet_type"] == bet_type, "race_id"])
+    missing = [r for r in race_ids if r not in have]
+    if not missing:
+        return fresh
+
+    new = snapshot(missing, **kwargs)
+    store.append(new)
+    fresh = fresh[~fresh["race_id"].isin(missing)]
+    return pd.concat([fresh, new], ignore_index=True)
+
+
+def to_wide(df: pd.DataFrame, bet_type: str, race_id=None) -> pd.DataFrame:
+    """
+    縦長テーブルから1券種分を取り出し、ランカーが使う形にする。
+      3rentan : first, second, third, odds
+      2shahuku: a, b, odds
+    race_id を渡すとそのレースだけにする。
+    """
+    names = {"3rentan": ["first", "second", "third"], "2shahuku": ["a", "b"]}[bet_type]
+    mask = df["bet_type"] == bet_type
+    if race_id is not None:
+        mask &= df["race_id"] == str(race_id)
+    sub = df.loc[mask]
+
+    out = sub["combination"].str.split("-", expand=True)
+    if out.empty:
+        return pd.DataFrame(columns=names + ["odds"])
+    out.columns = names
+    out = out.astype(int)
+    out["odds"] = sub["odds"].astype(float).values
+    if race_id is None:
+        out.insert(0, "race_id", sub["race_id"].values)
+    return out.reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    race_info = pd.read_pickle("today_race_info2.pkl")
+    race_ids = race_info["race_id"].astype(str).unique().tolist()
+    store = OddsStore()
+    df = snapshot(race_ids)
+    store.append(df)
+    print(f"[OK] {len(race_ids)} レース / {len(df)} 行 -> {store.root}")
+    print(df.groupby("bet_type").size())
@@ -0,0 +1,147 @@
+"""
+odds_store.py
+--------------
+オッズの時系列を貯める追記専用の保存先。odds_snapshot の縦長テーブル
+(race_id, bet_type, combination, odds, fetched_at) をそのまま積んでいく。
+
+  root/
+    {yyyymmdd}/{取得時刻}_{pid}.pkl   : 1回の取得分(レース開催日ごとに分ける)
+    {yyyymmdd}/index.pkl             : その日の索引。取得ファイルごとの (race_id, bet_type, fetched_at)
+
+書き込みは取得1回ごとに新しいファイルを作るだけで、既存ファイルは書き換えない
+(「一時ファイル -> 置き換え」なので、途中で落ちても壊れたファイルは残らない)。
+読み出しは (race_id, fetched_at) の MultiIndex で返すので、
+「発走何分前のオッズ」「オッズの推移」をスクレイピングし直さずに引ける。
+
+odds_poller は発走前には1分ごとに取得するので、1日で数百ファイルになる。latest()(予想サーバーの /ev から毎回呼ばれる)
+は索引で (race_id, bet_type) ごとの最新の取得分を探し、そのファイルだけを読む。索引は取得ファイルから作り直せる
+控えで、索引に無いファイル(別のプロセスの書き込みと重なった分など)は読むときに足す。
+
+ファイル形式は他の工程と同じ pickle。
+"""
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from race_id_index import kaisai_date
+
+DEFAULT_ROOT = os.path.join("data", "odds_ts")
+COLUMNS = ["race_id", "bet_type", "combination", "odds", "fetched_at"]
+INDEX = ["race_id", "fetched_at"]
+INDEX_FILE = "index.pkl"
+SNAPSHOT_KEYS = ["race_id", "bet_type", "fetched_at"]
+
+
+def race_day_of(race_id):
+    return kaisai_date(str(race_id)[:12]).strftime("%Y%m%d")
+
+
+class OddsStore:
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+
+    def append(self, df):
+        """縦長オッズテーブルを開催日ごとに1ファイルずつ追記する。"""
+        if df is None or df.empty:
+            return
+        stamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        for day, part in df.groupby(df["race_id"].map(race_day_of)):
+            day_dir = os.path.join(self.root, day)
+            os.makedirs(day_dir, exist_ok=True)
+            path = os.path.join(day_dir, f"{stamp}_{os.getpid()}.pkl")
+            tmp = path + ".tmp"
+            part[COLUMNS].reset_index(drop=True).to_pickle(tmp)
+            os.replace(tmp, path)
+            self.index(day)
+
+    def days(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
+
+    def _snapshot_files(self, day):
+        day_dir = os.path.join(self.root, day)
+        if not os.path.isdir(day_dir):
+            return []
+        return sorted(f for f in os.listdir(day_dir) if f.endswith(".pkl") and f != INDEX_FILE)
+
+    def index(self, day):
+        """
+        day の索引(取得ファイル file ごとの race_id, bet_type, fetched_at)。
+        索引に無い取得ファイルがあれば、そのファイルだけ読んで索引に足して書き直す。
+        """
+        path = os.path.join(self.root, day, INDEX_FILE)
+        idx = pd.read_pickle(path) if os.path.exists(path) else pd.DataFrame(columns=SNAPSHOT_KEYS + ["file"])
+        files = self._snapshot_files(day)
+        missing = sorted(set(files) - set(idx["file"]))
+        if missing:
+            parts = [idx] if len(idx) else []
+            for f in missing:
+                snap = pd.read_pickle(os.path.join(self.root, day, f))
+                parts.append(snap[SNAPSHOT_KEYS].drop_duplicates().assign(file=f))
+            idx = pd.concat(parts, ignore_index=True)
+            idx = idx[idx["file"].isin(files)].reset_index(drop=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            idx.to_pickle(tmp)
+            os.replace(tmp, path)
+        return idx
+
+    def load(self, days=None, race_ids=None):
+        """
+        保存済みオッズを (race_id, fetched_at) の MultiIndex で返す。
+        race_ids を渡すとその開催日のファイルだけ読む。
+        """
+        if race_ids is not None:
+            race_ids = {str(r) for r in race_ids}
+            days = sorted({race_day_of(r) for r in race_ids})
+        elif days is None:
+            days = self.days()
+
+        frames = [pd.read_pickle(os.path.join(self.root, day, f)) for day in days for f in self._snapshot_files(day)]
+        return self._frame(frames, race_ids)
+
+    @staticmethod
+    def _frame(frames, race_ids=None):
+        if not frames:
+            return pd.DataFrame(columns=COLUMNS).set_index(INDEX)
+
+        df = pd.concat(frames, ignore_index=True)
+        if race_ids is not None:
+            df = df[df["race_id"].isin(race_ids)]
+        # キャッシュ内で同じページを2度保存した分(fetched_at が同じ)は1つにする
+        df = df.drop_duplicates(subset=["race_id", "bet_type", "combination", "fetched_at"])
+        return df.set_index(INDEX).sort_index()
+
+    def latest(self, race_ids, bet_types=None, as_of=None, max_age=None):
+        """
+        (race_id, bet_type) ごとに as_of 時点(省略時は現在)で最も新しい取得分を縦長形式で返す。
+        max_age(秒)を渡すと、それより古い取得分は含めない。読むのは、索引で見つけた最新の取得分のファイルだけ。
+        """
+        race_ids = {str(r) for r in race_ids}
+        as_of = as_of or datetime.now()
+
+        def in_range(df):
+            if bet_types is not None:
+                df = df[df["bet_type"].isin(bet_types)]
+            df = df[df["fetched_at"] <= as_of]
+            if max_age is not None:
+                df = df[df["fetched_at"] >= as_of - pd.Timedelta(seconds=max_age)]
+            return df
+
+        frames = []
+        for day in sorted({race_day_of(r) for r in race_ids}):
+            idx = in_range(self.index(day))
+            idx = idx[idx["race_id"].isin(race_ids)]
+            if idx.empty:
+                continue
+            newest = idx.groupby(["race_id", "bet_type"])["fetched_at"].transform("max")
+            for f in sorted(idx.loc[idx["fetched_at"] == newest, "file"].unique()):
+                frames.append(pd.read_pickle(os.path.join(self.root, day, f)))
+
+        df = in_range(self._frame(frames, race_ids).reset_index())
+        if df.empty:
+            return df[COLUMNS].reset_index(drop=True).astype({"odds": float, "fetched_at": "datetime64[ns]"})
+
+        newest = df.groupby(["race_id", "bet_type"])["fetched_at"].transform("max")
+        return df.loc[df["fetched_at"] == newest, COLUMNS].reset_index(drop=True)
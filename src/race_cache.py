@@ -0,0 +1,109 @@
+"""
+race_cache.py
+--------------
+当日分の処理(モデルのスコア → レース単位の集計 → EV)の結果を、race_id ごとに持っておく置き場。
+
+欠車やライン構成の訂正で出走表が変わると、これまでは当日の全レースを最初から計算し直していた。
+ここでは race_id ごとに入力(出走表の行・レース情報の行・オッズの行など)のハッシュを取り、
+前回と同じレースは前回の結果をそのまま使い、変わったレース(と新しく増えたレース)だけを計算し直す。
+
+  data/race_cache/{kind}.pkl
+    digests : {race_id: 入力のハッシュ}(並びは結果のレースの並び)
+    frames  : {名前: race_id 列を持つ DataFrame}(前回の結果。レースの中の行の並びはそのまま)
+
+ハッシュには、モデル・選手マスター・特徴量の版など全レース共通の入力(salt)も混ぜる。
+それらが変わると全レースが計算し直しになる。計算のしかたを変えたときは CACHE_VERSION を上げる。
+特徴量はここには持たない。入力ファイルと特徴量の版だけで決まる feature_builder.load_or_build のキャッシュから
+取るので、モデルだけを替えたときはスコアから先だけを計算し直す。
+"""
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+DEFAULT_DIR = os.path.join('data', 'race_cache')
+CACHE_VERSION = 2
+
+
+def file_salt(paths, *extra):
+    """paths の (サイズ, 更新時刻)(無いファイルは None)と extra をまとめた文字列。race_digests の salt に使う。"""
+    stamps = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stamps.append([st.st_size, st.st_mtime_ns])
+        except OSError:
+            stamps.append(None)
+    return json.dumps([CACHE_VERSION, stamps, list(extra)], default=str)
+
+
+def race_digests(frames, salt=''):
+    """
+    frames(race_id 列を持つ DataFrame の並び。出走表・レース情報など)から {race_id: 入力のハッシュ} を返す
+    (race_id の昇順)。列の名前と型・行の中身・行の並びのどれかが変われば別の値になる。
+    """
+    hashes = {}
+    for df in frames:
+        schema = '|'.join(f'{c}:{t}' for c, t in df.dtypes.items()).encode('utf-8')
+        rows = pd.util.hash_pandas_object(df, index=False)
+        for rid, sub in rows.groupby(df['race_id'].astype(str).to_numpy()):
+            h = hashes.setdefault(rid, hashlib.sha1(str(salt).encode('utf-8')))
+            h.update(schema)
+            h.update(sub.to_numpy().tobytes())
+    return {rid: hashes[rid].hexdigest() for rid in sorted(hashes)}
+
+
+class RaceCache:
+    """前回の結果をレースごとに持つ。changed() で計算し直すレースを聞き、update() で結果を合わせる。"""
+
+    def __init__(self, kind, cache_dir=DEFAULT_DIR):
+        self.path = os.path.join(cache_dir, f'{kind}.pkl')
+        self.digests, self.frames = {}, {}
+        if os.path.exists(self.path):
+            saved = pd.read_pickle(self.path)
+            self.digests, self.frames = saved['digests'], saved['frames']
+
+    def clear(self):
+        """前回の結果を使わない(次の update で全レース計算し直した結果だけになる)。"""
+        self.digests, self.frames = {}, {}
+
+    def changed(self, digests):
+        """digests のうち、入力が前回と違う(または前回無かった)レース(digests の並び)。"""
+        return [rid for rid, d in digests.items() if self.digests.get(rid) != d]
+
+    def update(self, digests, frames, retry=()):
+        """
+        changed(digests) のレースを計算し直した結果 frames({名前: DataFrame})と前回の結果を合わせ、
+        digests にあるレースの分だけを {名前: DataFrame} で返して保存する。
+        レースは digests の並び、レースの中の行は計算したときの並びになる。
+        retry のレース(エラーで仮の値にしたものなど)はハッシュを残さず、次回も changed に入れる。
+        """
+        changed = set(self.changed(digests))
+        order = {rid: i for i, rid in enumerate(digests)}
+        out = {}
+        for name in set(self.frames) | set(frames):
+            parts = []
+            old = self.frames.get(name)
+            if old is not None:
+                parts.append(old[~old['race_id'].astype(str).isin(changed)])
+            new = frames.get(name)
+            if new is not None and len(new.columns):
+                parts.append(new)
+            if not parts:
+                continue
+            df = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+            pos = df['race_id'].astype(str).map(order)
+            keep = pos.notna().to_numpy()
+            out[name] = df[keep].iloc[pos[keep].to_numpy().argsort(kind='stable')].reset_index(drop=True)
+        retry = {str(rid) for rid in retry}
+        self.digests = {rid: d for rid, d in digests.items() if rid not in retry}
+        self.frames = out
+        self.save()
+        return out
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = self.path + '.tmp'
+        pd.to_pickle({'digests': self.digests, 'frames': self.frames}, tmp)
+        os.replace(tmp, self.path)
@@ -0,0 +1,109 @@
+"""
+race_id_index.py
+-----------------
+1_race_id_scrape 用の「開催・レースID」索引(SQLite)。
+
+  series : 開催(初日の開催ID)ごとの開催日数
+  days   : 開催日ID(12桁)ごとのレース数と確定フラグ
+  months : 月ごとの確定フラグ
+
+前日以前の開催日はレース数が変わらないので complete=1 として保存し、次回からは取りに行かない。
+月末を過ぎて全開催日が確定した月は months.complete=1 になり、月間スケジュールも含めて
+一切アクセスせずに索引だけからレースIDを返せる。
+"""
+import sqlite3
+from datetime import datetime, timedelta
+
+DEFAULT_INDEX_PATH = "race_id_index.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    series_id  TEXT PRIMARY KEY,
+    n_days     INTEGER NOT NULL,
+    checked_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS days (
+    kaisai_id  TEXT PRIMARY KEY,
+    race_count INTEGER,
+    complete   INTEGER NOT NULL DEFAULT 0,
+    checked_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS months (
+    month      TEXT PRIMARY KEY,
+    complete   INTEGER NOT NULL DEFAULT 0,
+    checked_at TEXT NOT NULL
+);
+"""
+
+
+def kaisai_date(kaisai_id):
+    """開催日ID(場2桁 + 初日yyyymmdd + 日目2桁)から、その日の日付を求める。"""
+    first_day = datetime.strptime(kaisai_id[2:10], "%Y%m%d")
+    return first_day + timedelta(days=int(kaisai_id[10:12]) - 1)
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class RaceIdIndex:
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # ---------------- 月 ----------------
+    def month_complete(self, month):
+        row = self.conn.execute("SELECT complete FROM months WHERE month = ?", (month,)).fetchone()
+        return bool(row and row[0])
+
+    def set_month_complete(self, month):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO months (month, complete, checked_at) VALUES (?, 1, ?)",
+                (month, _now()),
+            )
+
+    # ---------------- 開催(シリーズ) ----------------
+    def series_days(self, series_id):
+        row = self.conn.execute("SELECT n_days FROM series WHERE series_id = ?", (series_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_series_days(self, series_id, n_days):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO series (series_id, n_days, checked_at) VALUES (?, ?, ?)",
+                (series_id, int(n_days), _now()),
+            )
+
+    # ---------------- 開催日 ----------------
+    def day(self, kaisai_id):
+        """(race_count, complete) を返す。未登録なら None。"""
+        row = self.conn.execute(
+            "SELECT race_count, complete FROM days WHERE kaisai_id = ?", (kaisai_id,)
+        ).fetchone()
+        return (row[0], bool(row[1])) if row else None
+
+    def set_day(self, kaisai_id, race_count, complete):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO days (kaisai_id, race_count, complete, checked_at) VALUES (?, ?, ?, ?)",
+                (kaisai_id, race_count, int(bool(complete)), _now()),
+            )
+
+    def days_in_range(self, first_day, last_day):
+        """日付が [first_day, last_day] に入る開催日IDを(索引に載っている分だけ)昇順で返す。"""
+        rows = self.conn.execute("SELECT kaisai_id FROM days ORDER BY kaisai_id").fetchall()
+        return [r[0] for r in rows if first_day <= kaisai_date(r[0]) <= last_day]
+
+    def race_ids(self, kaisai_ids):
+        """開催日IDのリストから、索引上のレース数ぶんのレースIDを作る。"""
+        out = []
+        for kaisai_id in kaisai_ids:
+            found = self.day(kaisai_id)
+            if not found or not found[0]:
+                continue
+            out.extend(kaisai_id + str(j).zfill(2) for j in range(1, found[0] + 1))
+        return out
@@ -0,0 +1,175 @@
+"""
+race_page_parser.py
+--------------------
+kdreams のレース結果ページ(race-card/result)を、lxml の木を1回だけ作って解析するモジュール。
+
+従来は1ページごとに BeautifulSoup(html.parser) と pd.read_html(ページ全体) で2回パースし、
+その後も soup.find を何度も呼んでいた。ここでは
+  - lxml.html で1回だけパースし、
+  - メタ情報(ライン並び・ヘッダ・競輪場・グレード・発走時刻・天候)は事前コンパイル済みの XPath で取り出し、
+  - 表は「出走表・結果・払戻」の3つだけを pd.read_html(flavor='lxml') に渡す
+(列名・型推論を従来と完全に同じにするため、表→DataFrame 変換だけは pandas に任せる)。
+
+extract_page() の戻り値は 2_race_data_scrape.parse_race_page がそのまま使う。
+
+ベンチマーク/突き合わせ(キャッシュ済みページを使う。ネットワークには出ない):
+    python src/race_page_parser.py --bench [--limit 200]
+"""
+import argparse
+import glob
+import gzip
+import importlib
+import os
+import time
+from io import StringIO
+
+import lxml.html
+import pandas as pd
+from lxml import etree
+
+_RE_NS = {"re": "http://exslt.org/regular-expressions"}
+
+
+def _has_class(tag, cls):
+    return f"//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')]"
+
+
+# pd.read_html(match='.+') と同じ条件で表を拾う(何か文字を含む table)
+_X_TABLES = etree.XPath("//table[.//text()[re:test(., '.+')]]", namespaces=_RE_NS)
+_X_HAS_ROW = etree.XPath("boolean(.//tr)")
+
+_X_LINE_POSITION = etree.XPath(f"({_has_class('div', 'line_position_inner')})[1]")
+_X_RACE_HEADER = etree.XPath(f"({_has_class('div', 'race_header')})[1]")
+_X_RACE_TITLE = etree.XPath(f"({_has_class('div', 'race_title_header')})[1]")
+_X_FIRST_SPAN = etree.XPath("(.//span)[1]")
+_X_VELODROME = etree.XPath(f"({_has_class('span', 'velodrome')})[1]")
+_X_RACE_NAME = etree.XPath(f"({_has_class('span', 'race')})[1]")
+_X_SECTION_TITLE = etree.XPath(f"({_has_class('h1', 'section_title')})[1]")
+_X_TIME_DD = etree.XPath(f"({_has_class('dl', 'time')})[1]//dd")
+_X_WEATHER = etree.XPath(f"({_has_class('p', 'weather_info')})[1]")
+_X_SPANS = etree.XPath(".//span")
+
+
+def _first(xpath, node):
+    found = xpath(node)
+    return found[0] if found else None
+
+
+def _text(node):
+    return None if node is None else node.text_content()
+
+
+def _is_hidden(table):
+    return "display:none" in table.attrib.get("style", "").replace(" ", "")
+
+
+def _table_to_frame(table):
+    """table 要素1つ分を、pd.read_html と同じ規則で DataFrame にする。"""
+    html = lxml.html.tostring(table, encoding="unicode")
+    return pd.read_html(StringIO(html), flavor="lxml")[0]
+
+
+def _select_tables(root):
+    """
+    pd.read_html(ページ全体) が返す表の並びを再現し、従来と同じ位置の3表だけを変換する。
+    (表が8個なら 0/6/7 番目、それ以外は 0/3/4 番目)
+    """
+    tables = [t for t in _X_TABLES(root) if not _is_hidden(t) and _X_HAS_ROW(t)]
+    if len(tables) == 8:
+        picked = (tables[0], tables[6], tables[7])
+    else:
+        picked = (tables[0], tables[3], tables[4])
+    return tuple(_table_to_frame(t) for t in picked)
+
+
+def extract_page(html_text):
+    """
+    レース結果ページから解析に必要な素材を取り出す。
+    見つからない要素は None(従来の soup.find が None を返していた箇所に対応)。
+    """
+    root = lxml.html.fromstring(html_text)
+
+    try:
+        tables = _select_tables(root)
+    except (IndexError, ValueError):
+        tables = None
+
+    header_div = _first(_X_RACE_HEADER, root)
+    title_div = _first(_X_RACE_TITLE, root)
+    weather_p = _first(_X_WEATHER, root)
+    time_dds = _X_TIME_DD(root)
+
+    return {
+        "tables": tables,
+        "line_text": _text(_first(_X_LINE_POSITION, root)),
+        "has_header": header_div is not None,
+        "header_text": _text(_first(_X_FIRST_SPAN, header_div)) if header_div is not None else None,
+        "has_title": title_div is not None,
+        "title_text": _text(_first(_X_FIRST_SPAN, title_div)) if title_div is not None else None,
+        "stadium": _text(_first(_X_VELODROME, root)),
+        "race_name": _text(_first(_X_RACE_NAME, root)),
+        "grade_text": _text(_first(_X_SECTION_TITLE, root)),
+        "start_time": time_dds[0].text_content() if time_dds else None,
+        "weather_spans": [s.text_content() for s in _X_SPANS(weather_p)] if weather_p is not None else None,
+    }
+
+
+def _cached_result_pages(limit):
+    kdreams_http = importlib.import_module("kdreams_http")
+    paths = sorted(glob.glob(os.path.join(kdreams_http.CACHE_DIR, "*", "*.gz")))
+    pages = []
+    for path in paths:
+        with gzip.open(path, "rb") as f:
+            text = f.read().decode("utf-8", errors="replace")
+        if "line_position_inner" in text:
+            pages.append(text)
+        if len(pages) >= limit:
+            break
+    return pages
+
+
+def _same(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    info_a, card_a, harai_a = a
+    info_b, card_b, harai_b = b
+    return info_a == info_b and card_a.equals(card_b) and harai_a.equals(harai_b)
+
+
+def bench(limit=200):
+    """キャッシュ済みページで 従来(BeautifulSoup+read_html) と lxml 1パース版 を比較する。"""
+    scraper = importlib.import_module("2_race_data_scrape")
+    pages = _cached_result_pages(limit)
+    if not pages:
+        print("キャッシュ済みのレース結果ページがありません。先に一度スクレイピングを実行してください。")
+        return
+
+    t0 = time.perf_counter()
+    old = [scraper.extract_page_bs4(p) for p in pages]
+    t1 = time.perf_counter()
+    new = [extract_page(p) for p in pages]
+    t2 = time.perf_counter()
+
+    old_ms = (t1 - t0) / len(pages) * 1000
+    new_ms = (t2 - t1) / len(pages) * 1000
+    print(f"ページ数: {len(pages)}")
+    print(f"従来(bs4+read_html): {old_ms:.1f} ms/ページ")
+    print(f"lxml 1パース     : {new_ms:.1f} ms/ページ  (x{old_ms / new_ms:.1f})")
+
+    mismatch = 0
+    for i, page in enumerate(pages):
+        race_id = f"page{i:05d}"
+        a = scraper.parse_race_page(race_id, page, extract=scraper.extract_page_bs4)
+        b = scraper.parse_race_page(race_id, page, extract=extract_page)
+        if not _same(a, b):
+            mismatch += 1
+    print(f"解析結果の不一致: {mismatch} / {len(pages)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", action="store_true")
+    parser.add_argument("--limit", type=int, default=200)
+    args = parser.parse_args()
+    if args.bench:
+        bench(args.limit)
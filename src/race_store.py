@@ -0,0 +1,148 @@
+"""
+race_store.py
+--------------
+長時間のスクレイピング結果を、開催日ごとにディスクへ書き出していく保存先。
+
+  root/
+    manifest.txt             : 保存済み race_id を1行ずつ追記する進捗ファイル
+    info/{開催日ID}.pkl       : レース情報(開催日ID = race_id の末尾2桁を除いた12桁)
+    card/{開催日ID}.pkl       : 出走表
+    return/{開催日ID}.pkl     : 払戻
+
+レースは並列取得の終わった順(開催日の順とは限らない)に届くので、append は開催日ごとにメモリへためておき、
+expect で渡した その開催日のレースが全部そろった(解析できなかったレースは skip)ところで1回だけ書き出す。
+レースが届くたびにパーティションを書き直すと、1開催日ぶんでレース数の2乗の書き込みになるため。
+まだそろっていない開催日は flush() / close() で書き出す。
+
+書き込みは「一時ファイル -> 置き換え」の後に manifest へ追記する順番なので、途中で落ちても
+manifest にある race_id は必ずパーティションに入っている(書き出す前のレースは manifest にも無いので、
+再実行で取り直す)。再実行時は manifest にある race_id を飛ばす。
+
+ファイル形式は他の工程と同じ pickle。
+"""
+import os
+
+import pandas as pd
+
+TABLES = ("info", "card", "return")
+
+
+def kaisai_day_of(race_id):
+    return str(race_id)[:-2]
+
+
+class RaceStore:
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, "manifest.txt")
+        for name in TABLES:
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+        self._done = self._read_manifest()
+        # まだ書き出していないレース {開催日: {race_id: {テーブル名: DataFrame}}} と、開催日ごとの残りレース数
+        self._buffers = {}
+        self._waiting = {}
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return set()
+        with open(self.manifest_path, encoding="utf-8") as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def _partition_path(self, name, day):
+        return os.path.join(self.root, name, f"{day}.pkl")
+
+    def _load_partition(self, name, day):
+        path = self._partition_path(name, day)
+        if os.path.exists(path):
+            return pd.read_pickle(path)
+        return None
+
+    def _write_partition(self, name, day, df):
+        path = self._partition_path(name, day)
+        tmp = path + ".tmp"
+        df.to_pickle(tmp)
+        os.replace(tmp, path)
+
+    def is_done(self, race_id):
+        return str(race_id) in self._done
+
+    def pending(self, race_ids):
+        """まだ保存されていない race_id だけを元の順番で返す。"""
+        return [r for r in race_ids if str(r) not in self._done]
+
+    def expect(self, race_ids):
+        """これから append / skip する race_id を知らせる。開催日ごとに、全部届いた時点で書き出す。"""
+        for race_id in race_ids:
+            day = kaisai_day_of(race_id)
+            self._waiting[day] = self._waiting.get(day, 0) + 1
+
+    def append(self, race_id, info, card, harai):
+        """1レース分(レース情報dict, 出走表, 払戻)を開催日ごとにためる(書き出しは開催日がそろったとき)。"""
+        race_id = str(race_id)
+        self._buffers.setdefault(kaisai_day_of(race_id), {})[race_id] = {
+            "info": pd.DataFrame({race_id: info}).T,
+            "card": card,
+            "return": harai,
+        }
+        self._arrived(race_id)
+
+    def skip(self, race_id):
+        """expect したが保存しない(解析できなかった)レース。開催日の残りの数だけ減らす。"""
+        self._arrived(str(race_id))
+
+    def _arrived(self, race_id):
+        day = kaisai_day_of(race_id)
+        if day not in self._waiting:
+            return
+        self._waiting[day] -= 1
+        if self._waiting[day] <= 0:
+            del self._waiting[day]
+            self.flush(day)
+
+    def flush(self, day=None):
+        """ためているレースを開催日パーティションに書き出す(day を省略するとすべての開催日)。"""
+        for day in ([day] if day is not None else list(self._buffers)):
+            races = self._buffers.pop(day, None)
+            if not races:
+                continue
+            for name in TABLES:
+                df = pd.concat([frames[name] for frames in races.values()])
+                old = self._load_partition(name, day)
+                if old is not None:
+                    # manifest 追記前に落ちた場合の再実行でも同じレースが二重に入らないようにする
+                    df = pd.concat([old[~old.index.isin(list(races))], df])
+                self._write_partition(name, day, df)
+
+            with open(self.manifest_path, "a", encoding="utf-8") as f:
+                f.write("".join(race_id + "\n" for race_id in races))
+                f.flush()
+                os.fsync(f.fileno())
+            self._done.update(races)
+
+    def close(self):
+        """まだ書き出していないレースを全部書き出す。"""
+        self.flush()
+
+    def load(self, race_ids=None):
+        """
+        保存済みデータを (info_table, entry_table, return_table) で返す。
+        race_ids を渡すとその開催日のパーティションだけ読み、その race_id に絞って元の順番に並べる。
+        """
+        if race_ids is None:
+            days = sorted(f[:-4] for f in os.listdir(os.path.join(self.root, "info")) if f.endswith(".pkl"))
+        else:
+            race_ids = [str(r) for r in race_ids]
+            days = list(dict.fromkeys(kaisai_day_of(r) for r in race_ids))
+
+        out = []
+        for name in TABLES:
+            frames = [df for df in (self._load_partition(name, day) for day in days) if df is not None]
+            df = pd.concat(frames) if frames else pd.DataFrame()
+            if race_ids is not None and not df.empty:
+                order = {r: i for i, r in enumerate(race_ids)}
+                df = df[df.index.isin(order)]
+                # 同じ race_id の行の並びは崩さずに、race_id の順に並べ直す
+                pos = df.index.map(order)
+                df = df.iloc[pd.Series(pos).argsort(kind="stable").values]
+            out.append(df)
+        return tuple(out)
@@ -0,0 +1,136 @@
+"""
+race_summary.py
+----------------
+選手単位の予測(prediction_score_top3 / prediction_score_1st)を、レース単位の集計
+(買い目・A率〜I率・CT値・スコア)にまとめる。t_race.generate_race_summary と analyze_prediction の共通部分。
+
+これまではレースごとに groupby で回し、レースの中で2回並べ替えてから1行ずつ文字列や率を作っていたので、
+過去1年分(数万レース)を集計し直すと数分かかっていた。ここでは
+
+  - 全レースの選手を (レース, 順位) の表に1回で並べ、スコアの順は表の行ごとにまとめて並べ替える
+  - A率〜I率はその表の列、CT値・スコアは列どうしの配列計算
+  - 買い目の文字列は順位の列ごとにまとめてつなぐ
+
+の順で、レースの数によらずほぼ配列の演算だけで済ませる。
+結果は元の1レースずつの計算と同じ(丸めは Python の round、平均は上位から順に足した和で取る)。
+ただし同じスコアの選手の順は、元の並び(出走表の順)で決める。元の sort_values は既定の quicksort で、
+同点の順が numpy の版や CPU によって変わっていた。
+"""
+import numpy as np
+import pandas as pd
+
+RATE_LABELS = ['A率', 'B率', 'C率', 'D率', 'E率', 'F率', 'G率', 'H率', 'I率']
+TICKET_COLUMNS = ['2車単', '3連単_1着', '1着_補欠', '3連単_3着以内', '3着以内_補欠']
+
+
+def py_round(values, digits=2):
+    """配列を Python の round(x, digits) と同じ値に丸める(np.round は x*10**digits の誤差で .5 付近がずれることがある)。"""
+    values = np.asarray(values, dtype=float)
+    out = np.round(values, digits)
+    scaled = values * 10 ** digits
+    near = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near.any():
+        out[near] = [round(v, digits) for v in values[near].tolist()]
+    return out
+
+
+def race_rows(codes, n_groups, width):
+    """codes(レースの番号 0..n_groups-1)ごとの行番号の表 (n_groups, width)。レースの中は元の並び、空きは -1。"""
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    pos = np.arange(len(order)) - np.searchsorted(sorted_codes, sorted_codes)
+    rows = np.full((n_groups, width), -1, dtype=np.int64)
+    rows[sorted_codes, pos] = order
+    return rows
+
+
+def rank_rows(rows, values):
+    """
+    race_rows の表を、レースごとに values の大きい順に並べ替えたもの。
+    並びは sort_values(ascending=False, kind='stable') と同じ(NaN は最後、同じ値は元の行の並び)。
+    """
+    keys = np.append(-np.asarray(values, dtype=float), np.nan)[rows]
+    return np.take_along_axis(rows, np.argsort(keys, axis=1, kind='stable'), axis=1)
+
+
+def _tickets(cars, n, ok):
+    """
+    cars(順位順の車番の文字列の表)から (2車単, 3連単, 補欠) の文字列の配列を作る。
+    ok でないレース(3車未満・車番が数値にならない)は "N/A"。
+    """
+    first3 = '="' + cars[:, 0] + '-' + cars[:, 1] + '-' + cars[:, 2] + '"'
+    nirentan = '="' + cars[:, 0] + '-' + cars[:, 1] + '"'
+
+    rest = np.full(len(cars), '', dtype=object)
+    for j in range(3, cars.shape[1]):
+        joined = cars[:, j] if j == 3 else rest + '-' + cars[:, j]
+        rest = np.where(j < n, joined, rest)
+    hoketsu = np.where(n > 3, '="' + rest + '"', '')
+
+    na = np.array('N/A', dtype=object)
+    return (np.where(ok, nirentan, na), np.where(ok, first3, na), np.where(ok, hoketsu, na))
+
+
+def summarize_races(df, by, rate_col, first_cols=()):
+    """
+    選手単位の df を by のレースごとに1行にまとめる(by の昇順)。
+      - 2車単・3連単_1着・1着_補欠     : prediction_score_1st の大きい順の車番
+      - 3連単_3着以内・3着以内_補欠    : prediction_score_top3 の大きい順の車番
+      - A率〜I率・CT値・スコア          : rate_col の大きい順の値(選手がいない順位の率は "")
+    first_cols はレースの先頭行の値をそのまま付ける。列は by + first_cols + 上の並び + 選手数。
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    first_cols = [c for c in first_cols if c not in by]
+    scores = list(dict.fromkeys(['prediction_score_1st', 'prediction_score_top3', rate_col]))
+    df = df[list(dict.fromkeys(by + first_cols + ['車_番'] + scores))]  # 使う列だけにしてから絞る
+    codes = df.groupby(by, sort=True).ngroup().to_numpy()
+    keep = codes >= 0
+    if not keep.all():
+        df, codes = df[keep], codes[keep]
+    n_groups = int(codes.max()) + 1 if len(codes) else 0
+    n = np.bincount(codes, minlength=n_groups)
+    width = max(int(n.max()) if n_groups else 0, len(RATE_LABELS))
+
+    # レースの先頭行(元の並び)の値
+    first = np.unique(codes, return_index=True)[1]
+    out = df.iloc[first][by + first_cols].reset_index(drop=True)
+
+    # 車番は整数にして文字列に(数値にならない車番があるレースは買い目を "N/A" にする)
+    car_num = pd.to_numeric(df['車_番'], errors='coerce').to_numpy(dtype=float)
+    ok = (n >= 3) & (np.bincount(codes, weights=np.isnan(car_num), minlength=n_groups) == 0)
+    car_str = np.append(np.nan_to_num(car_num).astype(np.int64).astype(str).astype(object), '')
+
+    rows = race_rows(codes, n_groups, width)
+    ranked_1st = rank_rows(rows, df['prediction_score_1st'])
+    ranked_top3 = rank_rows(rows, df['prediction_score_top3'])
+    nirentan, sanrentan_1st, hoketsu_1st = _tickets(car_str[ranked_1st], n, ok)
+    _, sanrentan_top3, hoketsu_top3 = _tickets(car_str[ranked_top3], n, ok)
+    for col, values in zip(TICKET_COLUMNS, [nirentan, sanrentan_1st, hoketsu_1st, sanrentan_top3, hoketsu_top3]):
+        out[col] = values
+
+    # --- A率〜I率 ---
+    ranked = {'prediction_score_1st': ranked_1st, 'prediction_score_top3': ranked_top3}.get(rate_col)
+    if ranked is None:
+        ranked = rank_rows(rows, df[rate_col])
+    score = np.append(df[rate_col].to_numpy(dtype=float), np.nan)[ranked]
+    for i, label in enumerate(RATE_LABELS):
+        rate = py_round(score[:, i])
+        present = i < n
+        out[label] = rate if present.all() else np.where(present, rate.astype(object), '')
+
+    # --- CT値・スコア(上位の率から順に足した平均を使う) ---
+    a_rate = score[:, 0]
+    d_rate = np.where(n > 3, score[:, 3], score[np.arange(n_groups), np.maximum(n - 1, 0)])
+    total = np.zeros(n_groups)
+    for j in range(width):
+        total = np.where(j < n, total + score[:, j], total)
+    avg = total / np.maximum(n, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ct_value = np.where(a_rate > 0, (a_rate - d_rate) / a_rate, 0.0)
+        ct_value2 = np.where(avg > 0, (a_rate - avg) / a_rate, 0.0)
+    score_value = (a_rate * 50) + (ct_value * 25) + (ct_value2 * 25)
+
+    out['CT値'] = py_round(ct_value)
+    out['スコア'] = py_round(score_value)
+    out['選手数'] = n
+    return out
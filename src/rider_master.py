@@ -0,0 +1,144 @@
+"""
+rider_master.py
+----------------
+予想時に、当日の出走者(1日 ~1,000人)の通算成績だけを引くための選手マスター。
+
+従来の 9_new_player.py は累積済みの全期間ファイルを読み、groupby('選手名').tail(1) で
+player_cumulative_master.pkl を作っていた。当日の出走表とは選手名で merge していたので、
+同姓同名の選手が混ざるうえ、マスターを作るたびに全期間を読み直す必要があった。
+
+ここでは rider_stats の state(選手ごとの最新の通算成績)から、rider_id(選手名_期別)の昇順に並べた
+列ごとの .npy を書き出す。読むときは np.load(mmap_mode='r') で開くだけなので、ファイル全体は読み込まない。
+
+  root/
+    rider_id.npy    : rider_id(固定長の文字列, 昇順)
+    counts.npy      : int32 (選手数, 4) 出走数 / 1着数 / 2連対数 / 3連対数
+    last_date.npy   : datetime64[D] 最終出走日
+    as_of.txt       : マスターを作った時点の取り込み済み最終開催日
+
+引くときは rider_id を np.searchsorted で二分探索する(出走者1人あたり数回の比較で済む)。
+同じプロセスの中では、ファイルが変わらない限り開いたマスターを使い回す(open_master)。
+
+    python src/rider_master.py [--store rider_stats] [--root rider_master]
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from rider_stats import COUNT_COLS, DEFAULT_ROOT as STORE_ROOT, FEATURE_COLS, RiderStatsStore
+from rider_stats import race_dates, race_ids_of, rates, rider_ids
+
+DEFAULT_ROOT = 'rider_master'
+MASTER_FILES = ['rider_id.npy', 'counts.npy', 'last_date.npy', 'as_of.txt']
+
+
+def master_paths(root=DEFAULT_ROOT):
+    """マスターを構成するファイルのパス(特徴量キャッシュのキーに使う)。"""
+    return [os.path.join(root, name) for name in MASTER_FILES]
+
+
+def build_master(state, root=DEFAULT_ROOT):
+    """rider_stats の state から選手マスターを書き出し、選手数を返す。"""
+    os.makedirs(root, exist_ok=True)
+    state = state.sort_index()
+    ids = state.index.to_numpy(dtype=str)
+    arrays = {
+        'rider_id': ids.astype(f'U{max(1, max((len(i) for i in ids), default=1))}'),
+        'counts': state[COUNT_COLS].to_numpy(dtype=np.int32).reshape(-1, len(COUNT_COLS)),
+        'last_date': pd.to_datetime(state['最終出走日']).to_numpy(dtype='datetime64[D]'),
+    }
+    for name, arr in arrays.items():
+        # 読み手が開いている途中のファイルを壊さないよう、別名で書いてから置き換える
+        tmp = os.path.join(root, f'{name}.tmp.npy')
+        np.save(tmp, arr)
+        os.replace(tmp, os.path.join(root, f'{name}.npy'))
+    as_of = '' if state.empty else f"{state['最終出走日'].max():%Y-%m-%d}"
+    with open(os.path.join(root, 'as_of.txt'), 'w', encoding='utf-8') as f:
+        f.write(as_of + '\n')
+    return len(ids)
+
+
+class RiderMaster:
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+        ids_path, counts_path, last_date_path, as_of_path = master_paths(root)
+        self.ids = np.load(ids_path, mmap_mode='r')
+        self.counts = np.load(counts_path, mmap_mode='r')
+        self.last_date = np.load(last_date_path, mmap_mode='r')
+        with open(as_of_path, encoding='utf-8') as f:
+            text = f.read().strip()
+        self.as_of = pd.Timestamp(text) if text else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, ids):
+        """rider_id の並びに対する行番号(マスターに無い選手は -1)。"""
+        ids = np.asarray(ids, dtype=str)
+        if len(self.ids) == 0:
+            return np.full(len(ids), -1)
+        pos = np.searchsorted(self.ids, ids)
+        pos = np.minimum(pos, len(self.ids) - 1)
+        return np.where(self.ids[pos] == ids, pos, -1)
+
+    def lookup(self, ids):
+        """ids の順に通算成績(出走数..3連対数)を返す。マスターに無い選手(新人など)は0。"""
+        pos = self.positions(ids)
+        found = pos >= 0
+        out = np.zeros((len(pos), len(COUNT_COLS)), dtype=np.int32)
+        out[found] = self.counts[pos[found]]
+        return pd.DataFrame(out, columns=COUNT_COLS, index=pd.Index(ids, name='rider_id'))
+
+    def features(self, card):
+        """
+        出走表の各行に 累計勝率 / 累計2連対率 / 累計3連対率 / 累計出走数 を付けて返す(index は card と同じ)。
+        マスターの最終開催日以前のレースがあると、その日の結果まで含んだ値になるので警告を出す。
+        """
+        if self.as_of is not None and 'race_id' in card.columns and len(card):
+            first = pd.Timestamp(race_dates(race_ids_of(card)).min())
+            if first <= self.as_of:
+                print(f'[WARN] 選手マスターは {self.as_of:%Y-%m-%d} までの結果を含みます'
+                      f'({first:%Y-%m-%d} のレースには当日以降の結果が混ざります)')
+        counts = self.lookup(rider_ids(card).to_numpy())
+        counts.index = card.index
+        return rates(counts)
+
+
+_OPENED = {}
+
+
+def open_master(root=DEFAULT_ROOT):
+    """
+    root の選手マスターを開く。同じプロセスで開いたことがあり、ファイルが変わっていなければそれを使い回す
+    (predict_server.py のように常駐するプロセスで、マスターを作り直したときだけ開き直すため)。
+    マスターが無ければ、作り方を添えて FileNotFoundError を送出する。
+    """
+    missing = [path for path in master_paths(root) if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(
+            f'選手マスターがありません: {", ".join(missing)}\n'
+            f'先に python src/9_new_player.py を実行して {root}/ を作ってください。')
+    stamp = [(st.st_size, st.st_mtime_ns) for st in map(os.stat, master_paths(root))]
+    key = os.path.abspath(root)
+    opened = _OPENED.get(key)
+    if opened is None or opened[0] != stamp:
+        opened = _OPENED[key] = (stamp, RiderMaster(root))
+    return opened[1]
+
+
+def attach_features(card, root=DEFAULT_ROOT):
+    """card の累計特徴量を選手マスターの値で付け直したものを返す。"""
+    card = card.drop(columns=[c for c in FEATURE_COLS if c in card.columns])
+    return pd.concat([card, open_master(root).features(card)], axis=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', default=STORE_ROOT)
+    parser.add_argument('--root', default=DEFAULT_ROOT)
+    args = parser.parse_args()
+
+    n = build_master(RiderStatsStore(args.store).state(), args.root)
+    print(f'選手マスターを作成しました: {n} 人 -> {args.root}/')
@@ -0,0 +1,232 @@
+"""
+rider_stats.py
+---------------
+選手ごとの通算成績(出走数・1着数・2連対数・3連対数)を日付つきで持ち続ける保存先。
+
+  root/
+    manifest.txt          : 取り込み済み race_id を1行ずつ追記する進捗ファイル
+    state.pkl             : 選手ごとの最新の通算成績と最終出走日(index = rider_id)
+    history/{yyyymm}.pkl  : (rider_id, 日付) ごとの「その日を含めた」通算成績。出走した日だけ行がある
+
+選手は rider_id = 選手名 + '_' + 期別(例: '山田 太郎_113')で区別する。名前だけだと同姓同名の選手が
+同じ成績にまとめられてしまうため。
+
+fold() は manifest に無いレースだけを日付順に足し込み、その月のパーティションと state だけを書き直す。
+毎日の結果を足すのは数百行の計算で済み、5年分を最初から数え直す必要はない。
+
+日付はレースIDから求めた開催日。as-of の値は「その日より前」の成績だけを使う(当日分は含めない)ので、
+学習データに付けても先の結果が混ざらない。
+  asof(ids, date)   : 指定日時点の成績(最新なら state から、過去日なら history から)
+  features(card)    : 出走表の各行に、そのレース日時点の 累計出走数 / 累計勝率 / 累計2連対率 / 累計3連対率
+
+ファイル形式は他の工程と同じ pickle。予想時に当日の出走者だけを引くための索引は rider_master.py。
+"""
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from race_id_index import kaisai_date
+
+KEY = 'rider_id'
+COUNT_COLS = ['出走数', '1着数', '2連対数', '3連対数']
+FEATURE_COLS = ['累計勝率', '累計2連対率', '累計3連対率', '累計出走数']
+DEFAULT_ROOT = 'rider_stats'
+
+
+def race_ids_of(card):
+    """出走表の race_id(列があればそれ、無ければ index)を文字列で返す。"""
+    ids = card['race_id'] if 'race_id' in card.columns else pd.Series(card.index, index=card.index)
+    return ids.astype(str)
+
+
+def rider_ids(card):
+    """出走表の 選手名 と 期別 から rider_id('山田 太郎_113')の Series を作る(index は card と同じ)。"""
+    name = card['選手名'].astype(str).str.strip()
+    kibetsu = pd.to_numeric(card['期別'], errors='coerce').astype('Int64').astype(str)
+    return name + '_' + kibetsu
+
+
+def race_dates(race_ids):
+    """race_id の並びから開催日(datetime64)の配列を作る(開催日IDごとに1回だけ計算する)。"""
+    kaisai = pd.Series(race_ids).astype(str).str[:12]
+    uniq = kaisai.unique()
+    dates = pd.Series(pd.to_datetime([kaisai_date(k) for k in uniq]), index=uniq)
+    return kaisai.map(dates).to_numpy()
+
+
+def daily_counts(card):
+    """出走表(着順つき)を (rider_id, 日付) ごとの出走数・1着数・2連対数・3連対数 にまとめる。"""
+    rank = pd.to_numeric(card['着 順'], errors='coerce')
+    df = pd.DataFrame({
+        KEY: rider_ids(card).to_numpy(),
+        '日付': race_dates(race_ids_of(card)),
+        '出走数': 1,
+        '1着数': (rank == 1).astype(int).to_numpy(),
+        '2連対数': (rank <= 2).astype(int).to_numpy(),
+        '3連対数': (rank <= 3).astype(int).to_numpy(),
+    })
+    return df.groupby([KEY, '日付'], sort=True)[COUNT_COLS].sum().reset_index()
+
+
+def rates(counts):
+    """通算成績から 累計出走数 / 累計勝率 / 累計2連対率 / 累計3連対率 を作る(出走0なら率は0)。"""
+    n = counts['出走数'].astype(float)
+    denom = n.where(n > 0)
+    return pd.DataFrame({
+        '累計勝率': (counts['1着数'] / denom).fillna(0.0),
+        '累計2連対率': (counts['2連対数'] / denom).fillna(0.0),
+        '累計3連対率': (counts['3連対数'] / denom).fillna(0.0),
+        '累計出走数': n,
+    }, index=counts.index)[FEATURE_COLS]
+
+
+class RiderStatsStore:
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+        self.manifest_path = os.path.join(root, 'manifest.txt')
+        self.state_path = os.path.join(root, 'state.pkl')
+        self.history_dir = os.path.join(root, 'history')
+        os.makedirs(self.history_dir, exist_ok=True)
+        self._done = self._read_manifest()
+        self._state = None
+
+    # ---------------- 読み書き ----------------
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return set()
+        with open(self.manifest_path, encoding='utf-8') as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def _write(self, df, path):
+        tmp = path + '.tmp'
+        df.to_pickle(tmp)
+        os.replace(tmp, path)
+
+    def _partition_path(self, month):
+        return os.path.join(self.history_dir, f'{month}.pkl')
+
+    def months(self):
+        return sorted(f[:-4] for f in os.listdir(self.history_dir) if f.endswith('.pkl'))
+
+    def state(self):
+        """選手ごとの最新の通算成績(index = rider_id, 列 = 出走数..3連対数, 最終出走日)。"""
+        if self._state is None:
+            if os.path.exists(self.state_path):
+                self._state = pd.read_pickle(self.state_path)
+            else:
+                self._state = pd.DataFrame(columns=COUNT_COLS + ['最終出走日']).rename_axis(KEY)
+        return self._state
+
+    def last_date(self):
+        """取り込み済みの最終開催日(未取り込みなら None)。"""
+        state = self.state()
+        return None if state.empty else state['最終出走日'].max()
+
+    def history(self, until=None):
+        """(rider_id, 日付) ごとの通算成績。until を渡すとその日を含む月までのパーティションだけ読む。"""
+        months = self.months()
+        if until is not None:
+            months = [m for m in months if m <= pd.Timestamp(until).strftime('%Y%m')]
+        frames = [pd.read_pickle(self._partition_path(m)) for m in months]
+        if not frames:
+            return pd.DataFrame(columns=[KEY, '日付'] + COUNT_COLS)
+        return pd.concat(frames, ignore_index=True)
+
+    # ---------------- 取り込み ----------------
+    def fold(self, card):
+        """
+        出走表(着順つき)のうち未取り込みのレースを足し込み、取り込んだ行数を返す。
+        取り込み済みの最終開催日より前のレースが来たら、過去の通算成績が変わってしまうので ValueError。
+        """
+        race_ids = race_ids_of(card)
+        # manifest は大きいので Series.isin ではなく set の参照で判定する
+        is_new = np.fromiter((r not in self._done for r in race_ids), dtype=bool, count=len(race_ids))
+        new = card[is_new]
+        if new.empty:
+            return 0
+
+        daily = daily_counts(new)
+        last = self.last_date()
+        if last is not None and daily['日付'].min() < last:
+            raise ValueError(
+                f'取り込み済みの最終開催日 {last:%Y-%m-%d} より前のレースがあります'
+                f'({daily["日付"].min():%Y-%m-%d})。rebuild() で作り直してください。'
+            )
+
+        # 既存の通算成績に、日付順の累積を足す
+        state = self.state()
+        base = state.reindex(daily[KEY])[COUNT_COLS].fillna(0).astype(int).to_numpy()
+        cum = daily.groupby(KEY)[COUNT_COLS].cumsum().to_numpy() + base
+        rows = daily[[KEY, '日付']].copy()
+        rows[COUNT_COLS] = cum
+
+        # 変わった月のパーティションだけ書き直す(同じ日を2回に分けて取り込んだ場合は後の行で置き換える)
+        month = rows['日付'].dt.strftime('%Y%m')
+        for m, part in rows.groupby(month):
+            path = self._partition_path(m)
+            if os.path.exists(path):
+                old = pd.read_pickle(path)
+                keys = pd.MultiIndex.from_frame(part[[KEY, '日付']])
+                old = old[~pd.MultiIndex.from_frame(old[[KEY, '日付']]).isin(keys)]
+                part = pd.concat([old, part], ignore_index=True)
+            self._write(part.sort_values(['日付', KEY], kind='mergesort').reset_index(drop=True), path)
+
+        latest = rows.groupby(KEY).tail(1).set_index(KEY)
+        latest = latest[COUNT_COLS].assign(最終出走日=latest['日付'])
+        state = pd.concat([state[~state.index.isin(latest.index)], latest])
+        self._write(state, self.state_path)
+        self._state = state
+
+        with open(self.manifest_path, 'a', encoding='utf-8') as f:
+            f.write(''.join(r + '\n' for r in race_ids[is_new].unique()))
+            f.flush()
+            os.fsync(f.fileno())
+        self._done.update(race_ids)
+        return len(new)
+
+    def rebuild(self, card):
+        """保存先を空にして、card 全体から作り直す。"""
+        shutil.rmtree(self.root, ignore_errors=True)
+        self.__init__(self.root)
+        return self.fold(card)
+
+    # ---------------- 参照 ----------------
+    def asof(self, ids, date):
+        """date より前の出走だけで数えた通算成績を ids(rider_id)の順に返す(出走が無ければ0)。"""
+        date = pd.Timestamp(date)
+        last = self.last_date()
+        if last is not None and date > last:
+            counts = self.state()[COUNT_COLS]
+        else:
+            hist = self.history(until=date)
+            hist = hist[hist['日付'] < date]
+            counts = hist.groupby(KEY).tail(1).set_index(KEY)[COUNT_COLS]
+        return counts.reindex(pd.Index(ids, name=KEY)).fillna(0).astype(int)
+
+    def asof_features(self, ids, date):
+        """asof() の成績を 累計出走数 / 累計勝率 / 累計2連対率 / 累計3連対率 にしたもの。"""
+        return rates(self.asof(ids, date))
+
+    def features(self, card):
+        """
+        出走表の各行について、そのレースの開催日より前の成績から作った特徴量を返す(行の並び・index は card と同じ)。
+        """
+        rows = pd.DataFrame({
+            KEY: rider_ids(card).to_numpy(),
+            '日付': race_dates(race_ids_of(card)),
+            '_pos': np.arange(len(card)),
+        }).sort_values('日付', kind='mergesort')
+
+        hist = self.history(until=rows['日付'].max() if len(rows) else None)
+        hist = hist.sort_values('日付', kind='mergesort')
+        hist['日付'] = pd.to_datetime(hist['日付'])
+        hist[COUNT_COLS] = hist[COUNT_COLS].astype(int)
+
+        merged = pd.merge_asof(
+            rows, hist, on='日付', by=KEY, direction='backward', allow_exact_matches=False
+        ).sort_values('_pos')
+        counts = merged[COUNT_COLS].fillna(0)
+        counts.index = card.index
+        return rates(counts)
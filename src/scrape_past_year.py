@@ -15,6 +15,9 @@ import importlib
 race_id_scrape = importlib.import_module("1_race_id_scrape")
 race_data_scrape = importlib.import_module("2_race_data_scrape")
 
+# レース結果ページの同時取得数（アクセス間隔そのものは kdreams_http のレート制御で決まる）
+MAX_WORKERS = 8
+
 # main関数
 if __name__ == '__main__':
     # 過去13ヶ月〜24ヶ月分の全レースIDを格納するリスト
@@ -37,7 +40,7 @@ if __name__ == '__main__':
         
         print(f"\n>> {month_to_scrape} のデータを取得中...")
         
-        monthly_ids = race_id_scrape(month_to_scrape)
+        monthly_ids = race_id_scrape.race_id_scrape(month_to_scrape)
         all_race_ids.extend(monthly_ids)
         
         print(f"{month_to_scrape} の処理が完了しました。")
@@ -46,8 +49,9 @@ if __name__ == '__main__':
     print(f"合計 {len(all_race_ids)} 件のレースIDを取得しました。")
 
     # 取得したIDを元に、出走表・レース情報・払戻金データを取得
-    # race_data_scrape関数は、提示されたコードと同じものを使用
-    race_data = race_data_scrape(all_race_ids)
+    # race_data_scrape関数は、提示されたコードと同じものを使用（並列取得）
+    # 1年分の取得は長いので、1レースずつ race_store_PAST/ へ書き出しながら進める（再実行で続きから）
+    race_data = race_data_scrape.race_data_scrape(all_race_ids, max_workers=MAX_WORKERS, store_dir='race_store_PAST')
     
     # 結合用に、一時的なファイル名で保存
     pd.to_pickle(race_data[0], 'race_info_PAST.pkl')
@@ -0,0 +1,82 @@
+"""
+settle_races.py
+----------------
+結果が確定した当日のレースを、過去データの保存先(data/history。history_store.py)に足し込む。
+
+過去データは月次の 5_combine_data.py でしか増えないので、kekka.bat の最後に毎日回す
+build_production_models.py --incremental は、その間ずっと同じデータで学習し直していた。
+ここでは朝の予想に使った出走表・レース情報(today_race_card3.pkl / today_race_info2.pkl。
+3_back_sabun / 4_def_line_kyoudo を通した形)に、レース結果ページの着順を付けて、払戻といっしょに保存先へ入れる。
+着順が1つも付かなかったレース(中止・未確定)は入れない。
+
+    python src/settle_races.py [--history data/history]
+"""
+import argparse
+import importlib
+
+import pandas as pd
+
+from history_store import DEFAULT_ROOT, HistoryStore
+
+race_data_scrape = importlib.import_module('2_race_data_scrape')
+
+TODAY_CARD_PATH = 'today_race_card3.pkl'
+TODAY_INFO_PATH = 'today_race_info2.pkl'
+
+
+def _with_race_id(df):
+    """race_id を文字列の列にしたコピー(index に入っている形にも対応する)。"""
+    if 'race_id' not in df.columns:
+        df = df.reset_index().rename(columns={'index': 'race_id'})
+    df = df.reset_index(drop=True)
+    df['race_id'] = df['race_id'].astype(str)
+    return df
+
+
+def settle(card, info, entries, returns):
+    """
+    card / info(当日の出走表・レース情報)に entries(レース結果ページの出走表)の着順を付け、
+    着順の確定したレースの (card, info, returns) を返す。
+    """
+    card, info, entries, returns = map(_with_race_id, (card, info, entries, returns))
+    ranks = entries[['race_id', '車 番', '着 順']].copy()
+    ranks['_車番'] = pd.to_numeric(ranks.pop('車 番'), errors='coerce')
+    card['_車番'] = pd.to_numeric(card['車 番'], errors='coerce')
+    card = card.drop(columns=['着 順'], errors='ignore').merge(ranks, on=['race_id', '_車番'], how='left')
+    card = card.drop(columns=['_車番'])
+
+    settled = card.loc[pd.to_numeric(card['着 順'], errors='coerce').notna(), 'race_id'].unique()
+    return (card[card['race_id'].isin(settled)],
+            info[info['race_id'].isin(settled)],
+            returns[returns['race_id'].isin(settled)])
+
+
+def main(history_dir=DEFAULT_ROOT):
+    card = _with_race_id(pd.read_pickle(TODAY_CARD_PATH))
+    info = _with_race_id(pd.read_pickle(TODAY_INFO_PATH))
+    race_ids = info['race_id'].unique().tolist()
+
+    print(f'{len(race_ids)} レースの結果を取得します...')
+    try:
+        _, entries, returns = race_data_scrape.race_data_scrape(race_ids)
+    except ValueError:
+        # 1レースも解析できなかった(pd.concat する結果が無い)
+        print('レース結果を取得できませんでした。保存先は更新しません。')
+        return
+
+    card, info, returns = settle(card, info, entries, returns)
+    if card.empty:
+        print('着順の確定したレースがありません。保存先は更新しません。')
+        return
+
+    store = HistoryStore(history_dir)
+    for table, df in (('card', card), ('info', info), ('return', returns)):
+        store.append(table, df)
+    print(f"{card['race_id'].nunique()} レースを {history_dir} に追加しました。")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--history', default=DEFAULT_ROOT, help='過去データの保存先')
+    args = parser.parse_args()
+    main(args.history)
@@ -8,6 +8,8 @@ from datetime import datetime, timedelta
 import calendar
 import sys
 import importlib
+
+import kdreams_http
 # from race_data_scrape import race_data_scrape
 # from back_sabun import back_sabun, bankcho
 # from def_line_kyoudo import line_kyoudo
@@ -17,13 +19,12 @@ race_data_scrape = importlib.import_module("2_race_data_scrape")
 back_sabun = importlib.import_module("3_back_sabun")
 bankcho = importlib.import_module("3_back_sabun")
 line_kyoudo = importlib.import_module("4_def_line_kyoudo")
+fetch_soup = race_id_scrape.fetch_soup
 
 def race_id_scrape(kaisai_nengetu) :
     
     ul1 = "https://keirin.kdreams.jp/gamboo/schedule/search/" + kaisai_nengetu
-    res = requests.get(ul1)
-    res.encoding = ['EUC-JP']
-    soup = BeautifulSoup(res.text, 'html.parser')
+    soup = BeautifulSoup(kdreams_http.fetch_text(ul1), 'html.parser')
     kaisai_sches = soup.find_all('td',attrs={'class':'kaisai'}) 
     nen = kaisai_nengetu[0:4]
     gatu = kaisai_nengetu[5:7]
@@ -63,9 +64,9 @@ def race_id_scrape(kaisai_nengetu) :
         race_url = race_id_url + race_id_1 +"/"+race_id_2+"/"+race_id_3
         
         # -----------------------htmlの取得-------------------------------
-        race_id_res = requests.get(race_url)
-        race_id_res.encoding = ['EUC-JP']
-        race_id_soup = BeautifulSoup(race_id_res.text, 'html.parser')
+        race_id_soup = fetch_soup(race_url)
+        if race_id_soup is None:
+            continue
         
         # -----------------------開催日数の所得------------------------------
         day_len = len(race_id_soup.find_all('span',attrs={'class':'day'}))
@@ -80,7 +81,6 @@ def race_id_scrape(kaisai_nengetu) :
             date_list = ''.join(date_list)
             kaisai_lists.append(date_list) 
     
-        sleep(1)        
     kaisai_lists.sort()    
     
     # -----------------------------月始から月末までを抜き取る ----------------
@@ -111,11 +111,10 @@ def race_id_scrape(kaisai_nengetu) :
         race_url = race_id_url + race_id_1 +"/"+race_id_2+"/"+race_id_3
         
         # -----------------------htmlの取得-------------------------------
-        race_id_res = requests.get(race_url)
-        race_id_res.encoding = ['EUC-JP']
-        race_id_soup = BeautifulSoup(race_id_res.text, 'html.parser')
-        
-        sleep(1)
+        race_id_soup = fetch_soup(race_url)
+        if race_id_soup is None:
+            print(f"{race_id_2} のページを取得できませんでした(一時的なエラー)")
+            continue
         
         #------------------------レース数の取得----------------------------
         try:
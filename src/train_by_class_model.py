@@ -5,6 +5,12 @@ import sys
 import io
 import numpy as np
 
+from dtype_plan import compact
+from feature_builder import (
+    CUMULATIVE_FEATS, PYCARET_CATEGORICAL_FEATS, detect_race_class, load_or_build, prepare_pycaret_frame,
+)
+from native_class_model import export_model
+
 # --- 【新規追加】出力を画面とファイルの両方に同時に書き出すクラス ---
 class Logger(object):
     def __init__(self, filename="model_training_debug.log"):
@@ -30,43 +36,34 @@ sys.stderr = sys.stdout  # エラーログも同じファイルにまとめる
 # =====================================================================
 
 # --- 1. データの読み込みと結合 ---
-print("データを読み込んでいます...")
-df_shussou = pd.read_pickle('race_card3_cumulative_ready.pkl')
-df_raceinfo = pd.read_pickle('race_info2_202106-202606.pkl') 
+CARD_PATH = 'race_card3_cumulative_ready.pkl'
+INFO_PATH = 'race_info2_202106-202606.pkl'
 
-df_shussou.reset_index(inplace=True)
-df_raceinfo.reset_index(inplace=True)
 
-df_all = pd.merge(df_shussou, df_raceinfo, on='index', how='left')
-print(f"全データ結合後のShape: {df_all.shape}")
+def build_training_frame():
+    print("データを読み込んでいます...")
+    # 文字列列は category、数値列は収まる範囲で小さい型にしてから結合する(dtype_plan.py)
+    df_shussou = compact(pd.read_pickle(CARD_PATH), '出走表')
+    df_raceinfo = compact(pd.read_pickle(INFO_PATH), 'レース情報')
 
-# --- 2. 共通データの前処理 ---
+    df_shussou.reset_index(inplace=True)
+    df_raceinfo.reset_index(inplace=True)
 
-# ★追加: 「開始時間」から「時(Hour)」を抽出して新しい列「発走時」を作成 (例: "15:40" -> 15)
-df_all['発走時'] = df_all['開始時間'].apply(lambda x: int(str(x).split(':')[0]) if pd.notna(x) and ':' in str(x) else 0)
+    df = pd.merge(df_shussou, df_raceinfo, on='index', how='left')
+    print(f"全データ結合後のShape: {df.shape}")
 
-df_all.columns = df_all.columns.str.strip().str.replace(' ', '_').str.replace(' ', '_')
+    # --- 2. 共通データの前処理 ---
+    # 発走時の追加・列名のクリーニング・数値化（累積特徴量も数値になる）・欠損値補正は t_race.py と共通（feature_builder.py 参照）
+    return compact(prepare_pycaret_frame(df), '学習データ')
 
-categorical_features = ['枠_番', '車_番', '級_班', '脚_質', '期別', '競輪場', 'グレード', '天気', 'レース番号','レースタイトル', '開催番号', '強度', '強度２', '強度３', 'ライン構成', '1周']
 
-# ★【追加】累積特徴量の定義
-cumulative_features = ['累計勝率', '累計2連対率', '累計3連対率', '累計出走数']
+# 入力ファイルが前回と同じなら、前処理済みのデータをキャッシュから読む（モデルの設定だけ変えて学習し直すとき）
+df_all = load_or_build([CARD_PATH, INFO_PATH], 'pycaret_train', build_training_frame)
 
-# ★【変更】累積特徴量も数値変換させたいので、除外リスト（exclude_from_numeric_conversion）に「絶対に含めない」ようにします
-# （categorical_features等に累積特徴量は入っていないため、これで自動的に数値変換処理が実行されます）
-exclude_from_numeric_conversion = categorical_features + ['index', '総_評', 'レース名', '開催日', '開始時間', '予_想', '選手名']
+categorical_features = PYCARET_CATEGORICAL_FEATS
 
-# 数値化 (これにより「発走時」や「各種累積特徴量」も正常に数値化されます)
-for col in df_all.columns:
-    if col not in exclude_from_numeric_conversion:
-        df_all[col] = pd.to_numeric(df_all[col], errors='coerce')
-        
-# 欠損値補正
-numeric_cols = df_all.select_dtypes(include=['number']).columns
-df_all[numeric_cols] = df_all[numeric_cols].fillna(0)
-
-object_cols = df_all.select_dtypes(include=['object']).columns
-df_all[object_cols] = df_all[object_cols].fillna('unknown')
+# ★【追加】累積特徴量の定義
+cumulative_features = CUMULATIVE_FEATS
 
 # ★【追加】PyCaretのsetupに渡す数値特徴量のリストを定義（発走時 ＋ 累積特徴量）
 numeric_features_for_pycaret = cumulative_features + ['発走時']
@@ -80,26 +77,7 @@ columns_to_drop = ['index' , '予_想', '総_評', '着_順', '選手名', 'レ
 df_all = df_all.drop(columns=columns_to_drop, errors='ignore')
 
 
-# --- 3. レース種別（クラス）の判定関数と分割 【判定漏れ対策・強化版】 ---
-def detect_race_class(row):
-    kyu_han = str(row['級_班']).strip().upper()
-    race_title = str(row['レースタイトル']) if 'レースタイトル' in row else ''
-    
-    # ガールズ判定
-    if 'L' in kyu_han or 'ガールズ' in race_title:
-        return 'girls'
-    # チャレンジ判定（A3班、またはタイトルに「チャレンジ」「チ」が含まれる）
-    elif 'チャレンジ' in race_title or 'チ' in race_title or 'A3' in kyu_han:
-        return 'challenge'
-    # A級判定（1班・2班）
-    elif 'A' in kyu_han:
-        return 'a_class'
-    # S級判定
-    elif 'S' in kyu_han:
-        return 's_class'
-    else:
-        return 'other'
-
+# --- 3. レース種別（クラス）の判定と分割（判定は feature_builder.detect_race_class） ---
 # クラス列を追加
 df_all['race_class'] = df_all.apply(detect_race_class, axis=1)
 print("\n--- 【調査ログ】レース種別ごとのデータ件数 ---")
@@ -169,6 +147,13 @@ for r_class in target_classes:
     # モデルと列順序の保存
     model_name = f'keirin_model_3rd_{r_class}'
     save_model(final_model, model_name)
+
+    # t_race.py が PyCaret 無しで予測できるように書き出す（native_class_model.py。書き出せなければ PyCaret で予測される）
+    try:
+        diff = export_model(final_model, model_name)
+        print(f"[{r_class}] PyCaret 無しの予測用に書き出しました（元のモデルとの最大差 {diff:.3g}）")
+    except ValueError as e:
+        print(f"[{r_class}] ⚠️PyCaret 無しの予測用には書き出せませんでした: {e}")
     
     correct_columns = data_train.drop('target', axis=1).columns.tolist()
     pd.to_pickle(correct_columns, f'model_columns_3rd_{r_class}.pkl')
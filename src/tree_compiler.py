@@ -0,0 +1,393 @@
+"""
+tree_compiler.py
+-----------------
+学習済みの勾配ブースティング木(sklearn の HistGradientBoostingClassifier / LightGBM の Booster)を、
+全部の木をつなげた連続した numpy 配列に書き直し、numpy だけでまとめて予測する。
+
+Stage1 / Stage2 やクラス別モデルをレース単位など少ない行数で呼ぶと、predict_proba の呼び出しごとの
+入力チェックやスレッドの立ち上げの方が木をたどる時間より長くなりやすい。ここでは
+
+  feature / threshold      : 分岐に使う列番号としきい値(葉は feature = -1)
+  left / right             : 子ノードの通し番号(全部の木をつなげた配列の中での位置)
+  value                    : 葉の値
+  default_left / missing   : 欠損(と LightGBM のゼロ)をどちらに送るか
+  is_cat / bitset          : カテゴリ分岐(HGB のみ。左に送るカテゴリと既知のカテゴリのビット列)
+  roots                    : 各木の根
+  pre_*                    : HGB がカテゴリ列に前もってかける OrdinalEncoder(列の並べ替えと 値 -> 番号 の表)
+
+に並べ、(行, 木) の組を全部まとめて1段ずつ、一番深い木の深さの回数だけ下ろしていく。
+葉の値は元の実装と同じく初期値から木の順に1本ずつ足すので、予測確率は predict_proba とビット単位で一致する。
+速いのは1回に百行程度までで、数千行をまとめて予測するなら predict_proba の方が速い(bench で確かめる)。
+
+  - HGB: 2値分類のみ
+  - LightGBM: 2値分類(binary)の数値分岐のみ(カテゴリ分岐・線形木は対象外)
+  - model_blend.BlendedClassifier は中の2つを別々に書き直して同じ重みで混ぜる
+
+    python src/tree_compiler.py bench [--version VERSION] [--native native_models] [--rows 3000]
+"""
+import argparse
+import os
+import time
+import warnings
+
+import numpy as np
+from scipy.special import expit
+
+MISS_NAN, MISS_ZERO, MISS_NONE = 0, 1, 2
+# LightGBM がゼロとみなす幅(kZeroThreshold = 1e-35f)
+ZERO_THRESHOLD = float(np.float32(1e-35))
+
+ARRAY_FIELDS = ('feature', 'threshold', 'left', 'right', 'value', 'default_left', 'missing', 'is_cat',
+                'bitset', 'roots', 'cat_bitsets', 'known_bitsets', 'known_idx',
+                'pre_order', 'pre_cat_cols', 'pre_cat_values', 'pre_cat_offsets')
+
+
+class CompiledTrees:
+    """全部の木をつなげた配列と、それをたどる予測。link は 'logistic'(HGB)か 'sigmoid'(LightGBM)。"""
+
+    def __init__(self, arrays, baseline, link, scale=1.0, n_features=None):
+        for name in ARRAY_FIELDS:
+            setattr(self, name, np.ascontiguousarray(arrays[name]))
+        self.baseline = float(baseline)
+        self.link = link
+        self.scale = float(scale)
+        self.n_features = n_features
+        self.is_leaf = self.feature < 0
+        self.has_cat = bool(self.is_cat.any())
+        self.has_zero = bool((self.missing[~self.is_leaf] == MISS_ZERO).any())
+        # たどる側で使う形: 子は (右, 左) の順に交互に並べ、葉の列番号は 0 にしておく
+        self._children = np.empty(2 * len(self.left), dtype=np.int32)
+        self._children[0::2], self._children[1::2] = self.right, self.left
+        self._feature32 = np.where(self.is_leaf, 0, self.feature).astype(np.int32)
+        self._roots32 = self.roots.astype(np.int32)
+        # NaN をどちらに送るか(LightGBM の欠損を扱わない分岐では 0 として比べる)
+        self._nan_left = np.where((self.missing == MISS_NONE) & ~self.is_cat, 0.0 <= self.threshold,
+                                  self.default_left)
+        self.depth = self._depth()
+
+    def __len__(self):
+        return len(self.roots)
+
+    def _depth(self):
+        nodes, depth = self.roots, 0
+        while len(nodes):
+            nodes = nodes[~self.is_leaf[nodes]]
+            if len(nodes):
+                depth += 1
+            nodes = np.concatenate([self.left[nodes], self.right[nodes]])
+        return depth
+
+    # ---------------- 保存 ----------------
+    def save(self, path):
+        meta = np.array([self.baseline, self.scale, -1 if self.n_features is None else self.n_features])
+        np.savez(path, meta=meta, link=np.array(self.link), **{n: getattr(self, n) for n in ARRAY_FIELDS})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            baseline, scale, n_features = z['meta']
+            return cls({n: z[n] for n in ARRAY_FIELDS}, baseline, str(z['link']), scale,
+                       None if n_features < 0 else int(n_features))
+
+    # ---------------- 予測 ----------------
+    def preprocess(self, X):
+        """
+        HGB の OrdinalEncoder と同じく、カテゴリ列を先頭に並べて学習時のカテゴリの番号にする(無い値は NaN)。
+        LightGBM は予測の入力で |x| <= kZeroThreshold の値を 0 として読むので、同じく 0 にする。
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if self.link == 'sigmoid':
+            X = np.where(np.abs(X) <= ZERO_THRESHOLD, 0.0, X)
+        if not len(self.pre_order):
+            return np.ascontiguousarray(X)
+        X = X[:, self.pre_order]
+        for k, col in enumerate(self.pre_cat_cols):
+            cats = self.pre_cat_values[self.pre_cat_offsets[k]:self.pre_cat_offsets[k + 1]]
+            v = X[:, col]
+            pos = np.minimum(np.searchsorted(cats, v), max(len(cats) - 1, 0))
+            hit = cats[pos] == v if len(cats) else np.zeros(len(v), dtype=bool)
+            X[:, col] = np.where(hit, pos, np.nan)
+        return X
+
+    def leaf_values(self, X):
+        """(行数, 木の数) の各木の葉の値。"""
+        X = self.preprocess(X)
+        n, n_trees = len(X), len(self.roots)
+        flat_x = X.ravel()
+        idx = np.tile(self._roots32, n)
+        row_base = np.repeat(np.arange(n, dtype=np.int32) * X.shape[1], n_trees)
+        # 葉は自分自身を指すので、一番深い木の深さだけ全部の組を下ろせばよい(段ごとに組を絞り込まない方が速い)
+        for _ in range(self.depth):
+            fv = flat_x[row_base + self._feature32[idx]]
+            go_left = fv <= self.threshold[idx]
+            # 数値の比較と結果が変わる組(欠損・LightGBM のゼロ・カテゴリ分岐)だけ後から直す
+            nan = np.flatnonzero(np.isnan(fv))
+            if len(nan):
+                go_left[nan] = self._nan_left[idx[nan]]
+            if self.has_zero:
+                zero = np.flatnonzero(np.abs(fv) <= ZERO_THRESHOLD)
+                zero = zero[self.missing[idx[zero]] == MISS_ZERO]
+                go_left[zero] = self.default_left[idx[zero]]
+            if self.has_cat:
+                cat = np.flatnonzero(self.is_cat[idx])
+                if len(cat):
+                    node = idx[cat]
+                    in_left, missing = self._categorical(node, fv[cat])
+                    go_left[cat] = np.where(missing, self.default_left[node], in_left)
+            idx = self._children[2 * idx + go_left]
+        return self.value[idx].reshape(n, n_trees)
+
+    def _categorical(self, node, fv):
+        # HGB と同じ: NaN・負の値・学習時に無かったカテゴリは欠損扱い。値は uint8 に切り捨てて引く
+        bad = np.isnan(fv) | (fv < 0)
+        code = np.where(bad, 0, fv).astype(np.int64) & 255
+        word, bit = code >> 5, (code & 31).astype(np.uint32)
+        in_left = (self.cat_bitsets[self.bitset[node], word] >> bit) & 1
+        in_known = (self.known_bitsets[self.known_idx[self.feature[node]], word] >> bit) & 1
+        return in_left.astype(bool), bad | ((in_left == 0) & (in_known == 0))
+
+    def raw_predict(self, X):
+        # 初期値から木の順に1本ずつ足す(cumsum は左から順に足すので、元の実装の += と同じ丸めになる)
+        values = self.leaf_values(X)
+        acc = np.empty((len(values), values.shape[1] + 1))
+        acc[:, 0] = self.baseline
+        acc[:, 1:] = values
+        return np.cumsum(acc, axis=1)[:, -1]
+
+    def predict_proba(self, X):
+        raw = self.raw_predict(X)
+        proba = np.empty((len(raw), 2))
+        # HGB は expit(raw)、LightGBM は 1 / (1 + exp(-sigmoid * raw))。どちらも expit で同じ値になる
+        proba[:, 1] = expit(raw if self.link == 'logistic' else self.scale * raw)
+        proba[:, 0] = 1 - proba[:, 1]
+        return proba
+
+
+class CompiledBlend:
+    """model_blend.BlendedClassifier を書き直したもの。"""
+
+    def __init__(self, base, tail, weight):
+        self.base = base
+        self.tail = tail
+        self.weight = weight
+
+    def predict_proba(self, X):
+        return (1 - self.weight) * self.base.predict_proba(X) + self.weight * self.tail.predict_proba(X)
+
+
+# ---------------------------------------------------------------------------
+# 書き直し
+# ---------------------------------------------------------------------------
+def _concat(trees, cat_bitsets, known_bitsets, known_idx):
+    offsets = np.cumsum([0] + [len(t['feature']) for t in trees[:-1]])
+    arrays = {name: np.concatenate([t[name] for t in trees]) for name in
+              ('feature', 'threshold', 'value', 'default_left', 'missing', 'is_cat', 'bitset')}
+    for name in ('left', 'right'):
+        arrays[name] = np.concatenate([t[name] + off for t, off in zip(trees, offsets)]).astype(np.int64)
+    leaf = arrays['feature'] < 0
+    node_ids = np.arange(len(leaf))
+    # 葉は自分自身を指させておく(たどる側で範囲外を読まないように)
+    arrays['left'][leaf] = node_ids[leaf]
+    arrays['right'][leaf] = node_ids[leaf]
+    arrays['feature'] = arrays['feature'].astype(np.int64)
+    arrays['roots'] = offsets.astype(np.int64)
+    arrays['cat_bitsets'] = cat_bitsets
+    arrays['known_bitsets'] = known_bitsets
+    arrays['known_idx'] = known_idx
+    for name in ('pre_order', 'pre_cat_cols', 'pre_cat_offsets'):
+        arrays[name] = np.zeros(0, dtype=np.int64)
+    arrays['pre_cat_values'] = np.zeros(0)
+    return arrays
+
+
+def _hgb_preprocessing(model, arrays):
+    """HGB の _preprocessor(カテゴリ列の OrdinalEncoder を先頭に置く ColumnTransformer)を配列にする。"""
+    pre = model._preprocessor
+    if pre is None:
+        return
+    is_cat = np.asarray(model.is_categorical_, dtype=bool)
+    cat_cols = np.flatnonzero(is_cat)
+    arrays['pre_order'] = np.concatenate([cat_cols, np.flatnonzero(~is_cat)]).astype(np.int64)
+    start = pre.output_indices_['encoder'].start
+    arrays['pre_cat_cols'] = np.arange(start, start + len(cat_cols), dtype=np.int64)
+    categories = []
+    for cats in pre.named_transformers_['encoder'].categories_:
+        cats = np.asarray(cats, dtype=np.float64)
+        categories.append(cats[~np.isnan(cats)])
+    arrays['pre_cat_values'] = np.concatenate(categories) if categories else np.zeros(0)
+    arrays['pre_cat_offsets'] = np.cumsum([0] + [len(c) for c in categories]).astype(np.int64)
+
+
+def compile_hgb(model):
+    """HistGradientBoostingClassifier(2値分類)を書き直す。"""
+    if model.n_trees_per_iteration_ != 1:
+        raise ValueError('2値分類の HGB だけに対応しています')
+    known_bitsets, f_idx_map = model._bin_mapper.make_known_categories_bitsets()
+    trees, bitsets, n_bitsets = [], [], 0
+    for (predictor,) in model._predictors:
+        nodes = predictor.nodes
+        leaf = nodes['is_leaf'].astype(bool)
+        trees.append({
+            'feature': np.where(leaf, -1, nodes['feature_idx']),
+            'threshold': nodes['num_threshold'].astype(np.float64),
+            'left': nodes['left'].astype(np.int64),
+            'right': nodes['right'].astype(np.int64),
+            'value': np.where(leaf, nodes['value'], 0.0),
+            'default_left': nodes['missing_go_to_left'].astype(bool),
+            'missing': np.full(len(nodes), MISS_NAN, dtype=np.int8),
+            'is_cat': nodes['is_categorical'].astype(bool) & ~leaf,
+            'bitset': nodes['bitset_idx'].astype(np.int64) + n_bitsets,
+        })
+        raw_bitsets = predictor.raw_left_cat_bitsets
+        bitsets.append(raw_bitsets)
+        n_bitsets += len(raw_bitsets)
+    cat_bitsets = np.concatenate(bitsets) if n_bitsets else np.zeros((1, 8), dtype=np.uint32)
+    if not len(known_bitsets):
+        known_bitsets = np.zeros((1, 8), dtype=np.uint32)
+    arrays = _concat(trees, cat_bitsets.astype(np.uint32), known_bitsets.astype(np.uint32),
+                     np.asarray(f_idx_map, dtype=np.int64))
+    _hgb_preprocessing(model, arrays)
+    baseline = np.asarray(model._baseline_prediction).ravel()[0]
+    return CompiledTrees(arrays, baseline, 'logistic', n_features=model.n_features_in_)
+
+
+def _lgb_tree(structure):
+    rows = []
+
+    def visit(node):
+        i = len(rows)
+        rows.append(None)
+        if 'leaf_value' in node:
+            rows[i] = (-1, 0.0, -1, -1, node['leaf_value'], False, MISS_NAN)
+            return i
+        if node.get('decision_type') != '<=':
+            raise ValueError('LightGBM のカテゴリ分岐には対応していません')
+        left = visit(node['left_child'])
+        right = visit(node['right_child'])
+        missing = {'NaN': MISS_NAN, 'Zero': MISS_ZERO, 'None': MISS_NONE}[node['missing_type']]
+        rows[i] = (node['split_feature'], float(node['threshold']), left, right, 0.0, bool(node['default_left']),
+                   missing)
+        return i
+
+    visit(structure)
+    cols = list(zip(*rows))
+    return {
+        'feature': np.array(cols[0], dtype=np.int64),
+        'threshold': np.array(cols[1], dtype=np.float64),
+        'left': np.array(cols[2], dtype=np.int64),
+        'right': np.array(cols[3], dtype=np.int64),
+        'value': np.array(cols[4], dtype=np.float64),
+        'default_left': np.array(cols[5], dtype=bool),
+        'missing': np.array(cols[6], dtype=np.int8),
+        'is_cat': np.zeros(len(rows), dtype=bool),
+        'bitset': np.zeros(len(rows), dtype=np.int64),
+    }
+
+
+def compile_lightgbm(booster):
+    """LightGBM の Booster(2値分類)を書き直す。predict と同じく best_iteration があればそこまで。"""
+    dump = booster.dump_model()
+    objective = dump.get('objective', '').split()
+    if not objective or objective[0] != 'binary':
+        raise ValueError(f"2値分類の LightGBM だけに対応しています: {dump.get('objective')}")
+    scale = next((float(o.split(':')[1]) for o in objective[1:] if o.startswith('sigmoid:')), 1.0)
+    if any(t.get('is_linear') for t in dump['tree_info']):
+        raise ValueError('LightGBM の線形木には対応していません')
+    trees = [_lgb_tree(t['tree_structure']) for t in dump['tree_info']]
+    empty = np.zeros((1, 8), dtype=np.uint32)
+    arrays = _concat(trees, empty, empty, np.zeros(dump['max_feature_idx'] + 1, dtype=np.int64))
+    return CompiledTrees(arrays, 0.0, 'sigmoid', scale, n_features=dump['max_feature_idx'] + 1)
+
+
+def compile_model(model):
+    """HGB / LightGBM(Booster・LGBMClassifier)/ BlendedClassifier / NativeClassModel の推定器を書き直す。"""
+    from model_blend import BlendedClassifier
+    if isinstance(model, BlendedClassifier):
+        return CompiledBlend(compile_model(model.base), compile_model(model.tail), model.weight)
+    booster = getattr(model, '_booster', None) or getattr(model, 'booster_', None)
+    if booster is not None:
+        return compile_lightgbm(booster)
+    if hasattr(model, 'dump_model'):
+        return compile_lightgbm(model)
+    if hasattr(model, '_predictors'):
+        return compile_hgb(model)
+    raise ValueError(f'書き直せないモデルです: {type(model).__name__}')
+
+
+# ---------------------------------------------------------------------------
+# ベンチマーク
+# ---------------------------------------------------------------------------
+def _first_trees(compiled):
+    return _first_trees(compiled.base) if isinstance(compiled, CompiledBlend) else compiled
+
+
+def sample_rows(compiled, n_rows, seed=0):
+    """分岐のしきい値の前後・欠損・カテゴリ値を混ぜた入力(どの枝も通るように)。"""
+    trees = _first_trees(compiled)
+    rng = np.random.default_rng(seed)
+    n_features = trees.n_features or int(trees.feature.max()) + 1
+    X = rng.normal(size=(n_rows, n_features))
+    split = ~trees.is_leaf
+    for f in range(n_features):
+        th = trees.threshold[split & (trees.feature == f) & ~trees.is_cat]
+        th = th[np.isfinite(th)]
+        if len(th):
+            X[:, f] = rng.choice(th, n_rows) + rng.choice([-1e-9, 0.0, 1e-9], n_rows)
+        if (split & (trees.feature == f) & trees.is_cat).any():
+            X[:, f] = rng.integers(-1, 40, n_rows)
+    X[rng.random(X.shape) < 0.03] = np.nan
+    return X
+
+
+def bench(name, model, X, repeat=20):
+    """predict_proba と書き直したものの予測が一致するか確かめ、1回あたりの時間(ミリ秒)を返す。"""
+    compiled = compile_model(model)
+    predict = model.predict if hasattr(model, 'dump_model') else lambda a: model.predict_proba(a)[:, 1]
+    expected = predict(X)
+    got = compiled.predict_proba(X)[:, 1]
+    identical = np.array_equal(expected, got)
+
+    def timeit(f):
+        f(X)
+        t = time.perf_counter()
+        for _ in range(repeat):
+            f(X)
+        return (time.perf_counter() - t) / repeat * 1000
+
+    t_model, t_compiled = timeit(predict), timeit(compiled.predict_proba)
+    mark = '一致' if identical else f'不一致(最大差 {np.nanmax(np.abs(expected - got)):.3g})'
+    print(f'{name:<36} {len(X):>6}行  predict_proba {t_model:8.2f}ms  配列版 {t_compiled:8.2f}ms  {mark}')
+    return identical, t_model, t_compiled
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_bench = sub.add_parser('bench', help='Stage1 / Stage2 とクラス別モデルを書き直し、predict_proba と比べる')
+    p_bench.add_argument('--models', default='models', help='model_registry の置き場')
+    p_bench.add_argument('--version', default=None, help='省略時は CURRENT')
+    p_bench.add_argument('--native', default='native_models', help='native_class_model.py の書き出し先')
+    p_bench.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 3000])
+    p_bench.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    from model_registry import ModelRegistry
+    from native_class_model import NativeClassModel
+
+    # 列名の無い配列で predict_proba を呼ぶので、列名の警告は出さない
+    warnings.filterwarnings('ignore', message='X does not have valid feature names')
+
+    targets = []
+    if os.path.isdir(args.models):
+        models = ModelRegistry(args.models).open(args.version)
+        targets += [(f"{models['version']}/{n}", models[n]) for n in ('stage1_model', 'stage2_model')]
+    if os.path.isdir(args.native):
+        for f in sorted(os.listdir(args.native)):
+            if f.endswith('.native.pkl'):
+                native = NativeClassModel.load(os.path.join(args.native, f))
+                if native._booster is not None:
+                    targets.append((f[:-len('.native.pkl')], native._booster))
+    for name, model in targets:
+        compiled = compile_model(model)
+        for n_rows in args.rows:
+            bench(name, model, sample_rows(compiled, n_rows), args.repeat)
@@ -0,0 +1,35 @@
+"""
+velodrome.py
+-------------
+競輪場ごとの属性表(data/velodromes.csv)を読むモジュール。
+
+  競輪場 : 「競輪」を除いた場名(race_info の 競輪場 列の末尾2文字を落としたもの)
+  1周    : バンク周長(文字列。'333' / '400' / '500')
+
+1周 の値は従来 bankcho に直書きしていたリストと同じ(前橋も従来どおり '333')。
+みなし直線やカントなど、競輪場の属性を特徴量に足すときはこの表に列を追加する。
+"""
+import os
+from functools import lru_cache
+
+import pandas as pd
+
+VELODROME_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "data", "velodromes.csv")
+
+# 表に無い競輪場の周長(従来と同じ)
+DEFAULT_BANK = "400"
+
+
+@lru_cache(maxsize=None)
+def _load(path):
+    return pd.read_csv(path, dtype=str, encoding="utf-8").set_index("競輪場")
+
+
+def load_velodromes(path=VELODROME_CSV):
+    """競輪場(「競輪」なし)を index にした属性表を返す。"""
+    return _load(os.path.normpath(path)).copy()
+
+
+def venue_name(stadium):
+    """'前橋競輪' -> '前橋'。race_info の 競輪場 列(Series)をそのまま渡せる。"""
+    return stadium.str[:-2]
@@ -34,7 +34,7 @@ echo "8_cumulative_ready.pyの入力ファイル名称を確認してくださ
 REM pause
 
 echo "6つ目のスクリプトを実行します..."
-python "C:\Users\wolfs\Desktop\keirin-ai\src\8_cumulative_ready.py"
+python "C:\Users\wolfs\Desktop\keirin-ai\src\8_cumulative_ready.py" --ready
 
 echo "7つ目のスクリプトを実行します..."
 python "C:\Users\wolfs\Desktop\keirin-ai\src\9_new_player.py"